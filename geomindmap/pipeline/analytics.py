@@ -0,0 +1,221 @@
+import os
+import json
+import glob
+import numpy as np
+import runlog
+"""
+analytics.py
+------------
+This module merges the process info of all models into columnar tables and computes
+the cross-model comparison statistics.
+Sources:
+- data/<model>/info/*.json: range files (pic10_to_pic162.json, ...), merged.json, acc.json,
+  process_info_summary.json, response_info.json, response_token.json (pictures may repeat)
+- data/<model>/info/*.jsonl: run logs of batches still in progress
+- data/<model>/<pic>/step_acc.json and pattern.json: per-step accuracy and reasoning pattern
+- data/<model>/<pic>/stream_metrics.json: time to first (reasoning) token and tokens/s of the reasoning call
+Records are deduplicated per (model, picture). Parsed files are cached by mtime/size,
+so an update after new pictures finish only re-reads the changed files.
+
+Functions:
+- build_table(data_dir, cache_path): columnar table {column: numpy array}, one row per (model, picture)
+- compare(table): per-model statistics (accuracy vs tokens vs time, pattern frequencies vs accuracy)
+- update(data_dir, output_path): incremental rebuild, save statistics to analytics.json
+
+analytics.json and analytics_cache.json are rebuilt after every finished picture and are
+not tracked by git (.gitignore); run this module to rebuild them.
+"""
+
+CACHE_PATH = "geomindmap/data/analytics_cache.json"
+OUTPUT_PATH = "geomindmap/data/analytics.json"
+
+NUMERIC_COLUMNS = [
+    "accuracy", "tokens_total", "time_total", "tokens_response", "tokens_reasoning", "time_response",
+    "n_steps", "steps_to_final", "n_bf", "n_df", "n_switch", "bf_ratio",
+    "ttft", "ttfr", "tokens_per_s",
+]
+# field names used by the older info files
+RENAME = {
+    "response_tokens": "tokens_response",
+    "response_token": "tokens_response",
+    "reasoning_tokens": "tokens_reasoning",
+    "response_time": "time_response",
+}
+# summary files are read first, range files of full runs override them
+SUMMARY_FILES = ["acc.json", "process_info_summary.json", "response_info.json", "response_token.json"]
+
+# parse an info file (json list or jsonl run log) into {picture: fields}
+def read_info(path):
+    if path.endswith(".jsonl"):
+        records = runlog.read_log(path)
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+    if not isinstance(records, list):
+        return {}
+    rows = {}
+    for r in records:
+        if "picture" not in r:
+            continue
+        row = {}
+        for key, value in r.items():
+            key = RENAME.get(key, key)
+            if key in NUMERIC_COLUMNS and value is not None:
+                row[key] = float(value)
+        rows[r["picture"]] = row
+    return rows
+
+# parse step_acc.json + pattern.json + stream_metrics.json of one picture
+def read_steps(pic_dir):
+    row = {}
+    step_path = os.path.join(pic_dir, "step_acc.json")
+    if os.path.exists(step_path):
+        with open(step_path, 'r', encoding='utf-8') as f:
+            acc = np.array([int(s.get("accuracy", 0)) for s in json.load(f)])
+        if acc.size:
+            row["n_steps"] = int(acc.size)
+            # first step from which the final accuracy is kept
+            differs = np.nonzero(acc != acc[-1])[0]
+            row["steps_to_final"] = int(differs[-1] + 2) if differs.size else 1
+            row["step_accuracy"] = acc.tolist()
+    pattern_path = os.path.join(pic_dir, "pattern.json")
+    if os.path.exists(pattern_path):
+        with open(pattern_path, 'r', encoding='utf-8') as f:
+            pattern = json.load(f)
+        if isinstance(pattern, dict):
+            n_bf = len(pattern.get("Breadth-First", []))
+            n_df = len(pattern.get("Depth-First", []))
+            row["n_bf"] = n_bf
+            row["n_df"] = n_df
+            row["n_switch"] = len(pattern.get("Breadth-Depth Switch", []))
+            row["bf_ratio"] = n_bf / (n_bf + n_df) if n_bf + n_df else None
+    metrics_path = os.path.join(pic_dir, "stream_metrics.json")
+    if os.path.exists(metrics_path):
+        with open(metrics_path, 'r', encoding='utf-8') as f:
+            metrics = json.load(f)
+        for key in ("ttft", "ttfr", "tokens_per_s"):
+            if metrics.get(key) is not None:
+                row[key] = float(metrics[key])
+    return row
+
+# return cached parse result if file is unchanged, otherwise parse and store
+def cached(cache, key, paths, parse):
+    stamp = [[os.path.getmtime(p), os.path.getsize(p)] if os.path.exists(p) else None for p in paths]
+    entry = cache.get(key)
+    if entry is not None and entry["stamp"] == stamp:
+        return entry["rows"], False
+    rows = parse()
+    cache[key] = {"stamp": stamp, "rows": rows}
+    return rows, True
+
+# list model directories (contain info/ or pic*/ outputs)
+def list_models(data_dir):
+    return sorted(
+        d for d in os.listdir(data_dir)
+        if os.path.isdir(os.path.join(data_dir, d))
+        and (os.path.isdir(os.path.join(data_dir, d, "info")) or glob.glob(os.path.join(data_dir, d, "pic*")))
+    )
+
+# merge all sources into a columnar table
+def build_table(data_dir="geomindmap/data/", cache_path=CACHE_PATH):
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    changed = 0
+    merged = {}
+
+    for model in list_models(data_dir):
+        info_dir = os.path.join(data_dir, model, "info")
+        info_files = [os.path.join(info_dir, n) for n in SUMMARY_FILES if os.path.exists(os.path.join(info_dir, n))]
+        range_files = [p for p in glob.glob(os.path.join(info_dir, "*.json")) if os.path.basename(p) not in SUMMARY_FILES]
+        range_files += glob.glob(os.path.join(info_dir, "*.jsonl"))
+        # later runs win: order range files by the run ID timestamp
+        info_files += sorted(range_files, key=runlog.run_order)
+
+        for path in info_files:
+            rows, is_new = cached(cache, path, [path], lambda: read_info(path))
+            changed += is_new
+            for pic_name, row in rows.items():
+                target = merged.setdefault((model, pic_name), {})
+                target.update(row)
+
+        for pic_dir in sorted(glob.glob(os.path.join(data_dir, model, "pic*"))):
+            paths = [os.path.join(pic_dir, n) for n in ("step_acc.json", "pattern.json", "stream_metrics.json")]
+            row, is_new = cached(cache, pic_dir, paths, lambda: read_steps(pic_dir))
+            changed += is_new
+            target = merged.setdefault((model, os.path.basename(pic_dir)), {})
+            target.update({k: v for k, v in row.items() if k != "step_accuracy"})
+            # final step accuracy if no info record exists
+            if "accuracy" not in target and row.get("step_accuracy"):
+                target["accuracy"] = float(row["step_accuracy"][-1])
+
+    if cache_path:
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+    print(f"Analytics table: {len(merged)} rows, {changed} source files re-read")
+
+    keys = sorted(merged)
+    table = {
+        "model": np.array([k[0] for k in keys]),
+        "picture": np.array([k[1] for k in keys]),
+    }
+    for col in NUMERIC_COLUMNS:
+        table[col] = np.array([merged[k].get(col, np.nan) for k in keys], dtype=float)
+    return table
+
+# pearson correlation ignoring nan
+def corr(a, b):
+    ok = ~np.isnan(a) & ~np.isnan(b)
+    if ok.sum() < 3 or a[ok].std() == 0 or b[ok].std() == 0:
+        return None
+    return round(float(np.corrcoef(a[ok], b[ok])[0, 1]), 4)
+
+# mean ignoring nan
+def mean(a):
+    a = a[~np.isnan(a)]
+    return round(float(a.mean()), 4) if a.size else None
+
+# model comparison statistics
+def compare(table):
+    stats = {}
+    for model in np.unique(table["model"]):
+        m = table["model"] == model
+        acc = table["accuracy"][m]
+        s = {
+            "pictures": int(m.sum()),
+            "mean": {col: mean(table[col][m]) for col in NUMERIC_COLUMNS},
+            "accuracy_distribution": {str(level): int((acc == level).sum()) for level in range(4)},
+            "corr_accuracy": {
+                col: corr(acc, table[col][m])
+                for col in ["tokens_total", "time_total", "tokens_response", "time_response", "n_steps", "n_switch", "bf_ratio"]
+            },
+            # pattern frequencies grouped by final accuracy level
+            "pattern_by_accuracy": {},
+        }
+        for level in range(4):
+            g = acc == level
+            if g.any():
+                s["pattern_by_accuracy"][str(level)] = {
+                    col: mean(table[col][m][g]) for col in ["n_bf", "n_df", "n_switch", "bf_ratio", "n_steps"]
+                }
+        # accuracy per 10k tokens and per minute
+        tokens = table["tokens_total"][m]
+        minutes = table["time_total"][m] / 60
+        s["accuracy_per_10k_tokens"] = mean(acc / np.where(tokens > 0, tokens, np.nan) * 1e4)
+        s["accuracy_per_minute"] = mean(acc / np.where(minutes > 0, minutes, np.nan))
+        stats[str(model)] = s
+    return stats
+
+# incremental update of analytics.json
+def update(data_dir="geomindmap/data/", output_path=OUTPUT_PATH, cache_path=CACHE_PATH):
+    table = build_table(data_dir, cache_path)
+    stats = compare(table)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, indent=4, ensure_ascii=False)
+    print(f"Analytics saved to {output_path}")
+    return table, stats
+
+
+if __name__ == "__main__":
+    update()
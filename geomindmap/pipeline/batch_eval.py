@@ -0,0 +1,236 @@
+import os
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import routing
+import reasoning
+import pattern
+"""
+batch_eval.py
+-------------
+This module runs the evaluation stages step_accuracy and detect_pattern (reasoning.py) for
+several pictures in one request, so the multi-kilobyte instruction prompt is sent once per
+batch instead of once per picture. The reasoning traces (and ground truths) of a batch go in
+one JSON object keyed by picture name, and the model answers with one JSON object with the
+same keys, each value in the unbatched output format. The answer is split back into each
+picture's step_acc.json / pattern.json. Pictures missing or malformed in the answer are
+evaluated again with the unbatched function.
+
+Validation: validate() evaluates pictures with existing unbatched labels in batches, writes
+the batched labels next to them (step_acc_batch.json, pattern_batch.json) and reports the
+agreement: per-step and final accuracy for step_acc, BF/DF agreement, Cohen's kappa and
+switch precision/recall for pattern (pattern.agreement).
+
+Usage (from repository root):
+    python geomindmap/pipeline/batch_eval.py --model claude --pics pic1 pic2 pic3 --validate
+
+Functions:
+- step_accuracy_batch(pics, model, batch_size, output_name): batched step_accuracy
+- detect_pattern_batch(pics, model, batch_size, output_name): batched detect_pattern
+- accuracy_agreement(data_dir, model, output_name): batched vs unbatched step accuracy
+- validate(pics, model, batch_size): batched vs unbatched labels of the same pictures
+"""
+
+GPS_PATH = "geomindmap/pictures/gps.json"
+DATA_DIR = "geomindmap/data/"
+BATCH_SIZE = int(os.getenv("GEOMINDMAP_EVAL_BATCH", "5"))
+# batches evaluated concurrently
+EVAL_WORKERS = 4
+# validate(): minimum agreement of batched with unbatched labels
+MIN_AGREEMENT = 0.85
+
+# appended to the unbatched instruction prompt
+batch_format = """
+    You will receive the texts of several pictures as one JSON object keyed by picture name.
+    Evaluate each picture on its own, exactly as described above; the pictures are unrelated.
+    Output one JSON object with the same picture names as keys, the value of each key in the output format above:
+    {"pic1": <output for pic1>, "pic2": <output for pic2>}
+    Important:
+        - Include every picture name of the input
+        - Please output only raw JSON. Do not use any Markdown syntax
+    """
+
+# split pic names into batches
+def batches(pics, batch_size):
+    return [pics[i:i + batch_size] for i in range(0, len(pics), batch_size)]
+
+# output format of one picture: step list with accuracy / pattern dict
+def valid_output(kind, value):
+    if kind == "step_accuracy":
+        return isinstance(value, list) and bool(value) and all(isinstance(s, dict) and "accuracy" in s for s in value)
+    return isinstance(value, dict) and all(k in value for k in ("Breadth-First", "Depth-First"))
+
+# one batched request: {pic_name: output} of the valid outputs, tokens of the request
+def evaluate(kind, items):
+    prompt = reasoning.prompt_stepAcc if kind == "step_accuracy" else reasoning.prompt_pattern
+    response = routing.create(
+        kind,
+        expect_json = True,
+        input = [
+            {
+                "role": "system",
+                "content": [
+                    {"type": "input_text", "text": prompt + batch_format},
+                ]
+            },
+            {
+                "role": "user",
+                "content": [
+                    {"type": "input_text", "text": "Here are the pictures:" + json.dumps(items, ensure_ascii=False)},
+                ]
+            }
+        ]
+    )
+    try:
+        outputs = json.loads(reasoning.check_fix_json(response.output_text))
+    except (ValueError, TypeError):
+        # check_fix_json raises ValueError when the fixed answer is still no JSON
+        outputs = {}
+    if not isinstance(outputs, dict):
+        outputs = {}
+    return {pic: value for pic, value in outputs.items() if pic in items and valid_output(kind, value)}, response.usage.total_tokens
+
+# batched evaluation of one stage; returns {pic: (final accuracy or None, tokens)}
+def run(kind, pics, model, batch_size=BATCH_SIZE, output_name=None, ground_truth_path=GPS_PATH):
+    output_name = output_name or ("step_acc.json" if kind == "step_accuracy" else "pattern.json")
+    ground_truth = {}
+    if kind == "step_accuracy":
+        for pic in pics:
+            ground_truth[pic] = reasoning.load_ground_truth(ground_truth_path, pic)
+
+    def run_batch(batch):
+        items = {}
+        for pic in batch:
+            with open(f"{DATA_DIR}{model}/{os.path.splitext(pic)[0]}/reasoning.json", 'r', encoding='utf-8') as f:
+                trace = json.load(f)
+            items[os.path.splitext(pic)[0]] = {"reasoning": trace, "ground_truth": ground_truth[pic]} if pic in ground_truth else trace
+        # a single picture gains nothing from the batch framing
+        outputs, tokens = evaluate(kind, items) if len(batch) > 1 else ({}, 0)
+        results = {}
+        for pic in batch:
+            pic_name = os.path.splitext(pic)[0]
+            output_dir = f"{DATA_DIR}{model}/{pic_name}/"
+            if pic_name not in outputs:
+                # missing or malformed in the batched answer: unbatched request, written to output_name
+                if len(batch) > 1:
+                    print(f"{kind} of {pic_name} ({model}) missing in the batched answer, evaluating it alone")
+                if kind == "step_accuracy":
+                    final_acc, pic_tokens = unbatched(reasoning.step_accuracy, pic, output_dir, output_name, ground_truth_path)
+                else:
+                    final_acc, pic_tokens = None, unbatched(reasoning.detect_pattern, pic, output_dir, output_name, ground_truth_path)
+                results[pic] = (final_acc, pic_tokens)
+                continue
+            output = outputs[pic_name]
+            with open(output_dir + output_name, "w", encoding="utf-8") as f:
+                f.write(json.dumps(output, ensure_ascii=False) + "\n")
+            # tokens of the request are shared evenly by the pictures of the batch
+            results[pic] = (output[-1]["accuracy"] if kind == "step_accuracy" else None, tokens // len(batch))
+        if len(batch) > 1:
+            print(f"Batched {kind} ({model}): {len(outputs)} of {len(batch)} pictures in one request, {tokens} tokens")
+        return results
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=EVAL_WORKERS) as pool:
+        for batch_results in pool.map(run_batch, batches(pics, batch_size)):
+            results.update(batch_results)
+    return results
+
+# unbatched evaluation of one picture, result file renamed to output_name
+def unbatched(function, pic, output_dir, output_name, ground_truth_path):
+    default = "step_acc.json" if function is reasoning.step_accuracy else "pattern.json"
+    if output_name == default:
+        return function(output_dir + "reasoning.json", ground_truth_path, pic, output_dir)
+    # keep the unbatched labels of the validation
+    backup = None
+    if os.path.exists(output_dir + default):
+        with open(output_dir + default, 'r', encoding='utf-8') as f:
+            backup = f.read()
+    try:
+        result = function(output_dir + "reasoning.json", ground_truth_path, pic, output_dir)
+        os.replace(output_dir + default, output_dir + output_name)
+    finally:
+        if backup is not None:
+            with open(output_dir + default, 'w', encoding='utf-8') as f:
+                f.write(backup)
+    return result
+
+# batched step_accuracy: {pic: (final accuracy, tokens)}
+def step_accuracy_batch(pics, model, batch_size=BATCH_SIZE, output_name="step_acc.json"):
+    return run("step_accuracy", pics, model, batch_size, output_name)
+
+# batched detect_pattern: {pic: (None, tokens)}
+def detect_pattern_batch(pics, model, batch_size=BATCH_SIZE, output_name="pattern.json"):
+    return run("pattern", pics, model, batch_size, output_name)
+
+# step accuracy of output_name files compared with step_acc.json of the same pictures
+def accuracy_agreement(data_dir=DATA_DIR, model="chatgpt", output_name="step_acc_batch.json"):
+    steps = same_steps = pictures = same_final = 0
+    for pic_name in sorted(os.listdir(os.path.join(data_dir, model))):
+        a_path = os.path.join(data_dir, model, pic_name, "step_acc.json")
+        b_path = os.path.join(data_dir, model, pic_name, output_name)
+        if not (os.path.exists(a_path) and os.path.exists(b_path)):
+            continue
+        with open(a_path, 'r', encoding='utf-8') as f:
+            a = json.load(f)
+        with open(b_path, 'r', encoding='utf-8') as f:
+            b = json.load(f)
+        if not a or not b:
+            continue
+        a_steps = {s.get("step"): s["accuracy"] for s in a}
+        b_steps = {s.get("step"): s["accuracy"] for s in b}
+        # steps missing in one of the files count as disagreement
+        steps += len(set(a_steps) | set(b_steps))
+        same_steps += sum(a_steps[s] == b_steps.get(s) for s in a_steps)
+        pictures += 1
+        same_final += a[-1]["accuracy"] == b[-1]["accuracy"]
+    if not pictures:
+        return None
+    return {
+        "pictures": pictures,
+        "steps": steps,
+        "step_agreement": round(same_steps / steps, 4),
+        "final_agreement": round(same_final / pictures, 4),
+    }
+
+# batched labels of pictures with unbatched labels, agreement report
+def validate(pics, model, batch_size=BATCH_SIZE):
+    def labelled(name):
+        return [pic for pic in pics if os.path.exists(f"{DATA_DIR}{model}/{os.path.splitext(pic)[0]}/{name}")]
+    with open(GPS_PATH, 'r', encoding='utf-8') as f:
+        gps = json.load(f)
+    acc_pics = [pic for pic in labelled("step_acc.json") if pic in gps]
+    pattern_pics = labelled("pattern.json")
+    print(f"Validating batches of {batch_size}: {len(acc_pics)} pictures with step_acc.json, {len(pattern_pics)} with pattern.json")
+
+    if acc_pics:
+        step_accuracy_batch(acc_pics, model, batch_size, "step_acc_batch.json")
+    if pattern_pics:
+        detect_pattern_batch(pattern_pics, model, batch_size, "pattern_batch.json")
+    report = {
+        "batch_size": batch_size,
+        "step_accuracy": accuracy_agreement(DATA_DIR, model, "step_acc_batch.json"),
+        "pattern": pattern.agreement(DATA_DIR, [model], "pattern_batch.json").get(model),
+    }
+    checks = [report["step_accuracy"] and report["step_accuracy"]["step_agreement"],
+              report["pattern"] and report["pattern"]["agreement"]]
+    report["passed"] = all(c is None or c >= MIN_AGREEMENT for c in checks)
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batched step_accuracy / detect_pattern over several pictures per request.")
+    parser.add_argument("--model", "-m", default="chatgpt")
+    parser.add_argument("--pics", "-p", nargs="+", required=True, help="picture file names or names, e.g. pic1 pic2.png")
+    parser.add_argument("--stages", "-s", nargs="+", default=["accuracy", "pattern"], choices=["accuracy", "pattern"])
+    parser.add_argument("--batch-size", "-b", type=int, default=BATCH_SIZE)
+    parser.add_argument("--validate", action="store_true",
+                        help="compare batched with the existing unbatched labels (written to *_batch.json)")
+    args = parser.parse_args()
+    pics = [p if p.endswith(".png") else p + ".png" for p in args.pics]
+    if args.validate:
+        raise SystemExit(0 if validate(pics, args.model, args.batch_size)["passed"] else 1)
+    if "accuracy" in args.stages:
+        step_accuracy_batch(pics, args.model, args.batch_size)
+    if "pattern" in args.stages:
+        detect_pattern_batch(pics, args.model, args.batch_size)
@@ -0,0 +1,255 @@
+import os
+import io
+import sys
+import glob
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+import statistics
+"""
+benchmark.py
+------------
+Benchmarks of the pipeline code paths that run without LLM calls.
+Offline suite, over every data/<model>/pic*/ directory and synthetic trees of 10k / 100k nodes:
+- layout: hierarchy.repair + coordinate.calculate of the vi/l maps
+- json_load / json_dump: all JSON artifacts of the pictures
+- check_fix_json: parse path of valid JSON (extract.check_fix_json)
+- entity_to_vi_l: split of entity.json into vi and l lists
+- process_io: per-picture file I/O of the offline stages in process_single (read step_acc.json,
+  calculate_coordinates reading *_map_info.json and writing the layouts to a temp directory)
+Results (median of several runs) can be saved as baseline; a later run fails (exit code 1)
+if a benchmark is slower than baseline * (1 + threshold).
+Startup suite:
+- bench_import(): startup time of the pipeline modules, each import measured in a fresh
+  interpreter, and which provider SDKs got loaded by the import
+- bench_first_use(): time to import an SDK and build a provider client on first use
+
+Usage (from repository root):
+    python geomindmap/pipeline/benchmark.py --save-baseline
+    python geomindmap/pipeline/benchmark.py --threshold 0.3
+    python geomindmap/pipeline/benchmark.py --startup
+"""
+
+PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+SDK_MODULES = ["openai", "anthropic", "google"]
+BASELINE_PATH = "geomindmap/data/benchmark_baseline.json"
+SYNTHETIC_SIZES = (10_000, 100_000)
+# differences below this are timer noise, never regressions
+MIN_REGRESSION_S = 0.002
+
+sys.path.insert(0, PIPELINE_DIR)
+
+# run a snippet in a fresh interpreter and return its json output
+def run_fresh(code):
+    out = subprocess.run([sys.executable, "-c", code], cwd=PIPELINE_DIR, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1])
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+# import time of pipeline modules in fresh interpreters
+def bench_import(modules=("coordinate", "analytics", "providers", "reasoning", "extract", "match", "main"), repeat=5):
+    results = {}
+    for module in modules:
+        code = (
+            "import sys, time, json\n"
+            f"sys.path.insert(0, {PIPELINE_DIR!r})\n"
+            "t0 = time.perf_counter()\n"
+            f"import {module}\n"
+            "t1 = time.perf_counter()\n"
+            f"sdk = sorted(m for m in sys.modules if m.split('.')[0] in {SDK_MODULES!r} and '.' not in m)\n"
+            "print(json.dumps({'time': t1 - t0, 'sdk': sdk}))\n"
+        )
+        try:
+            runs = [run_fresh(code) for _ in range(repeat)]
+        except RuntimeError as e:
+            print(f"{module:12s} import failed: {e}")
+            continue
+        times = [r["time"] * 1000 for r in runs]
+        results[module] = {
+            "median_ms": round(statistics.median(times), 2),
+            "min_ms": round(min(times), 2),
+            "sdk_loaded": runs[0]["sdk"],
+        }
+        print(f"{module:12s} {results[module]['median_ms']:8.2f} ms  SDKs loaded: {results[module]['sdk_loaded'] or '-'}")
+    return results
+
+# first-use cost of each provider backend (SDK import + client construction)
+def bench_first_use(names=("chatgpt", "gpt5", "gemini", "gemini_genai", "claude", "qwen")):
+    results = {}
+    for name in names:
+        code = (
+            "import sys, time, json\n"
+            f"sys.path.insert(0, {PIPELINE_DIR!r})\n"
+            "import providers\n"
+            "t0 = time.perf_counter()\n"
+            f"providers.get_client({name!r})\n"
+            "print(json.dumps({'time': time.perf_counter() - t0}))\n"
+        )
+        try:
+            results[name] = round(run_fresh(code)["time"] * 1000, 2)
+            print(f"{name:12s} first use {results[name]:8.2f} ms")
+        except RuntimeError as e:
+            print(f"{name:12s} unavailable: {e}")
+    return results
+
+# median wall time of fn() over repeat runs (after one warm-up run)
+def timed(fn, repeat=5):
+    fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+# synthetic map info with n nodes on 5 granularity levels, parents on the level above
+def synthetic_tree(n, seed=0):
+    rng = random.Random(seed)
+    shares = [0.001, 0.01, 0.05, 0.2]
+    sizes = [max(1, int(n * w)) for w in shares]
+    sizes.append(n - sum(sizes))
+    nodes, previous = [], []
+    for level, size in enumerate(sizes, start=1):
+        current = [f"node {level}-{i}" for i in range(size)]
+        for name in current:
+            parent = rng.choice(previous) if previous else None
+            nodes.append({"entity": name, "type": "v", "granularity": level, "parent": parent})
+        previous = current
+    return nodes
+
+# picture directories with their artifacts loaded once
+def load_pictures(data_dir="geomindmap/data/"):
+    pictures = []
+    for pic_dir in sorted(glob.glob(os.path.join(data_dir, "*", "pic*"))):
+        files = {}
+        for path in sorted(glob.glob(os.path.join(pic_dir, "*.json"))):
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            try:
+                files[os.path.basename(path)] = (text, json.loads(text))
+            except json.JSONDecodeError:
+                continue
+        pictures.append((pic_dir, files))
+    return pictures
+
+# offline suite: {name: {"median_s", "items"}}
+def bench_offline(data_dir="geomindmap/data/", sizes=SYNTHETIC_SIZES, repeat=5):
+    import hierarchy
+    import coordinate
+    import extract
+
+    pictures = load_pictures(data_dir)
+    results = {}
+    def record(name, seconds, items, unit):
+        results[name] = {"median_s": round(seconds, 6), "items": items}
+        print(f"{name:28s} {seconds * 1000:10.2f} ms  {items:7d} {unit:7s} {seconds / max(items, 1) * 1e6:10.2f} us/{unit}")
+
+    maps = [data for _, files in pictures for name, (_, data) in files.items()
+            if name in ("vi_map_info.json", "l_map_info.json") and isinstance(data, list)]
+    repaired = [hierarchy.repair(m)[0] for m in maps]
+    record("layout_repair/pictures", timed(lambda: [hierarchy.repair(m) for m in maps], repeat), len(maps), "map")
+    record("layout_calculate/pictures", timed(lambda: [coordinate.calculate(m) for m in repaired], repeat), len(maps), "map")
+    for n in sizes:
+        tree = synthetic_tree(n)
+        fixed = hierarchy.repair(tree)[0]
+        runs = max(1, repeat * 10_000 // n)
+        record(f"layout_repair/{n}", timed(lambda: hierarchy.repair(tree), runs), n, "node")
+        record(f"layout_calculate/{n}", timed(lambda: coordinate.calculate(fixed), runs), n, "node")
+
+    texts = [text for _, files in pictures for text, _ in files.values()]
+    datas = [data for _, files in pictures for _, data in files.values()]
+    record("json_load/pictures", timed(lambda: [json.loads(t) for t in texts], repeat), len(texts), "file")
+    record("json_dump/pictures", timed(lambda: [json.dumps(d, indent=2, ensure_ascii=False) for d in datas], repeat), len(datas), "file")
+    for n in sizes:
+        tree = synthetic_tree(n)
+        text = json.dumps(tree, indent=2, ensure_ascii=False)
+        record(f"json_load/{n}", timed(lambda: json.loads(text), repeat), n, "node")
+        record(f"json_dump/{n}", timed(lambda: json.dumps(tree, indent=2, ensure_ascii=False), repeat), n, "node")
+
+    entity_texts = [files["entity.json"][0] for _, files in pictures if "entity.json" in files]
+    record("check_fix_json/pictures", timed(lambda: [extract.check_fix_json(t) for t in texts], repeat), len(texts), "file")
+    record("entity_to_vi_l/pictures", timed(lambda: [(extract.entity_to_vi_l(t, "vi"), extract.entity_to_vi_l(t, "l"))
+                                                     for t in entity_texts], repeat), len(entity_texts), "file")
+    for n in sizes:
+        entity = json.dumps([{"entity": f"entity {i}", "type": "vil"[i % 3]} for i in range(n)], indent=2)
+        record(f"entity_to_vi_l/{n}", timed(lambda: (extract.entity_to_vi_l(entity, "vi"), extract.entity_to_vi_l(entity, "l")), repeat), n, "entity")
+
+    # per-picture file I/O of the offline stages, layouts written to a temp directory
+    layout_dirs = [pic_dir for pic_dir, files in pictures if "vi_map_info.json" in files and "l_map_info.json" in files]
+    with tempfile.TemporaryDirectory() as tmp:
+        def process_io():
+            for pic_dir in layout_dirs:
+                step_path = os.path.join(pic_dir, "step_acc.json")
+                if os.path.exists(step_path):
+                    with open(step_path, 'r', encoding='utf-8') as f:
+                        json.load(f)
+                out_dir = os.path.join(tmp, os.path.basename(os.path.dirname(pic_dir)) + "_" + os.path.basename(pic_dir)) + "/"
+                os.makedirs(out_dir, exist_ok=True)
+                # printed repair reports would dominate the timing
+                with redirect_stdout():
+                    coordinate.calculate_coordinates(os.path.join(pic_dir, "vi_map_info.json"), out_dir, "vi")
+                    coordinate.calculate_coordinates(os.path.join(pic_dir, "l_map_info.json"), out_dir, "l")
+        record("process_io/pictures", timed(process_io, max(1, repeat // 2)), len(layout_dirs), "picture")
+    return results
+
+# silence prints of the benchmarked functions
+class redirect_stdout:
+    def __enter__(self):
+        self.stdout, sys.stdout = sys.stdout, io.StringIO()
+    def __exit__(self, *exc):
+        sys.stdout = self.stdout
+
+# regressions against the baseline: [(name, baseline_s, current_s)]
+def compare(results, baseline, threshold=0.3):
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        old, new = base["median_s"], r["median_s"]
+        change = new / old - 1 if old else 0.0
+        flag = ""
+        if new > old * (1 + threshold) and new - old > MIN_REGRESSION_S:
+            regressions.append((name, old, new))
+            flag = "  REGRESSION"
+        print(f"{name:28s} {old * 1000:10.2f} ms -> {new * 1000:10.2f} ms  {change:+7.1%}{flag}")
+    return regressions
+
+def save_baseline(results, path=BASELINE_PATH):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"), "python": sys.version.split()[0],
+                   "results": results}, f, indent=2)
+    print(f"Baseline saved to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the offline pipeline code paths.")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as new baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=0.3, help="allowed slowdown against the baseline")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sizes", type=int, nargs="*", default=list(SYNTHETIC_SIZES), help="synthetic tree sizes")
+    parser.add_argument("--startup", action="store_true", help="also measure import time and provider first use")
+    args = parser.parse_args()
+
+    if args.startup:
+        print("Import time:")
+        bench_import()
+        print("Provider first use:")
+        bench_first_use()
+    print("Offline stages:")
+    results = bench_offline(sizes=args.sizes, repeat=args.repeat)
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"Against baseline {args.baseline} ({baseline['created']}), threshold {args.threshold:.0%}:")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): " + ", ".join(name for name, _, _ in regressions))
+            sys.exit(1)
+        print("No regressions")
@@ -0,0 +1,204 @@
+import os
+import re
+import json
+import glob
+import time
+from collections import Counter
+from difflib import SequenceMatcher
+import numpy as np
+import gazetteer
+import hierarchy
+"""
+clue_index.py
+-------------
+This module builds a local vector index of the clue entities (type v/i) of all models and
+pictures, and clusters different spellings of the same clue into canonical clue groups
+("license plate", "licence plates", "license-plate", ...).
+Entities are embedded as character n-gram TF-IDF vectors (no embedding model) stored as
+sparse rows (CSR arrays: indptr, indices, data), pairwise cosine similarities are computed
+in batched sparse products, and pairs above a threshold are grouped around the most frequent
+spelling (leader clustering). Only spelling variants are merged: a name with a content word
+the other one lacks ("German license plate", "Doric columns", "town square") is a different
+clue, the modifier is what tells locations apart.
+
+Class:
+- ClueIndex(names, counts, n, min_df): sparse TF-IDF rows of clue names
+  - vector(text): query vector as (columns, weights)
+  - nearest(text, k): k most similar clue names
+  - similar_pairs(threshold, batch): index pairs with cosine similarity >= threshold
+
+Functions:
+- load_clues(data_dir): clue names and their occurrence counts over data/*/pic*/entity.json
+- same_words(a, b): whether two names have the same content words up to spelling
+- cluster(index, threshold): canonical clue groups
+- build(data_dir, output_path, threshold): build index, cluster and save clue_clusters.json
+"""
+
+OUTPUT_PATH = "geomindmap/data/clue_clusters.json"
+# words that do not make two clues different
+STOPWORDS = {"a", "an", "the", "of", "with", "and", "in", "on", "at", "for", "to"}
+# similarity of two words that are spellings of the same word (licence / license, colour / color)
+MIN_WORD_RATIO = 0.8
+
+# character n-grams of a normalized name, padded with spaces at word boundaries
+def ngrams(text, n=3):
+    text = f" {gazetteer.normalize(text)} "
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+# clue names and occurrence counts
+def load_clues(data_dir="geomindmap/data/"):
+    counts = Counter()
+    for path in glob.glob(os.path.join(data_dir, "*", "pic*", "entity.json")):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entities = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Skip {path}: {e}")
+            continue
+        counts.update(e["entity"] for e in entities if e.get("type") in ("v", "i"))
+    return counts
+
+# TF-IDF index of clue names
+class ClueIndex:
+    def __init__(self, names, counts=None, n=3, min_df=2):
+        self.names = list(names)
+        self.counts = counts or {}
+        self.n = n
+        grams = [Counter(ngrams(name, n)) for name in self.names]
+
+        # vocabulary: n-grams in at least min_df names (rarer ones cannot link two names)
+        df = Counter(g for c in grams for g in c)
+        self.vocab = {g: j for j, g in enumerate(sorted(g for g, d in df.items() if d >= min_df))}
+        self.idf = np.array([np.log(len(self.names) / df[g]) + 1 for g in sorted(self.vocab, key=self.vocab.get)], dtype=np.float32)
+
+        # sublinear tf * idf, L2-normalized rows in CSR arrays
+        indptr, indices, data = [0], [], []
+        for c in grams:
+            entries = sorted((self.vocab[g], 1 + np.log(tf)) for g, tf in c.items() if g in self.vocab)
+            cols = [j for j, _ in entries]
+            w = np.array([tf for _, tf in entries], dtype=np.float32) * self.idf[cols]
+            norm = np.linalg.norm(w)
+            indices += cols
+            data += list(w / norm if norm > 0 else w)
+            indptr.append(len(indices))
+        self.indptr = np.array(indptr, dtype=np.intp)
+        self.indices = np.array(indices, dtype=np.intp)
+        self.data = np.array(data, dtype=np.float32)
+        # the same entries by column (CSC) for column gathers in nearest() and similar_pairs()
+        order = np.argsort(self.indices, kind="stable")
+        self.col_rows = np.repeat(np.arange(len(self.names), dtype=np.intp), np.diff(self.indptr))[order]
+        self.col_data = self.data[order]
+        self.col_ptr = np.concatenate([[0], np.cumsum(np.bincount(self.indices, minlength=len(self.vocab)))]).astype(np.intp)
+
+    # sparse query vector: (columns, weights)
+    def vector(self, text):
+        c = Counter(g for g in ngrams(text, self.n) if g in self.vocab)
+        cols = np.array([self.vocab[g] for g in c], dtype=np.intp)
+        w = np.array([1 + np.log(tf) for tf in c.values()], dtype=np.float32) * self.idf[cols]
+        norm = np.linalg.norm(w)
+        return cols, (w / norm if norm > 0 else w)
+
+    # entries of the columns cols: rows, values * weights, owner of each entry
+    def gather(self, cols, weights, owners):
+        starts = self.col_ptr[cols]
+        counts = self.col_ptr[cols + 1] - starts
+        offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        return self.col_rows[offsets], self.col_data[offsets] * np.repeat(weights, counts), np.repeat(owners, counts)
+
+    # k most similar clue names: [(name, similarity)]
+    def nearest(self, text, k=5):
+        cols, w = self.vector(text)
+        if cols.size == 0:
+            return []
+        rows, values, _ = self.gather(cols, w, np.zeros(cols.size, dtype=np.intp))
+        sims = np.bincount(rows, weights=values, minlength=len(self.names))
+        k = min(k, sims.size)
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return [(self.names[i], round(float(sims[i]), 4)) for i in top]
+
+    # all index pairs (i < j) with cosine similarity >= threshold, in batched sparse products
+    def similar_pairs(self, threshold=0.7, batch=256):
+        n = len(self.names)
+        pairs = []
+        for start in range(0, n, batch):
+            stop = min(start + batch, n)
+            # rows start..stop times all rows: products of the shared columns, summed per (row, row)
+            lo, hi = self.indptr[start], self.indptr[stop]
+            owners = np.repeat(np.arange(stop - start), np.diff(self.indptr[start:stop + 1]))
+            rows, values, owners = self.gather(self.indices[lo:hi], self.data[lo:hi], owners)
+            S = np.bincount(owners * n + rows, weights=values, minlength=(stop - start) * n).reshape(stop - start, n)
+            i, j = np.nonzero(S >= threshold)
+            i += start
+            keep = i < j
+            pairs.append(np.stack([i[keep], j[keep]], axis=1))
+        return np.vstack(pairs) if pairs else np.zeros((0, 2), dtype=np.intp)
+
+# content words of a name: normalized, singular, without stopwords
+def content_words(name):
+    return [hierarchy.singular(w) for w in gazetteer.normalize(name).split() if w not in STOPWORDS]
+
+# two words are the same up to spelling (licence / license, colour / color), not a derived word
+# (sign / signal); numbers, codes and roman numerals (MCMXXI / MCMXXXI) must match exactly
+def same_word(a, b):
+    if a == b:
+        return True
+    if re.search(r"\d", a + b) or re.fullmatch(r"[ivxlcdm]+", a) or re.fullmatch(r"[ivxlcdm]+", b):
+        return False
+    return a[:3] == b[:3] and abs(len(a) - len(b)) <= 1 and SequenceMatcher(None, a, b).ratio() >= MIN_WORD_RATIO
+
+# same content words up to spelling and word breaks (neo-classical / neoclassical)
+def same_words(a, b):
+    a, b = content_words(a), content_words(b)
+    if "".join(a) == "".join(b):
+        return True
+    return all(any(same_word(x, y) for y in b) for x in a) and all(any(same_word(y, x) for x in a) for y in b)
+
+# leader clustering of similar clue names: {canonical: [members]}
+def cluster(index, threshold=0.7):
+    """
+    Names are visited from most to least frequent; an unassigned name becomes the leader
+    (canonical spelling) of a group and takes all unassigned names similar to it that are
+    spellings of the same words (same_words). Unlike single-link merging, groups cannot
+    chain into one giant cluster, and a generic name does not absorb its modified variants.
+    """
+    neighbours = [[] for _ in index.names]
+    for i, j in index.similar_pairs(threshold):
+        neighbours[i].append(j)
+        neighbours[j].append(i)
+
+    order = sorted(range(len(index.names)), key=lambda i: (-index.counts.get(index.names[i], 0), len(index.names[i]), index.names[i]))
+    leader = [None] * len(index.names)
+    clusters = {}
+    for i in order:
+        if leader[i] is not None:
+            continue
+        members = [i] + [j for j in neighbours[i] if leader[j] is None and same_words(index.names[i], index.names[j])]
+        for j in members:
+            leader[j] = i
+        clusters[index.names[i]] = [index.names[j] for j in members]
+    return clusters
+
+# build index, cluster and save clue_clusters.json
+def build(data_dir="geomindmap/data/", output_path=OUTPUT_PATH, threshold=0.7):
+    t0 = time.time()
+    counts = load_clues(data_dir)
+    index = ClueIndex(sorted(counts), counts)
+    t1 = time.time()
+    clusters = cluster(index, threshold)
+    t2 = time.time()
+    merged = {k: v for k, v in clusters.items() if len(v) > 1}
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(sorted(merged.items(), key=lambda kv: -len(kv[1]))), f, indent=4, ensure_ascii=False)
+    print(f"{len(index.names)} clue names, {len(index.vocab)} n-grams, index in {t1 - t0:.2f} s, clustering in {t2 - t1:.2f} s")
+    print(f"{len(clusters)} canonical clues, {len(merged)} groups with several spellings")
+    return index, clusters
+
+
+if __name__ == "__main__":
+    index, clusters = build()
+    t0 = time.perf_counter()
+    for _ in range(100):
+        hits = index.nearest("Augsburger banner")
+    print(f"nearest('Augsburger banner'): {hits[:3]} in {(time.perf_counter() - t0) * 10:.3f} ms per query")
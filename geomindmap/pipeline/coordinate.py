@@ -1,5 +1,6 @@
 import json
 import numpy as np
+import hierarchy
 """
 coordinate.py
 -------------
@@ -9,7 +10,8 @@ Used to render vi_map and l_map as radial graphs.
 
 Functions:
 - calculate(nodes): main function, assign angles recursively and return {entity: (x,y)}
-- calculate_coordinates(input_path, output_dir, mode): read nodes JSON, compute coords, save new JSON
+- calculate_coordinates(input_path, output_dir, mode, repair): read nodes JSON, repair the hierarchy
+  (see hierarchy.py, repairs saved to <mode>_map_repair.json), compute coords, save new JSON
 """
 # Calculate Coordinates
 def calculate(nodes):
@@ -28,7 +30,7 @@ def calculate(nodes):
         return size
 
     # Identify roots and calculate its tree total size
-    roots = children[None]
+    roots = children.get(None, [])
     total_size = sum(subtree_size(root) for root in roots)
 
     # Assign angular spans to each node of a tree
@@ -67,15 +69,18 @@ def calculate(nodes):
     return coords
 
 # Calculate and save coordinates to JSON
-def calculate_coordinates(input_path, output_dir, mode):
+def calculate_coordinates(input_path, output_dir, mode, repair=True):
     
     if mode == "vi":
         output_path = output_dir + "vi_map_layout.json"
     elif mode == "l":
         output_path = output_dir + "l_map_layout.json"
 
-    with open(input_path, 'r', encoding='utf-8') as f:
-        nodes = json.load(f)
+    if repair:
+        nodes, _ = hierarchy.repair_file(input_path, output_dir + f"{mode}_map_repair.json")
+    else:
+        with open(input_path, 'r', encoding='utf-8') as f:
+            nodes = json.load(f)
     coords = calculate(nodes)
     for node in nodes:
         x, y = coords[node['entity']]
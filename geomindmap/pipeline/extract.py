@@ -1,9 +1,13 @@
 import os
+import glob
 import base64
-import requests
 import argparse
 import json
-from openai import OpenAI 
+import routing
+import gazetteer
+import hierarchy
+import hedging
+from concurrent.futures import ThreadPoolExecutor
 """
 extract.py
 ----------
@@ -15,15 +19,28 @@ It produces:
 - l_map_info.json: hierarchical location map
 
 Functions:
-- extract_entity(image_path, reasoning_path, output_dir): extract entities from reasoning text + image
+- extract_entity(image_path, reasoning_path, output_dir, base64_image, chunk_tokens): extract entities from
+  reasoning text + image; with chunking enabled (GEOMINDMAP_CHUNK_TOKENS), traces longer than chunk_tokens
+  (estimated) are split into paragraph groups, extracted concurrently and merged by normalized entity names
+- chunk_paragraphs(paragraphs, max_tokens): consecutive paragraph groups under a token estimate
+- merge_entities(entity_lists): deduplicated entity list of several chunks
 - vi_map(output_dir, entity, response1_id): build visual/inference map with granularity and parent
-- l_map(output_dir, entity, response2_id): build location map with granularity and parent
+- l_map(output_dir, entity, response2_id, use_gazetteer): build location map with granularity and parent,
+  known locations are resolved by the offline gazetteer, only unknown ones are sent to the LLM
 - extract(image_path, reasoning_path, output_dir): run full extraction pipeline
+- compare_chunking(data_dir, models, chunk_tokens): entity recall of chunked extraction against the
+  unchunked entity.json on the traces that would be split (python extract.py --compare-chunking)
 """
 
-client = OpenAI(
-    api_key = os.getenv("OPENAI_API_KEY"),
-)
+# traces over this estimated token count are extracted in chunks; 0 (default): never chunk.
+# Every chunk sends the image again and vi_map / l_map continue the first chunk's conversation,
+# so chunking is opt-in for genuinely long traces, e.g. GEOMINDMAP_CHUNK_TOKENS=3000 (~1% of the
+# current traces); check the entity recall with compare_chunking() first
+CHUNK_TOKENS = int(os.getenv("GEOMINDMAP_CHUNK_TOKENS", "0"))
+SUGGESTED_CHUNK_TOKENS = 3000
+CHUNK_WORKERS = 4
+# compare_chunking(): minimum recall of the unchunked entities
+MIN_RECALL = 0.9
 
 # check and fix json format using llm
 def check_fix_json(str):
@@ -36,11 +53,9 @@ def check_fix_json(str):
     prompt = """
         Fix the following JSON string by ensuring it is properly formatted and contains valid JSON syntax. Please output only raw JSON. Do not use any Markdown syntax. Do not modify the original content.
         """
-    response = client.responses.create(
-        model = "o4-mini", 
-        reasoning = { 
-            "effort": "medium"
-        },
+    response = routing.create(
+        "fix_json",
+        expect_json = True,
         input = [
             {
                 "role": "user",
@@ -61,15 +76,95 @@ def check_fix_json(str):
         raise ValueError(f"LLM returned invalid JSON after fixing: {e}\nGot: {fixed_json}")
 
 
+# rough token count of a text (~4 characters per token), no tokenizer needed
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+# compact text of one reasoning paragraph, without JSON escaping and indentation
+def paragraph_text(i, p):
+    title = p.get("title", "").strip()
+    return f"[Paragraph {i + 1}] " + (title + "\n" if title else "") + p.get("content", "").strip()
+
+# group consecutive paragraphs into chunks under max_tokens (a longer paragraph is a chunk of its own)
+def chunk_paragraphs(paragraphs, max_tokens=CHUNK_TOKENS):
+    chunks, current, size = [], [], 0
+    for i, p in enumerate(paragraphs):
+        text = paragraph_text(i, p)
+        tokens = estimate_tokens(text)
+        if current and size + tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(text)
+        size += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+# merge entity lists of several chunks: first occurrence of a normalized name wins,
+# a name extracted as location in any chunk stays a location
+def merge_entities(entity_lists):
+    merged, index = [], {}
+    for entities in entity_lists:
+        for e in entities:
+            if not isinstance(e, dict) or not str(e.get("entity", "")).strip():
+                continue
+            key = hierarchy.loose_key(str(e["entity"]))
+            if key in index:
+                if e.get("type") == "l":
+                    merged[index[key]]["type"] = "l"
+                continue
+            index[key] = len(merged)
+            merged.append({"entity": str(e["entity"]).strip(), "type": e.get("type")})
+    return merged
+
 ### step 1 : extract entity
-def extract_entity(image_path, reasoning_path, output_dir):
+def extract_entity(image_path, reasoning_path, output_dir, base64_image=None, chunk_tokens=CHUNK_TOKENS):
     # encode image to base64
-    with open(image_path, "rb") as image_file:
-        base64_image = base64.b64encode(image_file.read()).decode("utf-8")
+    if base64_image is None:
+        with open(image_path, "rb") as image_file:
+            base64_image = base64.b64encode(image_file.read()).decode("utf-8")
     # read reasoning text
     with open(reasoning_path, "r", encoding="utf-8") as f:
         reasoning_text = f.read()
 
+    # long traces: extract the paragraph groups concurrently and merge
+    chunks = chunk_paragraphs(json.loads(reasoning_text), chunk_tokens) if chunk_tokens else []
+    if len(chunks) > 1:
+        return extract_entity_chunked(chunks, output_dir, base64_image)
+
+    response1 = entity_request(reasoning_text, base64_image)
+    entity = response1.output_text
+    print(entity)
+
+    # save entity to output
+    entity = check_fix_json(entity)
+
+    with open(output_dir + "entity.json", "w", encoding="utf-8") as f:
+        f.write(entity + "\n")
+    print(f"Finish extract_entity! Written in {output_dir}")
+    
+    return entity, response1.id, response1.usage.total_tokens
+
+# extract entities of each chunk concurrently, merge into one entity.json
+def extract_entity_chunked(chunks, output_dir, base64_image, output_name="entity.json"):
+    with ThreadPoolExecutor(max_workers=min(len(chunks), CHUNK_WORKERS)) as pool:
+        # chunk requests keep the deadline of the extract stage
+        responses = list(pool.map(hedging.bind(lambda chunk: entity_request(chunk, base64_image)), chunks))
+    entity_lists = [json.loads(check_fix_json(r.output_text)) for r in responses]
+    merged = merge_entities(entity_lists)
+    print(f"Chunked extract_entity: {len(chunks)} chunks, {sum(len(e) for e in entity_lists)} entities merged to {len(merged)}")
+
+    entity = json.dumps(merged, ensure_ascii=False, indent=2)
+    with open(output_dir + output_name, "w", encoding="utf-8") as f:
+        f.write(entity + "\n")
+    print(f"Finish extract_entity! Written in {output_dir}")
+
+    # vi_map / l_map continue the conversation of the first chunk (it holds the image);
+    # they receive the merged entity list in their prompt
+    return entity, responses[0].id, sum(r.usage.total_tokens for r in responses)
+
+# entity extraction request for a reasoning text (whole trace or chunk) + image
+def entity_request(reasoning_text, base64_image):
     system_prompt = """
     You are a text analysis expert. Please help me process a reasoning trace generated by an LLM during a Geoguessr task.
     Your workflow is: extract key entity terms and categorize them → perform fine-grained classification and association for clue terms → perform fine-grained classification and association for location terms. We will proceed step by step.
@@ -119,11 +214,9 @@ def extract_entity(image_path, reasoning_path, output_dir):
     Your task:
     '''
 
-    response1 = client.responses.create(
-        model = "o4-mini", 
-        reasoning = { 
-            "effort": "medium"
-        },
+    return routing.create(
+        "extract_entity",
+        expect_json = True,
         input = [
             {
                 "role": "system",
@@ -140,17 +233,6 @@ def extract_entity(image_path, reasoning_path, output_dir):
             }
         ]
     )
-    entity = response1.output_text
-    print(entity)
-
-    # save entity to output
-    entity = check_fix_json(entity)
-
-    with open(output_dir + "entity.json", "w", encoding="utf-8") as f:
-        f.write(entity + "\n")
-    print(f"Finish extract_entity! Written in {output_dir}")
-    
-    return entity, response1.id, response1.usage.total_tokens
 
 def entity_to_vi_l(entity, type):
     # string to json
@@ -213,8 +295,8 @@ def vi_map(output_dir, entity, response1_id):
     {"entity": "separated lanes", "type": "v", "granularity":2,"parent":"highway"}
     {"entity": "lanes color", "type": "v", "granularity":3,"parent":"separated lanes"}
     {"entity": "tall residential buildings", "type": "v", "granularity":1,"parent":null}
-    {"entity": "German Plattenbau", "type": "i", "granularity":3,"parent":"tall residential building"}
-    {"entity": "red banner 'Augsburger'", "type": "v", "granularity":2,"parent":"tall residential building"}
+    {"entity": "German Plattenbau", "type": "i", "granularity":3,"parent":"tall residential buildings"}
+    {"entity": "red banner 'Augsburger'", "type": "v", "granularity":2,"parent":"tall residential buildings"}
     ]
 
     Important:
@@ -224,11 +306,9 @@ def vi_map(output_dir, entity, response1_id):
     - Please output only raw JSON. Do not use any Markdown syntax
     Your task:
     '''
-    response2 = client.responses.create(
-        model = "o4-mini",
-        reasoning = { 
-            "effort": "medium"
-        }, 
+    response2 = routing.create(
+        "vi_map",
+        expect_json = True,
         previous_response_id = response1_id,
         input = [
             {
@@ -253,10 +333,29 @@ def vi_map(output_dir, entity, response1_id):
 
 
 ### step 3 : assign granularity and parent to location entities
-def l_map(output_dir, entity, response2_id):
+def l_map(output_dir, entity, response2_id, use_gazetteer=True):
     
     entity_l_text = entity_to_vi_l(entity, "l")
 
+    # resolve known locations offline, only unknown locations go to the LLM
+    resolved = []
+    if use_gazetteer:
+        resolved, unknown = gazetteer.resolve(json.loads(entity_l_text), gazetteer.load_gazetteer())
+        print(f"Gazetteer resolved {len(resolved)} locations, {len(unknown)} unknown")
+        if not unknown:
+            l_map_info = json.dumps(sorted(resolved, key=lambda n: n['granularity']), ensure_ascii=False, indent=2)
+            with open(output_dir + "l_map_info.json", "w", encoding="utf-8") as f:
+                f.write(l_map_info + "\n")
+            print(f"Finish l_map! Written in {output_dir}")
+            return 0
+        entity_l_text = json.dumps(unknown, ensure_ascii=False, indent=2)
+        if resolved:
+            entity_l_text = '''
+    The following locations are already classified, do not output them again, but you may use them as parents:
+    ''' + json.dumps(resolved, ensure_ascii=False, indent=2) + '''
+    Classify only these locations:
+    ''' + entity_l_text
+
     assign_granularity_parent_l = ''' 
     Your task is to first classify all location entities into five hierarchical levels based on their geographic scope and output them in order.
     Granularity Level Definitions:
@@ -306,11 +405,9 @@ def l_map(output_dir, entity, response2_id):
     - Please output only raw JSON. Do not use any Markdown syntax
     Your task:
     '''
-    response3 = client.responses.create(
-        model = "o4-mini",
-        reasoning = { 
-            "effort": "medium"
-        }, 
+    response3 = routing.create(
+        "l_map",
+        expect_json = True,
         previous_response_id = response2_id,
         input = [
             {
@@ -326,6 +423,11 @@ def l_map(output_dir, entity, response2_id):
     print(l_map_info)
 
     l_map_info = check_fix_json(l_map_info)
+    # merge gazetteer results with LLM results
+    if resolved:
+        known = {n['entity'] for n in resolved}
+        nodes = resolved + [n for n in json.loads(l_map_info) if n['entity'] not in known]
+        l_map_info = json.dumps(sorted(nodes, key=lambda n: n['granularity']), ensure_ascii=False, indent=2)
     # save l_map_info to output
     with open(output_dir + "l_map_info.json", "w", encoding="utf-8") as f:
         f.write(l_map_info + "\n")
@@ -334,7 +436,7 @@ def l_map(output_dir, entity, response2_id):
     return response3.usage.total_tokens
 
 
-def extract(image_path, reasoning_path, output_dir):
+def extract(image_path, reasoning_path, output_dir, base64_image=None):
     """
     Run full extraction pipeline to generate GeoMindMap layout info:
     1. entity.json
@@ -343,7 +445,7 @@ def extract(image_path, reasoning_path, output_dir):
     Returns total tokens used.
     """
     # step 1 : extract entity
-    entity, response1_id, token1= extract_entity(image_path, reasoning_path, output_dir)
+    entity, response1_id, token1= extract_entity(image_path, reasoning_path, output_dir, base64_image)
 
     # step 2 : assign granularity and parent node to v and i entities
     response2_id, token2= vi_map(output_dir, entity, response1_id)
@@ -354,3 +456,56 @@ def extract(image_path, reasoning_path, output_dir):
     print("Extract completed successfully!")
     return token1 + token2 + token3
 
+# entity recall of chunked extraction on the traces that would be split, against their unchunked entity.json
+def compare_chunking(data_dir="geomindmap/data/", models=None, chunk_tokens=SUGGESTED_CHUNK_TOKENS):
+    """
+    For every picture whose trace splits into several chunks at chunk_tokens and that has an
+    entity.json from the unchunked path, the chunked extraction is written to entity_chunked.json
+    and compared by normalized entity names (hierarchy.loose_key). Location entities are
+    reported separately, they are the input of l_map.
+    """
+    report = {"chunk_tokens": chunk_tokens, "pictures": {}, "entities": 0, "recalled": 0, "locations": 0, "locations_recalled": 0}
+    for path in sorted(glob.glob(os.path.join(data_dir, "*", "pic*", "reasoning.json"))):
+        pic_dir = os.path.dirname(path)
+        model, pic_name = os.path.basename(os.path.dirname(pic_dir)), os.path.basename(pic_dir)
+        if models and model not in models or not os.path.exists(os.path.join(pic_dir, "entity.json")):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            chunks = chunk_paragraphs(json.load(f), chunk_tokens)
+        if len(chunks) < 2:
+            continue
+        with open(f"geomindmap/pictures/{pic_name}.png", "rb") as image_file:
+            base64_image = base64.b64encode(image_file.read()).decode("utf-8")
+        extract_entity_chunked(chunks, pic_dir + "/", base64_image, "entity_chunked.json")
+        with open(os.path.join(pic_dir, "entity.json"), 'r', encoding='utf-8') as f:
+            reference = json.load(f)
+        with open(os.path.join(pic_dir, "entity_chunked.json"), 'r', encoding='utf-8') as f:
+            chunked = {hierarchy.loose_key(str(e["entity"])) for e in json.load(f) if isinstance(e, dict)}
+        keys = {hierarchy.loose_key(str(e["entity"])): e.get("type") for e in reference if isinstance(e, dict)}
+        locations = [k for k, t in keys.items() if t == "l"]
+        recalled = sum(k in chunked for k in keys)
+        locations_recalled = sum(k in chunked for k in locations)
+        report["pictures"][f"{model}/{pic_name}"] = {"chunks": len(chunks), "entities": len(keys), "recalled": recalled,
+                                                     "locations": len(locations), "locations_recalled": locations_recalled}
+        report["entities"] += len(keys)
+        report["recalled"] += recalled
+        report["locations"] += len(locations)
+        report["locations_recalled"] += locations_recalled
+    report["recall"] = report["recalled"] / report["entities"] if report["entities"] else None
+    report["location_recall"] = report["locations_recalled"] / report["locations"] if report["locations"] else None
+    print(f"Chunking at {chunk_tokens} tokens: {len(report['pictures'])} traces split, "
+          f"entity recall {report['recall']}, location recall {report['location_recall']}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Entity extraction tools.")
+    parser.add_argument("--compare-chunking", action="store_true",
+                        help="chunked vs unchunked entity recall on the traces that would be split")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS or SUGGESTED_CHUNK_TOKENS)
+    parser.add_argument("--model", "-m", nargs="+", default=None)
+    args = parser.parse_args()
+    if args.compare_chunking:
+        report = compare_chunking(models=args.model, chunk_tokens=args.chunk_tokens)
+        if report["recall"] is not None and report["recall"] < MIN_RECALL:
+            raise SystemExit(f"Entity recall {report['recall']:.3f} below {MIN_RECALL}")
@@ -0,0 +1,157 @@
+import os
+import re
+import json
+import glob
+import unicodedata
+from collections import Counter, defaultdict
+"""
+gazetteer.py
+------------
+This module provides an offline gazetteer for location entities.
+It resolves location names to granularity (1 continent -> 5 street) and parent
+without calling an LLM, using:
+- gazetteer.json: bundled places with granularity, parent and coordinates + alias table
+- gazetteer_learned.json: entries learned from previously accepted l_map_info.json files
+
+Functions:
+- normalize(name): normalize a location name for lookup
+- load_gazetteer(path, learned_path): load bundled + learned entries and build the lookup index
+- lookup(gaz, name): return canonical place name or None
+- ancestors(gaz, name): return the chain of parent places of a canonical name
+- resolve(entity_l, gaz): resolve location entities to granularity + parent, return (resolved, unknown)
+- learn(data_dir, learned_path, min_votes, min_share): learn entries from existing l_map_info.json files;
+  main.py and the job service (jobs.py) call it after every finished picture, next to the other
+  cross-picture indexes, so later pictures resolve the places earlier ones agreed on
+"""
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.json")
+LEARNED_PATH = "geomindmap/data/gazetteer_learned.json"
+
+# normalize a location name: lowercase, strip accents/quotes/punctuation, drop leading "the"
+def normalize(name):
+    name = unicodedata.normalize("NFKD", str(name))
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    name = name.casefold().replace("ß", "ss")
+    name = re.sub(r"[\"'’`´.,()]", "", name)
+    name = re.sub(r"[\s\-_/]+", " ", name).strip()
+    if name.startswith("the "):
+        name = name[4:]
+    return name
+
+# load bundled gazetteer and learned entries, build normalized lookup index
+def load_gazetteer(path=GAZETTEER_PATH, learned_path=LEARNED_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        gaz = json.load(f)
+
+    # learned entries never override bundled ones
+    if learned_path and os.path.exists(learned_path):
+        with open(learned_path, 'r', encoding='utf-8') as f:
+            learned = json.load(f)
+        for name, place in learned.get("places", {}).items():
+            gaz["places"].setdefault(name, place)
+
+    index = {}
+    for name in gaz["places"]:
+        index[normalize(name)] = name
+    for alias, name in gaz.get("aliases", {}).items():
+        if name in gaz["places"]:
+            index.setdefault(normalize(alias), name)
+    gaz["index"] = index
+    return gaz
+
+# return canonical place name or None
+def lookup(gaz, name):
+    return gaz["index"].get(normalize(name))
+
+# return the chain of parent places, nearest first
+def ancestors(gaz, name):
+    chain = []
+    parent = gaz["places"][name].get("parent")
+    while parent and parent in gaz["places"] and parent not in chain:
+        chain.append(parent)
+        parent = gaz["places"][parent].get("parent")
+    return chain
+
+# resolve location entities to granularity + parent
+def resolve(entity_l, gaz):
+    """
+    entity_l: list of location names (as in entity.json)
+    Parent is the nearest gazetteer ancestor that is also in entity_l, otherwise null.
+    Returns (resolved, unknown):
+    - resolved: [{"entity", "granularity", "parent"}] in l_map_info.json format
+    - unknown: names not found in the gazetteer (to be sent to the LLM)
+    """
+    canonical = {}
+    for name in entity_l:
+        place = lookup(gaz, name)
+        if place is not None:
+            # keep the first spelling used in the picture
+            canonical.setdefault(place, name)
+
+    resolved = []
+    unknown = []
+    for name in entity_l:
+        place = lookup(gaz, name)
+        if place is None:
+            unknown.append(name)
+            continue
+        parent = None
+        for a in ancestors(gaz, place):
+            if a in canonical and canonical[a] != name:
+                parent = canonical[a]
+                break
+        resolved.append({
+            "entity": name,
+            "granularity": gaz["places"][place]["granularity"],
+            "parent": parent
+        })
+    return resolved, unknown
+
+# learn granularity + parent from accepted l_map_info.json files
+def learn(data_dir="geomindmap/data/", learned_path=LEARNED_PATH, min_votes=2, min_share=0.8):
+    """
+    Scan data/<model>/<pic>/l_map_info.json, vote per normalized name and keep
+    names whose (granularity, parent) answer is consistent across pictures and models.
+    Bundled places are skipped. Returns number of learned places.
+    """
+    gaz = load_gazetteer(learned_path=None)
+    votes = defaultdict(Counter)
+    spelling = defaultdict(Counter)
+
+    for path in sorted(glob.glob(os.path.join(data_dir, "*", "pic*", "l_map_info.json"))):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                nodes = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Skip {path}: {e}")
+            continue
+        for node in nodes:
+            key = normalize(node["entity"])
+            if key in gaz["index"]:
+                continue
+            parent = node.get("parent")
+            if parent is not None:
+                parent = gaz["index"].get(normalize(parent), parent)
+            votes[key][(node["granularity"], parent)] += 1
+            spelling[key][node["entity"]] += 1
+
+    learned = {}
+    for key, counter in votes.items():
+        total = sum(counter.values())
+        (granularity, parent), count = counter.most_common(1)[0]
+        if total < min_votes or count / total < min_share:
+            continue
+        name = spelling[key].most_common(1)[0][0]
+        learned[name] = {"granularity": granularity, "parent": parent, "votes": count}
+
+    # unchanged entries are not rewritten, the pipeline calls this after every picture
+    text = json.dumps({"places": learned}, indent=2, ensure_ascii=False)
+    if os.path.exists(learned_path):
+        with open(learned_path, 'r', encoding='utf-8') as f:
+            if f.read() == text:
+                return len(learned)
+    os.makedirs(os.path.dirname(learned_path), exist_ok=True)
+    with open(learned_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    print(f"Learned {len(learned)} places from {data_dir}, saved to {learned_path}")
+    return len(learned)
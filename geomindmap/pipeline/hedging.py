@@ -0,0 +1,207 @@
+import os
+import glob
+import time
+import queue
+import threading
+import contextvars
+from contextlib import contextmanager
+import numpy as np
+import runlog
+"""
+hedging.py
+----------
+This module keeps one slow LLM call from stalling a picture (and with it a serial batch).
+- Hedged requests (opt-in, every duplicate is a paid request): when a call has not returned
+  after a percentile (e.g. p90) of the historical latency of its stage, a duplicate request
+  is sent and whichever finishes first wins; the other one runs out in the background and
+  its result is dropped.
+  Latency history: time_response of the model's info files for the reasoning calls,
+  the routing trace (routing.py) for the helper calls, plus the calls of this process.
+  Stages with fewer than MIN_SAMPLES observations are not hedged.
+- Deadlines: per-stage and per-image time limits. A call still running at the deadline
+  raises StageTimeout, the pipeline records the timed-out stage and moves on to the next
+  picture (main.process_single). The abandoned call cannot be cancelled, but its result
+  is never written.
+
+Hedged attempts must be free of side effects (no files written), the caller writes the
+result of the winning attempt.
+
+Configuration (environment, or main.py --hedge / --stage-deadline / --image-deadline):
+- GEOMINDMAP_HEDGE: latency percentile that triggers the duplicate, e.g. "90" (default "off")
+- GEOMINDMAP_STAGE_DEADLINE: seconds per stage, "600" or "reasoning=900,match=300"
+- GEOMINDMAP_IMAGE_DEADLINE: seconds for all stages of one picture
+
+Functions:
+- run(key, attempt): hedged call, attempt(i) runs attempt i (0: original, 1: duplicate)
+- hedge_delay(key): seconds after which a call of this stage is duplicated (None: no hedging)
+- stage(name, image_end): context with the deadline of a pipeline stage
+- image_deadline(): absolute end time of a picture started now (None: no limit)
+- bind(fn): fn running with the current deadline in pool threads
+- set_config(hedge, stage_deadline, image_deadline): change the configuration
+"""
+
+INFO_GLOB = "geomindmap/data/{model}/info/*.json*"
+TRACE_PATH = "geomindmap/data/routing_trace.jsonl"
+MIN_SAMPLES = 20
+# shortest hedge delay, fast calls are not worth a duplicate
+MIN_DELAY = 2.0
+# duplicates per call
+MAX_HEDGES = 1
+
+class StageTimeout(Exception):
+    def __init__(self, stage, seconds):
+        super().__init__(f"{stage} exceeded its deadline ({seconds:.0f} s)")
+        self.stage = stage
+
+# "600" -> {"*": 600.0}, "reasoning=900,match=300" -> {"reasoning": 900.0, "match": 300.0}
+def parse_deadlines(value):
+    if not value:
+        return {}
+    deadlines = {}
+    for item in value.split(","):
+        name, _, seconds = item.rpartition("=")
+        deadlines[name.strip() or "*"] = float(seconds)
+    return deadlines
+
+# percentile, None when hedging is off
+def parse_percentile(value):
+    if value in (None, "", "off", "0"):
+        return None
+    percentile = float(value)
+    if not 0 < percentile < 100:
+        raise ValueError(f"hedge percentile must be between 0 and 100, got {value}")
+    return percentile
+
+# no silent extra requests: hedging is opt-in
+HEDGE_PERCENTILE = parse_percentile(os.getenv("GEOMINDMAP_HEDGE", "off"))
+STAGE_DEADLINES = parse_deadlines(os.getenv("GEOMINDMAP_STAGE_DEADLINE"))
+IMAGE_DEADLINE = float(os.getenv("GEOMINDMAP_IMAGE_DEADLINE") or 0) or None
+
+_history = {}
+_lock = threading.Lock()
+_deadline = contextvars.ContextVar("deadline", default=None)
+stats = {"calls": 0, "hedged": 0, "hedge_won": 0, "timeouts": 0}
+
+# change the configuration; worker processes read it from the environment
+def set_config(hedge=None, stage_deadline=None, image_deadline=None):
+    global HEDGE_PERCENTILE, STAGE_DEADLINES, IMAGE_DEADLINE
+    if hedge is not None:
+        HEDGE_PERCENTILE = parse_percentile(hedge)
+        os.environ["GEOMINDMAP_HEDGE"] = hedge
+    if stage_deadline is not None:
+        STAGE_DEADLINES = parse_deadlines(stage_deadline)
+        os.environ["GEOMINDMAP_STAGE_DEADLINE"] = stage_deadline
+    if image_deadline is not None:
+        IMAGE_DEADLINE = image_deadline or None
+        os.environ["GEOMINDMAP_IMAGE_DEADLINE"] = str(image_deadline)
+
+# latencies on disk: "reasoning/<model>" from the info files, "<stage>/<model>" from the routing trace
+def load_history(key):
+    import analytics
+    kind, _, model = key.partition("/")
+    if kind == "reasoning":
+        rows = {}
+        for path in sorted(glob.glob(INFO_GLOB.format(model=model))):
+            # a run log and its compacted summary hold the same pictures
+            rows.update(analytics.read_info(path))
+        return [r["time_response"] for r in rows.values() if r.get("time_response")]
+    return [c["latency"] for c in runlog.read_log(TRACE_PATH)
+            if c.get("stage") == kind and c.get("model") == model and c.get("latency")]
+
+# record the latency of a finished call
+def observe(key, latency):
+    with _lock:
+        if key not in _history:
+            _history[key] = load_history(key)
+        _history[key].append(latency)
+
+# seconds after which a call is duplicated, None without hedging or enough history
+def hedge_delay(key, percentile=None):
+    percentile = percentile or HEDGE_PERCENTILE
+    if percentile is None:
+        return None
+    with _lock:
+        if key not in _history:
+            _history[key] = load_history(key)
+        latencies = list(_history[key])
+    if len(latencies) < MIN_SAMPLES:
+        return None
+    return max(float(np.percentile(latencies, percentile)), MIN_DELAY)
+
+# absolute end time of a picture started now
+def image_deadline():
+    return time.time() + IMAGE_DEADLINE if IMAGE_DEADLINE else None
+
+# deadline of a pipeline stage: its own limit, cut by the end of the picture
+@contextmanager
+def stage(name, image_end=None):
+    limit = STAGE_DEADLINES.get(name, STAGE_DEADLINES.get("*"))
+    ends = [t for t in (image_end, time.time() + limit if limit else None) if t]
+    token = _deadline.set((name, min(ends)) if ends else None)
+    try:
+        if ends and time.time() >= min(ends):
+            raise StageTimeout(name, 0)
+        yield
+    finally:
+        _deadline.reset(token)
+
+# fn running with the current deadline (context variables do not pass into pool threads)
+def bind(fn):
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(fn, *args)
+
+# hedged call: attempt(i) -> result, i = 0 original, 1.. duplicates
+def run(key, attempt, percentile=None):
+    """
+    The original attempt runs in a worker thread. Without a result after hedge_delay(key),
+    a duplicate is started; the first successful attempt wins. An attempt that fails
+    before a duplicate was started raises at once, otherwise the call fails only when all
+    attempts failed. At the deadline of the current stage StageTimeout is raised.
+    """
+    delay = hedge_delay(key, percentile)
+    deadline = _deadline.get()
+    results = queue.Queue()
+    starts = []
+
+    def start():
+        i = len(starts)
+        starts.append(time.time())
+        def work():
+            try:
+                results.put((i, True, attempt(i)))
+            except Exception as e:
+                results.put((i, False, e))
+        threading.Thread(target=work, daemon=True, name=f"{key}#{i}").start()
+
+    with _lock:
+        stats["calls"] += 1
+    start()
+    failed = 0
+    while True:
+        waits = []
+        if delay is not None and len(starts) <= MAX_HEDGES:
+            waits.append(starts[0] + delay * len(starts))
+        if deadline is not None:
+            waits.append(deadline[1])
+        try:
+            i, ok, value = results.get(timeout=max(min(waits) - time.time(), 0) if waits else None)
+        except queue.Empty:
+            if deadline is not None and time.time() >= deadline[1]:
+                with _lock:
+                    stats["timeouts"] += 1
+                raise StageTimeout(deadline[0], time.time() - starts[0])
+            print(f"{key}: no result after {time.time() - starts[0]:.1f} s (p{percentile or HEDGE_PERCENTILE:g} {delay:.1f} s), sending a duplicate request")
+            with _lock:
+                stats["hedged"] += 1
+            start()
+            continue
+        if ok:
+            observe(key, time.time() - starts[i])
+            if i > 0:
+                print(f"{key}: duplicate request won after {time.time() - starts[0]:.1f} s")
+                with _lock:
+                    stats["hedge_won"] += 1
+            return value
+        failed += 1
+        if failed == len(starts):
+            raise value
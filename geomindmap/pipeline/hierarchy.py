@@ -0,0 +1,158 @@
+import os
+import json
+import gazetteer
+"""
+hierarchy.py
+------------
+This module validates and repairs the hierarchies in vi_map_info.json / l_map_info.json
+before layout. The LLM output often breaks the rules of the extraction prompts:
+- duplicate entities
+- parents that are missing, misspelled or in singular/plural form ("tall residential building")
+- nodes that are their own parent, or parent cycles
+- parents on the same or a finer granularity level than the child
+Repairs are deterministic and every pass is linear in the number of nodes (parent chains
+after the cycle pass are strictly coarser, so upward walks are bounded by the number of
+granularity levels). Every repair is reported, so a broken tree no longer needs a paid
+re-extraction.
+
+Functions:
+- validate(nodes): list of issues, without changing the nodes
+- repair(nodes): repaired copy of the nodes and the list of repairs
+- repair_file(input_path, report_path): repair a *_map_info.json file, return repaired nodes
+"""
+
+NULL_PARENTS = {"", "none", "null", "nil", "n/a"}
+
+# singular form of the last word for plural-insensitive matching
+def singular(word):
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("ses", "xes", "zes", "ches", "shes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")) and len(word) > 3:
+        return word[:-1]
+    return word
+
+# loose lookup key of an entity: normalized, last word singular
+def loose_key(name):
+    words = gazetteer.normalize(name).split(" ")
+    words[-1] = singular(words[-1])
+    return " ".join(words)
+
+# granularity as positive int, None if unusable
+def to_granularity(value):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value >= 1 else None
+
+# issues of a node list: [{"entity", "issue", "action"}]
+def validate(nodes):
+    _, repairs = repair(nodes)
+    return repairs
+
+# repaired copy of the nodes and the repairs made
+def repair(nodes):
+    repairs = []
+    def report(entity, issue, action):
+        repairs.append({"entity": entity, "issue": issue, "action": action})
+
+    # 1. clean fields, drop duplicates (first occurrence wins)
+    fixed = []
+    index = {}
+    for node in nodes:
+        if not isinstance(node, dict) or not str(node.get("entity", "")).strip():
+            report(str(node), "invalid node", "dropped")
+            continue
+        node = dict(node)
+        node["entity"] = str(node["entity"]).strip()
+        parent = node.get("parent")
+        if parent is not None and (not isinstance(parent, str) or parent.strip().lower() in NULL_PARENTS):
+            parent = None
+        node["parent"] = parent.strip() if parent else None
+        granularity = to_granularity(node.get("granularity"))
+        if granularity is None:
+            report(node["entity"], f"invalid granularity {node.get('granularity')!r}", "set later from parent")
+        node["granularity"] = granularity
+        if node["entity"] in index:
+            report(node["entity"], "duplicate entity", "dropped, first occurrence kept")
+            continue
+        index[node["entity"]] = len(fixed)
+        fixed.append(node)
+
+    # loose keys for misspelled / plural parent names (first entity wins)
+    loose = {}
+    for node in fixed:
+        loose.setdefault(loose_key(node["entity"]), node["entity"])
+
+    # 2. resolve parents: exact, then loose match, otherwise the node becomes a root
+    for node in fixed:
+        parent = node["parent"]
+        if parent is None or parent in index and parent != node["entity"]:
+            continue
+        if parent == node["entity"]:
+            node["parent"] = None
+            report(node["entity"], "node is its own parent", "made root")
+            continue
+        match = loose.get(loose_key(parent))
+        if match is not None and match != node["entity"]:
+            node["parent"] = match
+            report(node["entity"], f"parent '{parent}' not found", f"attached to '{match}'")
+        else:
+            node["parent"] = None
+            report(node["entity"], f"parent '{parent}' not found", "made root")
+
+    # 3. break cycles: walk parent pointers once, colouring visited nodes
+    state = {}  # entity -> 1 on current walk, 2 done
+    for node in fixed:
+        path = []
+        entity = node["entity"]
+        while entity is not None and state.get(entity) is None:
+            state[entity] = 1
+            path.append(entity)
+            entity = fixed[index[entity]]["parent"]
+        if entity is not None and state.get(entity) == 1:
+            # cycle: entity ... end of path; cut above the coarsest node of the cycle
+            cycle = path[path.index(entity):]
+            cut = min(cycle, key=lambda e: (fixed[index[e]]["granularity"] or 0, index[e]))
+            report(cut, "parent cycle " + " -> ".join(cycle + [entity]), "made root")
+            fixed[index[cut]]["parent"] = None
+        for e in path:
+            state[e] = 2
+
+    # 4. granularity order, top-down: parents must be coarser than children
+    children = {}
+    for node in fixed:
+        children.setdefault(node["parent"], []).append(node["entity"])
+    queue = list(children.get(None, []))
+    for entity in queue:
+        node = fixed[index[entity]]
+        parent = node["parent"]
+        if node["granularity"] is None:
+            node["granularity"] = fixed[index[parent]]["granularity"] + 1 if parent else 1
+        elif parent is not None and fixed[index[parent]]["granularity"] >= node["granularity"]:
+            # nearest coarser ancestor; the chain above is already in order
+            anchor = parent
+            while anchor is not None and fixed[index[anchor]]["granularity"] >= node["granularity"]:
+                anchor = fixed[index[anchor]]["parent"]
+            node["parent"] = anchor
+            report(entity, f"parent '{parent}' not coarser (granularity {fixed[index[parent]]['granularity']} >= {node['granularity']})",
+                   f"attached to '{anchor}'" if anchor else "made root")
+        queue.extend(children.get(entity, []))
+    return fixed, repairs
+
+# repair a *_map_info.json file; the report is saved if there were repairs
+def repair_file(input_path, report_path=None):
+    with open(input_path, 'r', encoding='utf-8') as f:
+        nodes = json.load(f)
+    nodes, repairs = repair(nodes)
+    if repairs:
+        print(f"Repaired {input_path}: {len(repairs)} repairs")
+        if report_path:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(repairs, f, indent=2, ensure_ascii=False)
+    elif report_path and os.path.exists(report_path):
+        # stale report of an earlier, broken version
+        os.remove(report_path)
+    return nodes, repairs
@@ -0,0 +1,228 @@
+import os
+import json
+import hashlib
+import importlib.util
+import time
+import numpy as np
+"""
+images.py
+---------
+This module keeps the picture catalogue pictures/index.json and builds the web variants
+of the pictures for index.html.
+The catalogue is scanned incrementally: byte size and content hash decide whether a picture
+changed. index.json is tracked by git, so it holds no file times (a checkout changes them);
+the mtime of each hashed file is kept in the untracked pictures/index_cache.json, and files
+with the same mtime and size there are not hashed again. Each entry records content hash,
+dimensions (from the PNG header), byte size and whether ground truth exists in gps.json.
+A scan reports new, changed and removed pictures.
+Each picture gets a thumbnail, a medium and a full-size variant in WebP, stored in
+pictures/web/<variant>/<id>.webp, with dimensions, bytes and hashes in the catalogue, so
+the page shows thumbnails immediately and no longer probes the PNG with a HEAD request.
+Variants are only rebuilt for new or changed pictures. Building variants requires Pillow
+(pip install pillow), scanning does not.
+With Pillow, the scan also stores a 64-bit perceptual hash (DCT hash of the 32x32 grayscale
+picture) of each entry. Re-exports, resized or recompressed copies and small edits of the
+same photo differ in few bits (Hamming distance <= PHASH_THRESHOLD), different photos of the
+current set in at least 16, so near-duplicates are found before a batch spends reasoning
+and extraction calls on them.
+
+index.json entries:
+    {"file": "pic10.png", "id": "pic10", "width": 3024, "height": 4032, "bytes": 1834212,
+     "hash": "...", "phash": "c3a1...", "gps": true,
+     "variants": {"thumb": {"path": "pictures/web/thumb/pic10.webp", "width": 120, "height": 160, "bytes": 4210, "hash": "..."}, ...}}
+
+Functions:
+- file_hash(path): sha256 content hash (16 hex chars)
+- png_size(path): width, height from the PNG IHDR chunk
+- entry_name(entry): file name of an index.json entry (plain string or catalogue dict)
+- load_catalogue(index_path): catalogue entries {file name: entry}
+- phash(path): 64-bit perceptual hash (16 hex chars), requires Pillow
+- scan(image_folder_path, index_path, gps_path): incremental catalogue update, returns (entries, diff)
+- near_duplicates(entries, threshold): pairs of catalogue entries with close perceptual hashes
+- build_variants(image_folder_path, index_path, force): build missing/changed variants and save the catalogue
+"""
+
+# variant name -> (longest side in px or None for original size, WebP quality)
+VARIANTS = {
+    "thumb": (160, 70),
+    "medium": (1024, 80),
+    "full": (None, 85),
+}
+WEB_DIR = "web"
+# max Hamming distance of near-duplicate perceptual hashes (of 64 bits)
+PHASH_THRESHOLD = 10
+PHASH_SIZE = 32
+
+# orthonormal DCT-II matrix
+def dct_matrix(n):
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    m[0] /= np.sqrt(2)
+    return m * np.sqrt(2 / n)
+
+# perceptual hash: signs of the 8x8 lowest DCT frequencies against their median
+def phash(path):
+    from PIL import Image, ImageOps
+    with Image.open(path) as img:
+        img = ImageOps.exif_transpose(img).convert("L").resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS)
+    d = dct_matrix(PHASH_SIZE)
+    low = (d @ np.asarray(img, dtype=np.float64) @ d.T)[:8, :8].flatten()
+    # the DC term (mean brightness) does not enter the median
+    bits = low > np.median(low[1:])
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):016x}"
+
+# sha256 content hash
+def file_hash(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+# width, height of a PNG from its IHDR chunk (first chunk after the 8-byte signature)
+def png_size(path):
+    with open(path, "rb") as f:
+        head = f.read(24)
+    if head[:8] != b"\x89PNG\r\n\x1a\n" or head[12:16] != b"IHDR":
+        raise ValueError(f"Not a PNG file: {path}")
+    return int.from_bytes(head[16:20], "big"), int.from_bytes(head[20:24], "big")
+
+# file name of an index.json entry
+def entry_name(entry):
+    return entry["file"] if isinstance(entry, dict) else entry
+
+# catalogue entries in menu order: {file name: entry (dict, or file name for old indexes)}
+def load_catalogue(index_path="geomindmap/pictures/index.json"):
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return {entry_name(e): e for e in json.load(f)}
+
+# save catalogue entries as index.json
+def save_catalogue(entries, index_path):
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, indent=4, ensure_ascii=False)
+
+# incremental catalogue scan
+def scan(image_folder_path="geomindmap/pictures/", index_path=None, gps_path=None):
+    index_path = index_path or os.path.join(image_folder_path, "index.json")
+    gps_path = gps_path or os.path.join(image_folder_path, "gps.json")
+    cache_path = os.path.join(os.path.dirname(index_path), "index_cache.json")
+    old = load_catalogue(index_path)
+    # {file name: [mtime, size, hash]} of the last scan on this machine
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    gps = {}
+    if os.path.exists(gps_path):
+        with open(gps_path, 'r', encoding='utf-8') as f:
+            gps = json.load(f)
+
+    # keep the menu order of index.json, new pictures are appended
+    files = {n for n in os.listdir(image_folder_path) if n.endswith(".png")}
+    names = [n for n in old if n in files] + sorted(files - set(old))
+
+    diff = {"new": [], "changed": [], "removed": sorted(set(old) - files), "unchanged": []}
+    can_phash = importlib.util.find_spec("PIL") is not None
+    if not can_phash:
+        print("Pillow not installed: no perceptual hashes, near-duplicates are not detected")
+    entries = []
+    for name in names:
+        path = os.path.join(image_folder_path, name)
+        st = os.stat(path)
+        entry = old.get(name)
+        entry = dict(entry) if isinstance(entry, dict) else {"file": name, "id": os.path.splitext(name)[0]}
+        # catalogues written before index_cache.json stored the mtime in the entry
+        entry.pop("mtime", None)
+        cached = cache.get(name)
+        if cached and cached[:2] == [st.st_mtime, st.st_size]:
+            digest = cached[2]
+        else:
+            digest = file_hash(path)
+        cache[name] = [st.st_mtime, st.st_size, digest]
+        if entry.get("hash") == digest and entry.get("bytes") == st.st_size:
+            status = "unchanged"
+        else:
+            # entries of old indexes (plain file names) have no hash yet and count as new
+            status = "changed" if "hash" in entry else "new"
+            entry["width"], entry["height"] = png_size(path)
+            entry["hash"] = digest
+            entry["bytes"] = st.st_size
+            # variants and perceptual hash of the old content are stale
+            entry.pop("variants", None)
+            entry.pop("phash", None)
+        if can_phash and "phash" not in entry:
+            entry["phash"] = phash(path)
+        entry["gps"] = name in gps
+        diff[status].append(name)
+        entries.append(entry)
+
+    save_catalogue(entries, index_path)
+    with open(cache_path, 'w', encoding='utf-8') as f:
+        json.dump({name: cache[name] for name in names}, f)
+    print(f"Catalogue: {len(entries)} pictures, {len(diff['new'])} new, {len(diff['changed'])} changed, {len(diff['removed'])} removed")
+    return entries, diff
+
+# near-duplicate pairs (a, b, distance) of catalogue entries, a before b in catalogue order
+def near_duplicates(entries, threshold=PHASH_THRESHOLD):
+    entries = [e for e in entries if isinstance(e, dict) and e.get("phash")]
+    if len(entries) < 2:
+        return []
+    hashes = np.array([int(e["phash"], 16) for e in entries], dtype=np.uint64)
+    # Hamming distances row by row: xor, then count the set bits of the 8 bytes
+    pairs = []
+    for i in range(len(hashes) - 1):
+        x = np.bitwise_xor(hashes[i + 1:], hashes[i])
+        dist = np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+        for j in np.nonzero(dist <= threshold)[0]:
+            pairs.append((entries[i]["file"], entries[i + 1 + j]["file"], int(dist[j])))
+    return pairs
+
+# write one variant, return its manifest info
+def write_variant(img, out_path, max_side, quality):
+    from PIL import Image
+    if max_side and max(img.size) > max_side:
+        img = img.copy()
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    img.save(out_path, "WEBP", quality=quality, method=6)
+    return {"width": img.width, "height": img.height, "bytes": os.path.getsize(out_path), "hash": file_hash(out_path)}
+
+# build web variants of new/changed pictures and save them in the catalogue
+def build_variants(image_folder_path="geomindmap/pictures/", index_path=None, force=False):
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        raise SystemExit("Building image variants requires Pillow: pip install pillow")
+
+    index_path = index_path or os.path.join(image_folder_path, "index.json")
+    entries, _ = scan(image_folder_path, index_path)
+
+    t0 = time.time()
+    built = 0
+    for entry in entries:
+        name, pic_id = entry["file"], entry["id"]
+        paths = {v: os.path.join(image_folder_path, WEB_DIR, v, pic_id + ".webp") for v in VARIANTS}
+        if not force and "variants" in entry and all(os.path.exists(p) for p in paths.values()):
+            continue
+
+        with Image.open(os.path.join(image_folder_path, name)) as img:
+            # apply the EXIF rotation of smartphone photos, WebP output has no orientation tag
+            img = ImageOps.exif_transpose(img)
+            img = img.convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+            entry["variants"] = {}
+            for v, (max_side, quality) in VARIANTS.items():
+                info = write_variant(img, paths[v], max_side, quality)
+                # paths relative to index.html
+                entry["variants"][v] = {"path": f"pictures/{WEB_DIR}/{v}/{pic_id}.webp", **info}
+        built += 1
+        print(f"Built variants of {name}: " + ", ".join(f"{v} {i['bytes'] // 1024} KB" for v, i in entry["variants"].items()))
+
+    save_catalogue(entries, index_path)
+    print(f"{built} of {len(entries)} pictures rebuilt in {time.time() - t0:.1f} s, catalogue saved to {index_path}")
+    return entries
+
+
+if __name__ == "__main__":
+    build_variants()
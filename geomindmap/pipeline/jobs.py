@@ -0,0 +1,204 @@
+import os
+import io
+import json
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import images
+import runlog
+"""
+jobs.py
+-------
+This module is the job queue of the local pipeline service (server.py --jobs N).
+Uploaded pictures are added to the picture catalogue and processed by a bounded pool of
+worker threads in the long-lived server process, so provider clients (providers.py),
+the gazetteer and other caches stay warm across jobs, and no process or SDK starts per run.
+A job runs the selected stages of one picture with one model (main.process_single);
+its status shows the current stage, the duration of each finished stage and the result
+files in the data/ layout (data/<model>/<pic>/...). Process info of finished jobs is
+appended to data/<model>/info/service_<run_id>.jsonl, which analytics.py reads like
+any run log. Only the last max_finished finished jobs are kept in memory, older ones
+are evicted (GET /jobs/<id> answers 404, their results stay in data/).
+
+Class:
+- JobPool(workers, max_pending, picture_dir, max_finished): bounded job queue
+  - add_picture(data): store an upload as pictures/picN.png (same content: same picture)
+  - submit(pic, models, stages): one job per model, returns the job records
+  - get(job_id) / list(): job status records
+
+Functions:
+- to_png(data): PNG bytes of an uploaded image (other formats need Pillow)
+"""
+
+PICTURE_DIR = "geomindmap/pictures/"
+GPS_PATH = "geomindmap/pictures/gps.json"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# stages that compare with the ground truth in gps.json
+GROUND_TRUTH_STAGES = ("accuracy", "pattern")
+# result files of a job, in the data/ layout
+RESULT_FILES = [
+    "reasoning.json", "step_acc.json", "entity.json", "vi_map_info.json", "l_map_info.json",
+    "para_match.json", "vi_map_layout.json", "l_map_layout.json", "pattern.json",
+]
+
+# finished (done / failed / timed_out) job records kept for GET /jobs
+MAX_FINISHED = 500
+
+class QueueFull(Exception):
+    pass
+
+# PNG bytes of an uploaded image
+def to_png(data):
+    if data.startswith(PNG_SIGNATURE):
+        return data
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        raise ValueError("Only PNG uploads are supported without Pillow (pip install pillow)")
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img = ImageOps.exif_transpose(img)
+            out = io.BytesIO()
+            img.save(out, "PNG")
+    except OSError:
+        raise ValueError("Unsupported image format")
+    return out.getvalue()
+
+class JobPool:
+    def __init__(self, workers=2, max_pending=50, picture_dir=PICTURE_DIR, max_finished=MAX_FINISHED):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.picture_dir = picture_dir
+        self.jobs = {}
+        self.lock = threading.Lock()
+        # catalogue writes and index updates are not thread-safe
+        self.catalogue_lock = threading.Lock()
+        self.update_lock = threading.Lock()
+        self.run_id = runlog.new_run_id()
+        self.logs = {}
+        self.counter = 0
+
+    # store an upload as the next free picN.png; a known content returns the existing picture
+    def add_picture(self, data):
+        png = to_png(data)
+        tmp_path = os.path.join(self.picture_dir, f".upload{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(png)
+        digest = images.file_hash(tmp_path)
+        with self.catalogue_lock:
+            for name, entry in images.load_catalogue(os.path.join(self.picture_dir, "index.json")).items():
+                if isinstance(entry, dict) and entry.get("hash") == digest:
+                    os.remove(tmp_path)
+                    return name, False
+            numbers = [int(m.group(1)) for n in os.listdir(self.picture_dir) if (m := re.fullmatch(r"pic(\d+)\.png", n))]
+            name = f"pic{max(numbers, default=0) + 1}.png"
+            os.replace(tmp_path, os.path.join(self.picture_dir, name))
+            images.scan(self.picture_dir)
+        return name, True
+
+    # one job per model; a job already queued or running for the same picture and model is returned instead
+    def submit(self, pic, models, stages):
+        import main
+        unknown = [m for m in models if m not in main.REASONING]
+        if unknown:
+            raise ValueError(f"Unknown model(s): {', '.join(unknown)}")
+        unknown = [s for s in stages if s not in main.STAGES]
+        if unknown:
+            raise ValueError(f"Unknown stage(s): {', '.join(unknown)}")
+        if not os.path.exists(os.path.join(self.picture_dir, pic)):
+            raise ValueError(f"Unknown picture: {pic}")
+
+        skipped = []
+        with open(GPS_PATH, 'r', encoding='utf-8') as f:
+            if pic not in json.load(f):
+                skipped = [s for s in stages if s in GROUND_TRUTH_STAGES]
+        stages = [s for s in main.STAGES if s in stages and s not in skipped]
+
+        records = []
+        with self.lock:
+            active = {(j["picture"], j["model"]): j for j in self.jobs.values() if j["status"] in ("queued", "running")}
+            new = [m for m in models if (pic, m) not in active]
+            pending = sum(j["status"] == "queued" for j in self.jobs.values())
+            if pending + len(new) > self.max_pending:
+                raise QueueFull(f"{pending} jobs queued, limit {self.max_pending}")
+            for model in models:
+                if (pic, model) in active:
+                    records.append(active[(pic, model)])
+                    continue
+                self.counter += 1
+                job = {
+                    "id": f"{self.run_id}-{self.counter}",
+                    "picture": pic, "model": model, "stages": stages, "skipped": skipped,
+                    "status": "queued", "stage": None, "timings": {},
+                    "created": time.time(), "started": None, "finished": None,
+                    "info": None, "error": None, "files": {},
+                }
+                self.jobs[job["id"]] = job
+                records.append(job)
+                self.pool.submit(self.run, job)
+        return [self.view(j) for j in records]
+
+    def run(self, job):
+        import main
+        import analytics
+        import search_index
+        import location_tree
+        import gazetteer
+        job["status"], job["started"] = "running", time.time()
+        try:
+            result = main.process_single(job["picture"], job["model"], job["stages"], timings=job["timings"])
+            info = main.to_info(result, main.catalogue_hashes().get(job["picture"]))
+            with self.update_lock:
+                if job["model"] not in self.logs:
+                    self.logs[job["model"]] = runlog.RunLog(f"geomindmap/data/{job['model']}/info/service_{self.run_id}.jsonl")
+                self.logs[job["model"]].append(info)
+                # cross-picture indexes read all outputs, one update at a time
+                analytics.update()
+                search_index.update()
+                gazetteer.learn()
+                location_tree.update()
+            job["info"], job["status"] = info, "timed_out" if info["timed_out"] else "done"
+        except Exception as e:
+            job["error"], job["status"] = f"{type(e).__name__}: {e}", "failed"
+            print(f"Job {job['id']} ({job['picture']}, {job['model']}) failed: {job['error']}")
+        finally:
+            job["finished"] = time.time()
+            self.evict()
+
+    # drop the oldest finished jobs beyond max_finished
+    def evict(self):
+        with self.lock:
+            finished = sorted((j["finished"], job_id) for job_id, j in self.jobs.items() if j["finished"] is not None)
+            for _, job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+                del self.jobs[job_id]
+
+    # status record with current stage and result files
+    def view(self, job):
+        job = dict(job, timings=dict(job["timings"]))
+        if job["status"] == "running":
+            job["stage"] = next((s for s in job["stages"] if s not in job["timings"]), None)
+        pic_name = os.path.splitext(job["picture"])[0]
+        out_dir = f"geomindmap/data/{job['model']}/{pic_name}/"
+        # paths relative to index.html
+        job["files"] = {name: f"data/{job['model']}/{pic_name}/{name}" for name in RESULT_FILES
+                        if os.path.exists(out_dir + name)}
+        end = job["finished"] or time.time()
+        job["elapsed"] = end - job["started"] if job["started"] else None
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        return self.view(job) if job else None
+
+    def list(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [self.view(j) for j in jobs]
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        for log in self.logs.values():
+            log.close()
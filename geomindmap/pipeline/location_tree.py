@@ -0,0 +1,330 @@
+import os
+import json
+import glob
+import time
+import argparse
+from collections import Counter
+import numpy as np
+import gazetteer
+import hierarchy
+"""
+location_tree.py
+----------------
+This module merges the location maps (l_map_info.json) of all models and pictures into one
+global location tree with a stable radial layout, so the same place (e.g. Germany) is drawn
+at the same angle in every picture.
+Each node owns an angular sector inside its parent's sector; the node angle is the sector
+center. A rebuild partitions each sector among the children in proportion to their subtree
+sizes (observed fan-out) and keeps SLACK of it free at the end. A child inserted later takes
+one slot of the parent's unit width (sector width per subtree node) at the start of the
+largest free gap, so existing nodes never move and siblings stay evenly spaced. When a
+parent has no slot left, only its subtree is re-partitioned (rebalance); if its slots would
+get narrower than MIN_SIBLING_GAP, the grandparent's subtree is, and so on. Nodes outside
+that subtree keep their angles; the moved nodes are reported and recorded in "rebalances",
+and the projections of the pictures containing them are rewritten.
+Nodes are identified by the normalized gazetteer canonical name if known, otherwise by the
+normalized name, so a name learned by gazetteer.learn() keeps its key. A node keeps its first
+parent; a full rebuild uses the most common parent and orders siblings by frequency.
+
+Tree file (data/location_tree.json):
+    {"nodes": {key: {"name", "granularity", "parent", "lo", "hi", "angle", "unit", "children", "count"}},
+     "sources": {"<model>/<pic>": {"stamp": [mtime, size], "keys": [...]}},
+     "rebalances": [{"time", "parent", "moved": [...]}]}
+
+Functions:
+- insert(tree, l_map_info, source, gaz): insert the locations of one picture
+- update(data_dir, tree_path): incremental insertion of new/changed l_map_info.json files,
+  writes the projection l_map_global_layout.json of each inserted picture
+- rebuild(data_dir, tree_path): build the tree from scratch, sectors weighted by subtree size
+- rebalance(tree, key): re-partition the smallest subtree around key that fits one more child of key
+- project(tree, l_map_info, gaz): per-picture layout nodes positioned by the global angles
+- min_sibling_gap(tree): smallest angle between two siblings (python location_tree.py --check)
+"""
+
+TREE_PATH = "geomindmap/data/location_tree.json"
+ROOT = "__root__"
+FULL_CIRCLE = 2 * np.pi
+# share of each sector kept free for children inserted after a rebuild
+SLACK = 0.15
+# child slots of a node without children
+LEAF_SLOTS = 4
+# --check: smallest allowed angle between siblings (radians, 0.05 degrees)
+MIN_SIBLING_GAP = np.radians(0.05)
+
+class SlackExhausted(Exception):
+    pass
+
+def empty_tree():
+    return {"nodes": {ROOT: {"name": None, "granularity": 0, "parent": None, "lo": 0.0, "hi": FULL_CIRCLE,
+                             "angle": 0.0, "unit": FULL_CIRCLE / LEAF_SLOTS, "children": [], "count": 0}},
+            "sources": {}}
+
+# global key of a location name: normalized either way, so a name keeps its key when it gets learned
+def node_key(gaz, name):
+    return gazetteer.normalize(gazetteer.lookup(gaz, name) or name)
+
+# sector of a new child: one unit slot at the start of the largest free gap in the parent's sector
+# min_gap: narrowest allowed slot (0 once even the whole tree has been rebalanced)
+def allocate(tree, parent_key, min_gap=MIN_SIBLING_GAP):
+    parent = tree["nodes"][parent_key]
+    taken = sorted((tree["nodes"][c]["lo"], tree["nodes"][c]["hi"]) for c in parent["children"])
+    best, start = None, parent["lo"]
+    for lo, hi in taken + [(parent["hi"], parent["hi"])]:
+        if best is None or lo - start > best[1] - best[0]:
+            best = (start, lo)
+        start = max(start, hi)
+    lo, hi = best
+    unit = parent.get("unit") or (parent["hi"] - parent["lo"]) / LEAF_SLOTS
+    # the slack of the parent is used up (halving the gap again would crowd the siblings),
+    # or its slots are too narrow to tell siblings apart
+    if hi - lo < unit * (1 - 1e-9) or unit < min_gap:
+        raise SlackExhausted(parent_key)
+    return lo, lo + unit
+
+# add a node under its parent (parent must exist); moved: set of the keys moved by a rebalance
+def add_node(tree, key, name, granularity, parent_key, moved=None):
+    try:
+        lo, hi = allocate(tree, parent_key)
+    except SlackExhausted:
+        keys = rebalance(tree, parent_key)
+        if moved is not None:
+            moved.update(keys)
+        lo, hi = allocate(tree, parent_key, 0.0)
+    tree["nodes"][key] = {"name": name, "granularity": granularity, "parent": parent_key,
+                          "lo": lo, "hi": hi, "angle": (lo + hi) / 2, "unit": (hi - lo) / LEAF_SLOTS,
+                          "children": [], "count": 0}
+    tree["nodes"][parent_key]["children"].append(key)
+
+# partition the sector of a node among its children by subtree size, SLACK kept free at the end
+# reserve: {key: extra child slots} counted in the unit of that node (rebalance)
+def partition(tree, key, sizes, reserve=None):
+    node = tree["nodes"][key]
+    width = node["hi"] - node["lo"]
+    extra = (reserve or {}).get(key, 0)
+    if not node["children"]:
+        node["unit"] = width / LEAF_SLOTS
+        return
+    node["unit"] = width * (1 - SLACK) / (sum(sizes[c] for c in node["children"]) + extra)
+    lo = node["lo"]
+    for child_key in node["children"]:
+        child = tree["nodes"][child_key]
+        child["lo"], child["hi"] = lo, lo + node["unit"] * sizes[child_key]
+        child["angle"] = (child["lo"] + child["hi"]) / 2
+        lo = child["hi"]
+        partition(tree, child_key, sizes, reserve)
+
+# all keys of a subtree
+def descendants(tree, key):
+    keys = [key]
+    for child in tree["nodes"][key]["children"]:
+        keys += descendants(tree, child)
+    return keys
+
+# make room for one more child of key: re-partition the smallest enclosing subtree whose new
+# slots under key stay wider than MIN_SIBLING_GAP; returns the keys of the moved nodes
+def rebalance(tree, key):
+    nodes = tree["nodes"]
+    scope = key
+    # angles before the first partition (a wider scope re-partitions the narrower one again)
+    before = {}
+    while True:
+        for k in descendants(tree, scope):
+            before.setdefault(k, nodes[k]["angle"])
+        sizes = subtree_sizes(tree, scope)
+        # the pending child counts in the sizes of key and its ancestors up to scope
+        k = key
+        while True:
+            sizes[k] += 1
+            if k == scope:
+                break
+            k = nodes[k]["parent"]
+        partition(tree, scope, sizes, {key: 1})
+        if nodes[key]["unit"] >= MIN_SIBLING_GAP or scope == ROOT:
+            break
+        scope = nodes[scope]["parent"]
+    moved = sorted(k for k, angle in before.items() if abs(nodes[k]["angle"] - angle) > 1e-12)
+    tree.setdefault("rebalances", []).append({"time": time.time(), "parent": scope, "moved": moved})
+    print(f"Location tree: no free slot under {key}, rebalanced the subtree of {scope}, {len(moved)} nodes moved")
+    return moved
+
+# number of nodes in each subtree
+def subtree_sizes(tree, key=ROOT, sizes=None):
+    sizes = {} if sizes is None else sizes
+    sizes[key] = 1 + sum(subtree_sizes(tree, c, sizes)[c] for c in tree["nodes"][key]["children"])
+    return sizes
+
+# smallest angle between two siblings and their parent key
+def min_sibling_gap(tree):
+    gap, where = np.inf, None
+    for key, node in tree["nodes"].items():
+        angles = np.sort([tree["nodes"][c]["angle"] for c in node["children"]])
+        if len(angles) > 1 and np.diff(angles).min() < gap:
+            gap, where = float(np.diff(angles).min()), key
+    return gap, where
+
+# insert the locations of one picture, returns the keys of its nodes
+# moved: set collecting the keys of nodes moved by rebalances
+def insert(tree, l_map_info, source, gaz, moved=None):
+    nodes, _ = hierarchy.repair(l_map_info)
+    by_name = {n["entity"]: n for n in nodes}
+    keys = {}
+    # parents first: repaired parents are strictly coarser
+    for n in sorted(nodes, key=lambda n: n["granularity"]):
+        key = node_key(gaz, n["entity"])
+        keys[n["entity"]] = key
+        if key in tree["nodes"]:
+            continue
+        parent_key = keys.get(n["parent"], ROOT) if n["parent"] in by_name else ROOT
+        # a node must not hang below itself (two names with the same key)
+        if parent_key == key:
+            parent_key = ROOT
+        add_node(tree, key, n["entity"], n["granularity"], parent_key, moved)
+    for key in set(keys.values()):
+        tree["nodes"][key]["count"] += 1
+    return sorted(set(keys.values()))
+
+# per-picture layout nodes at the global angles, radius = granularity of the picture
+def project(tree, l_map_info, gaz):
+    nodes, _ = hierarchy.repair(l_map_info)
+    layout = []
+    for n in nodes:
+        node = tree["nodes"].get(node_key(gaz, n["entity"]))
+        theta = node["angle"] if node else 0.0
+        r = n["granularity"]
+        layout.append({**n, "angle": theta, "x": r * np.cos(theta), "y": r * np.sin(theta)})
+    return layout
+
+def load_tree(tree_path=TREE_PATH):
+    if os.path.exists(tree_path):
+        with open(tree_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return empty_tree()
+
+def save_tree(tree, tree_path=TREE_PATH):
+    with open(tree_path, 'w', encoding='utf-8') as f:
+        json.dump(tree, f, ensure_ascii=False)
+
+# l_map_info.json files: {"<model>/<pic>": path}
+def list_sources(data_dir):
+    sources = {}
+    for path in sorted(glob.glob(os.path.join(data_dir, "*", "pic*", "l_map_info.json"))):
+        pic_dir = os.path.dirname(path)
+        sources[f"{os.path.basename(os.path.dirname(pic_dir))}/{os.path.basename(pic_dir)}"] = path
+    return sources
+
+def read_nodes(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# write the global projection next to l_map_layout.json
+def write_projection(tree, path, gaz, nodes=None):
+    layout = project(tree, nodes if nodes is not None else read_nodes(path), gaz)
+    with open(os.path.join(os.path.dirname(path), "l_map_global_layout.json"), 'w', encoding='utf-8') as f:
+        json.dump(layout, f, indent=2, ensure_ascii=False)
+
+# incremental update with new or changed pictures
+def update(data_dir="geomindmap/data/", tree_path=TREE_PATH):
+    t0 = time.time()
+    gaz = gazetteer.load_gazetteer()
+    tree = load_tree(tree_path)
+    inserted = 0
+    moved = set()
+    sources = list_sources(data_dir)
+    for source, path in sources.items():
+        stamp = [os.path.getmtime(path), os.path.getsize(path)]
+        old = tree["sources"].get(source)
+        if old is not None and old["stamp"] == stamp:
+            continue
+        try:
+            nodes = read_nodes(path)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Skip {path}: {e}")
+            continue
+        # changed picture: its old nodes stay in place, only their counts drop
+        for key in old["keys"] if old else []:
+            if key in tree["nodes"]:
+                tree["nodes"][key]["count"] -= 1
+        keys = insert(tree, nodes, source, gaz, moved)
+        tree["sources"][source] = {"stamp": stamp, "keys": keys}
+        write_projection(tree, path, gaz, nodes)
+        inserted += 1
+    # pictures with nodes moved by a rebalance get a new projection
+    if moved:
+        redrawn = [s for s, entry in tree["sources"].items() if moved & set(entry["keys"]) and s in sources]
+        for source in redrawn:
+            write_projection(tree, sources[source], gaz)
+        print(f"Location tree: {len(moved)} nodes moved ({', '.join(sorted(moved)[:10])}{', ...' if len(moved) > 10 else ''}), "
+              f"{len(redrawn)} projections rewritten")
+    if inserted:
+        save_tree(tree, tree_path)
+    print(f"Location tree: {len(tree['nodes']) - 1} nodes, {inserted} pictures inserted in {time.time() - t0:.2f} s")
+    return tree
+
+# build from scratch: most common parent, sectors weighted by subtree size, frequent siblings first
+def rebuild(data_dir="geomindmap/data/", tree_path=TREE_PATH):
+    t0 = time.time()
+    gaz = gazetteer.load_gazetteer()
+    sources = list_sources(data_dir)
+    pictures = {}
+    count, parents, names, granularity = Counter(), {}, {}, {}
+    for source, path in sources.items():
+        try:
+            nodes, _ = hierarchy.repair(read_nodes(path))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Skip {path}: {e}")
+            continue
+        pictures[source] = (path, nodes)
+        by_name = {n["entity"]: n for n in nodes}
+        for n in nodes:
+            key = node_key(gaz, n["entity"])
+            count[key] += 1
+            parent = node_key(gaz, n["parent"]) if n["parent"] in by_name else ROOT
+            parents.setdefault(key, Counter())[parent if parent != key else ROOT] += 1
+            names.setdefault(key, Counter())[n["entity"]] += 1
+            granularity.setdefault(key, Counter())[n["granularity"]] += 1
+
+    tree = empty_tree()
+    def place(key, seen=()):
+        if key in tree["nodes"]:
+            return
+        parent = parents[key].most_common(1)[0][0]
+        # most common parents can form a cycle across pictures: fall back to the root
+        if parent in seen or parent not in count:
+            parent = ROOT
+        if parent != ROOT:
+            place(parent, seen + (key,))
+        tree["nodes"][key] = {"name": names[key].most_common(1)[0][0], "granularity": granularity[key].most_common(1)[0][0],
+                              "parent": parent, "lo": 0.0, "hi": 0.0, "angle": 0.0, "unit": 0.0,
+                              "children": [], "count": count[key]}
+        tree["nodes"][parent]["children"].append(key)
+
+    # coarse levels first, then by frequency: siblings ordered by frequency
+    for key in sorted(count, key=lambda k: (granularity[k].most_common(1)[0][0], -count[k], k)):
+        place(key)
+    partition(tree, ROOT, subtree_sizes(tree))
+    for source, (path, nodes) in pictures.items():
+        tree["sources"][source] = {"stamp": [os.path.getmtime(path), os.path.getsize(path)],
+                                   "keys": sorted({node_key(gaz, n["entity"]) for n in nodes})}
+        write_projection(tree, path, gaz, nodes)
+    save_tree(tree, tree_path)
+    gap, where = min_sibling_gap(tree)
+    print(f"Location tree rebuilt: {len(tree['nodes']) - 1} nodes from {len(pictures)} pictures in {time.time() - t0:.2f} s, "
+          f"smallest sibling gap {np.degrees(gap):.3f} degrees (under {where})")
+    return tree
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the global location tree.")
+    parser.add_argument("--rebuild", action="store_true", help="build the tree from scratch")
+    parser.add_argument("--check", action="store_true",
+                        help=f"fail if two siblings are closer than {np.degrees(MIN_SIBLING_GAP):g} degrees")
+    args = parser.parse_args()
+    if args.rebuild or not os.path.exists(TREE_PATH):
+        tree = rebuild()
+    else:
+        tree = update()
+    if args.check:
+        gap, where = min_sibling_gap(tree)
+        print(f"Smallest sibling gap: {np.degrees(gap):.4f} degrees (children of {where})")
+        if gap < MIN_SIBLING_GAP:
+            raise SystemExit(f"Siblings closer than {np.degrees(MIN_SIBLING_GAP):g} degrees")
@@ -3,8 +3,24 @@ import reasoning
 import extract
 import match
 import coordinate
+import analytics
+import search_index
+import location_tree
+import gazetteer
+import workqueue
+import runlog
+import routing
+import images
+import hedging
+import batch_eval
 import os
 import json
+import zlib
+import fnmatch
+import glob
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 """
 main.py
 -------
@@ -15,24 +31,144 @@ Steps for each image:
 3. Extract entities + vi_map + l_map
 4. Match entities to paragraphs
 5. Compute layout coordinates
-6. Save process info (tokens, time, accuracy)
+6. Detect reasoning pattern (BF/DF/Switch)
+7. Save process info (tokens, time, accuracy)
+
+Usage (from repository root):
+    python geomindmap/pipeline/main.py --model claude gemini --pics "pic1*" --workers 4 --shard 0/2
 
 Functions:
-- build_pic_list(image_folder_path): build index.json of available images
-- process_single(pic, model): run pipeline on one image
-- batch(pic_list, model): run pipeline on multiple images
+- build_pic_list(image_folder_path): incremental picture catalogue in index.json (hash, size, dimensions, gps)
+- plan_changed(pic_list, model): pictures whose catalogue entry changed since the model's last run
+- dedup(pic_list, model, reuse): flag planned pictures that are near-duplicates (perceptual hash) of
+  pictures the model already processed; with reuse, copy their results instead of processing
+- process_single(pic, model, stages, image, ground_truth, timings): run selected pipeline stages on one image,
+  optionally recording the duration of each stage; a stage past its deadline (--stage-deadline,
+  --image-deadline) is recorded as timed_out and the remaining stages are skipped
+- batch(pic_list, model, run_id, stages, workers, eval_batch): run pipeline on multiple images in worker processes,
+  process info is appended to info/<first>_to_<last>_<run_id>.jsonl and compacted to the summary json;
+  with eval_batch, accuracy and pattern of eval_batch finished pictures are evaluated in one request
+- batch_evaluate(pending, model, stages, batch_size): batched accuracy / pattern of finished pictures (batch_eval.py)
+- process_fanout(pic, models, stages): one image to several models concurrently, image encoding
+  and ground truth lookup are shared, each model runs its downstream chain independently
+- batch_fanout(pic_list, models, run_id, stages, workers, plans): batch of fan-out runs, each picture
+  goes only to the models whose plan (--changed / --dedup) contains it and that have not logged it;
+  a model that fails is recorded with an error for that picture, retried on resume
+- batch_queue(plans, queue_path, stages, workers): drain a shared lease-based work queue of
+  (model, picture, stage) items, so several machines can share one run
+- select_pictures(all_pic_list, patterns, shard): select pictures by globs and deterministic shard i/N
+- parse_args(argv): command line options
+- run(args): run the pipeline with parsed options (command line and server.py --run)
 """
-# build picture menu list and save as index.json
-def build_pic_list(image_folder_path):
-    all_files = os.listdir(image_folder_path)
-    image_names = [file for file in all_files if file.endswith('.png')]
-    with open(image_folder_path + "index.json", 'w', encoding='utf-8') as f:
-        json.dump(image_names, f, indent=4, ensure_ascii=False)
-    print(f"Pictures list is saved to {image_folder_path + 'index.json'}")
-    return image_names
+# incremental picture catalogue in index.json, returns new/changed/removed pictures
+def build_pic_list(image_folder_path="geomindmap/pictures/"):
+    entries, diff = images.scan(image_folder_path)
+    print(f"Pictures catalogue is saved to {image_folder_path + 'index.json'}")
+    return diff
+
+# content hash of each picture file name, from the catalogue
+def catalogue_hashes(index_path="geomindmap/pictures/index.json"):
+    return {name: e.get("hash") for name, e in images.load_catalogue(index_path).items() if isinstance(e, dict)}
+
+# pictures whose catalogue entry changed since the last run of a model
+def plan_changed(pic_list, model, index_path="geomindmap/pictures/index.json"):
+    """
+    The hash recorded in the model's process info is compared with the catalogue hash.
+    Pictures without a recorded hash count as done if their reasoning output exists
+    (runs from before the catalogue), and as new otherwise. Pictures whose last run hit a
+    stage deadline are processed again.
+    """
+    hashes = catalogue_hashes(index_path)
+    info_dir = f"geomindmap/data/{model}/info/"
+    last = {}
+    paths = glob.glob(info_dir + "*.json") + glob.glob(info_dir + "*.jsonl")
+    for path in sorted(paths, key=runlog.run_order):
+        if path.endswith(".jsonl"):
+            records = runlog.read_log(path)
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        for r in records if isinstance(records, list) else []:
+            if isinstance(r, dict) and r.get("hash"):
+                # a timed-out picture is not done
+                last[r["picture"]] = None if r.get("timed_out") else r["hash"]
+
+    todo = []
+    for pic in pic_list:
+        pic_name = os.path.splitext(pic)[0]
+        if pic_name in last:
+            if last[pic_name] != hashes.get(pic):
+                todo.append(pic)
+        elif not os.path.exists(f"geomindmap/data/{model}/{pic_name}/reasoning.json"):
+            todo.append(pic)
+    print(f"{model}: {len(todo)} of {len(pic_list)} pictures changed since the last run")
+    return todo
+
+# near-duplicates of planned pictures: {pic: (processed picture, distance)}, plus pairs inside the plan
+def find_duplicates(pic_list, model, index_path="geomindmap/pictures/index.json"):
+    catalogue = images.load_catalogue(index_path)
+    # perceptual hashes are added by the catalogue scan
+    if any(not isinstance(catalogue.get(pic), dict) or "phash" not in catalogue[pic] for pic in pic_list):
+        build_pic_list(os.path.dirname(index_path) + "/")
+        catalogue = images.load_catalogue(index_path)
+    planned = set(pic_list)
+    found, inside = {}, []
+    for a, b, dist in images.near_duplicates(list(catalogue.values())):
+        if a in planned and b in planned:
+            inside.append((a, b, dist))
+            continue
+        pic, other = (a, b) if a in planned else (b, a)
+        if pic not in planned or os.path.splitext(pic)[0] == os.path.splitext(other)[0]:
+            continue
+        if os.path.exists(f"geomindmap/data/{model}/{os.path.splitext(other)[0]}/reasoning.json"):
+            if pic not in found or dist < found[pic][1]:
+                found[pic] = (other, dist)
+    return found, inside
+
+# copy the results of a processed near-duplicate, linked by duplicate_of.json
+def reuse_results(pic, source, model, distance):
+    source_dir = f"geomindmap/data/{model}/{os.path.splitext(source)[0]}/"
+    output_dir = f"geomindmap/data/{model}/{os.path.splitext(pic)[0]}/"
+    shutil.copytree(source_dir, output_dir, dirs_exist_ok=True,
+                    ignore=shutil.ignore_patterns("duplicate_of.json", "*.tmp*"))
+    with open(output_dir + "duplicate_of.json", 'w', encoding='utf-8') as f:
+        json.dump({"picture": os.path.splitext(source)[0], "distance": distance}, f, indent=2)
+
+# flag near-duplicates before a batch; with reuse, their results are copied and they leave the plan
+def dedup(pic_list, model, reuse=False):
+    found, inside = find_duplicates(pic_list, model)
+    for a, b, dist in inside:
+        print(f"{model}: {a} and {b} are near-duplicates (distance {dist}), both are processed")
+    for pic, (other, dist) in sorted(found.items()):
+        action = "results reused" if reuse else "processed again (use --dedup reuse to skip)"
+        print(f"{model}: {pic} is a near-duplicate of {other} (distance {dist}), {action}")
+        if reuse:
+            reuse_results(pic, other, model, dist)
+    return [pic for pic in pic_list if pic not in found] if reuse else pic_list
+
+# reasoning function of each model
+REASONING = {
+    "chatgpt": reasoning.reasoning_chatgpt,
+    "claude": reasoning.reasoning_claude,
+    "gemini": reasoning.reasoning_gemini,
+    "gemini_genai": reasoning.reasoning_gemini_genai,
+    "gpt5": reasoning.reasoning_gpt5,
+    "qwen": reasoning.reasoning_qwen,
+}
+# pipeline stages in order
+STAGES = ["reasoning", "accuracy", "extract", "match", "layout", "pattern"]
+
+# record the duration of a finished stage in timings (if given), return the current time
+def stage_done(timings, stage, t_start):
+    now = time.time()
+    if timings is not None:
+        timings[stage] = now - t_start
+    return now
 
 # process single image
-def process_single(pic,model):
+# image / ground_truth: shared preprocessing from prepare(), loaded here if not given
+# timings: dict filled with the duration of each stage as soon as it finishes
+def process_single(pic, model, stages=STAGES, image=None, ground_truth=None, timings=None):
         
         pic_name = os.path.splitext(pic)[0]
         
@@ -41,30 +177,60 @@ def process_single(pic,model):
         print(f"Image Path: {image_path}")
         print(f"Output Directory: {output_dir}")
         
-        t0 = time.time()
+        t0 = t_stage = time.time()
+        tokens_reasoning_paragraph, response_tokens, reasoning_tokens, response_time = 0, 0, 0, 0
+        tokens_extract, tokens_match = 0, 0
+        accuracy = None
+        # stage deadlines (hedging.py): a timed-out stage is recorded and the remaining stages are skipped
+        image_end = hedging.image_deadline()
+        timed_out = None
         
-        # Step 1: choose model and generate reasoning response and segmentation
-        if model == "chatgpt":
-            tokens_reasoning_paragraph, response_tokens, reasoning_tokens, response_time = reasoning.reasoning_chatgpt(image_path, output_dir)
-        elif model == "claude":
-            tokens_reasoning_paragraph, response_tokens, reasoning_tokens, response_time = reasoning.reasoning_claude(image_path, output_dir)
-        elif model == "gemini":
-            tokens_reasoning_paragraph, response_tokens, reasoning_tokens, response_time = reasoning.reasoning_gemini(image_path, output_dir)
-        
-        # Evaluate reasoning accuracy/correctness in Granularity Score
-        accuracy, tokens_acc = reasoning.step_accuracy(output_dir + "reasoning.json", "geomindmap/pictures/gps.json", pic, output_dir)
-        
-        
-        # Step 2: extract entities and build map layout info
-        tokens_extract = extract.extract(image_path, output_dir + "reasoning.json", output_dir)
+        try:
+            # Step 1: choose model and generate reasoning response and segmentation
+            if "reasoning" in stages:
+                with hedging.stage("reasoning", image_end):
+                    tokens_reasoning_paragraph, response_tokens, reasoning_tokens, response_time = REASONING[model](image_path, output_dir, image)
+                t_stage = stage_done(timings, "reasoning", t_stage)
+            
+            # Evaluate reasoning accuracy/correctness in Granularity Score
+            if "accuracy" in stages:
+                with hedging.stage("accuracy", image_end):
+                    accuracy, tokens_acc = reasoning.step_accuracy(output_dir + "reasoning.json", "geomindmap/pictures/gps.json", pic, output_dir, ground_truth)
+                t_stage = stage_done(timings, "accuracy", t_stage)
+            elif os.path.exists(output_dir + "step_acc.json"):
+                with open(output_dir + "step_acc.json", 'r', encoding='utf-8') as f:
+                    accuracy = json.load(f)[-1]['accuracy']
+            
+            
+            # Step 2: extract entities and build map layout info
+            if "extract" in stages:
+                with hedging.stage("extract", image_end):
+                    tokens_extract = extract.extract(image_path, output_dir + "reasoning.json", output_dir, image["base64"] if image else None)
+                t_stage = stage_done(timings, "extract", t_stage)
 
-        # Step 3: match entities to paragraphs
-        tokens_match = match.match(output_dir + "entity.json", output_dir + "reasoning.json", output_dir)
-        
-        # Step 4: calculate coordinates for map layout
-        coordinate.calculate_coordinates(output_dir + "vi_map_info.json", output_dir, "vi")
-        coordinate.calculate_coordinates(output_dir + "l_map_info.json", output_dir, "l")
-        t4 = time.time()
+            # Step 3: match entities to paragraphs
+            if "match" in stages:
+                with hedging.stage("match", image_end):
+                    tokens_match = match.match(output_dir + "entity.json", output_dir + "reasoning.json", output_dir)
+                t_stage = stage_done(timings, "match", t_stage)
+            
+            # Step 4: calculate coordinates for map layout
+            if "layout" in stages:
+                coordinate.calculate_coordinates(output_dir + "vi_map_info.json", output_dir, "vi")
+                coordinate.calculate_coordinates(output_dir + "l_map_info.json", output_dir, "l")
+                t_stage = stage_done(timings, "layout", t_stage)
+            t4 = time.time()
+
+            # detect reasoning pattern and save to pattern.json
+            if "pattern" in stages:
+                with hedging.stage("pattern", image_end):
+                    reasoning.detect_pattern(output_dir + "reasoning.json", "geomindmap/pictures/gps.json", pic, output_dir, ground_truth)
+                t_stage = stage_done(timings, "pattern", t_stage)
+        except hedging.StageTimeout as e:
+            timed_out, t4 = e.stage, time.time()
+            if timings is not None:
+                timings[e.stage] = None
+            print(f"{pic_name} ({model}): {e}, remaining stages skipped")
         
         # Print time and token usage
         
@@ -76,63 +242,292 @@ def process_single(pic,model):
         
         print(f"Finished! {pic_name} is done.")
 
-        return pic_name, tokens_total, t_total, reasoning_tokens, response_tokens, response_time, accuracy
+        return pic_name, tokens_total, t_total, reasoning_tokens, response_tokens, response_time, accuracy, timed_out
+
+# shared preprocessing of one image: encoded image + ground truth
+def prepare(pic):
+    image = reasoning.load_image(f"geomindmap/pictures/{pic}")
+    ground_truth = None
+    with open("geomindmap/pictures/gps.json", 'r', encoding='utf-8') as f:
+        if pic in json.load(f):
+            ground_truth = reasoning.load_ground_truth("geomindmap/pictures/gps.json", pic)
+    return image, ground_truth
+
+# fan out one image to several models concurrently, each model continues its own chain
+# returns {model: result} and {model: error message} of the models that raised, the others still finish
+def process_fanout(pic, models, stages=STAGES):
+    image, ground_truth = prepare(pic)
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=len(models)) as pool:
+        futures = {pool.submit(process_single, pic, model, stages, image, ground_truth): model for model in models}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                errors[futures[future]] = f"{type(e).__name__}: {e}"
+    return results, errors
+
+# process info record of process_single result
+# picture_hash: catalogue content hash of the processed picture, used by plan_changed()
+# timed_out: stage that exceeded its deadline (the picture is processed again by --changed)
+def to_info(result, picture_hash=None):
+    pic_name, tokens_total, t_total, reasoning_tokens, response_tokens, response_time, accuracy, timed_out = result
+    return {
+        "picture": pic_name,
+        "hash": picture_hash,
+        # tokens & time of pipeline
+        "tokens_total": tokens_total, 
+        "time_total": t_total,
+        # tokens & time of reasoning response generation
+        "tokens_response": response_tokens,
+        "tokens_reasoning": reasoning_tokens, 
+        "time_response": response_time,
+        "accuracy": accuracy,
+        "timed_out": timed_out
+    }
+
+# batched accuracy / pattern of finished pictures, completes their process info records
+# pending: (pic, info) pairs; pictures without ground truth get no accuracy, timed-out pictures are skipped
+def batch_evaluate(pending, model, stages, batch_size):
+    with open("geomindmap/pictures/gps.json", 'r', encoding='utf-8') as f:
+        gps = json.load(f)
+    pics = [pic for pic, info in pending if not info["timed_out"]]
+    if "accuracy" in stages:
+        results = batch_eval.step_accuracy_batch([pic for pic in pics if pic in gps], model, batch_size)
+        for pic, info in pending:
+            if pic in results:
+                info["accuracy"] = results[pic][0]
+    if "pattern" in stages and pics:
+        batch_eval.detect_pattern_batch(pics, model, batch_size)
+    return [info for pic, info in pending]
 
 # process a batch of images and save process info
-def batch(pic_list, model):
+def batch(pic_list, model, run_id=None, stages=STAGES, workers=1, eval_batch=0):
 
     print('Hello')
-    results = []
 
-    # save info to a json file
+    # append-only run log, compacted to the summary json at the end
+    # pass the run_id of an interrupted run to resume it
+    if run_id is None:
+        run_id = runlog.new_run_id()
     first_name = os.path.splitext(pic_list[0])[0]
     last_name = os.path.splitext(pic_list[-1])[0]
-    out_file = f"geomindmap/data/{model}/info/{first_name}_to_{last_name}.json"
+    log_file = f"geomindmap/data/{model}/info/{first_name}_to_{last_name}_{run_id}.jsonl"
+    out_file = f"geomindmap/data/{model}/info/{first_name}_to_{last_name}_{run_id}.json"
+    done = {r["picture"] for r in runlog.read_log(log_file)}
+    todo = [pic for pic in pic_list if os.path.splitext(pic)[0] not in done]
+    print(f"Run ID: {run_id}, {len(done)} pictures already done, {len(todo)} to process with {workers} worker(s)")
+
+    # batched evaluation: accuracy / pattern run after the other stages, eval_batch pictures per request
+    eval_stages = [s for s in ("accuracy", "pattern") if s in stages] if eval_batch else []
+    pic_stages = [s for s in stages if s not in eval_stages]
+    pending = []
 
     # process each picture and collect token usage and time info
-    for pic in pic_list:
-        pic_name, tokens_total, t_total, reasoning_tokens, response_tokens, response_time, accuracy = process_single(pic,model)
-        info = {
-            "picture": pic_name,
-            # tokens & time of pipeline
-            "tokens_total": tokens_total, 
-            "time_total": t_total,
-            # tokens & time of reasoning response generation
-            "tokens_response": response_tokens,
-            "tokens_reasoning": reasoning_tokens, 
-            "time_response": response_time,
-            "accuracy": accuracy
-        }
-        results.append(info)
-        with open(out_file, "w", encoding="utf-8") as f:
-            json.dump(results, f, indent=4, ensure_ascii=False)
-        
+    hashes = catalogue_hashes()
+    with runlog.RunLog(log_file) as log, ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_single, pic, model, pic_stages): pic for pic in todo}
+        for n, future in enumerate(as_completed(futures), 1):
+            info = to_info(future.result(), hashes.get(futures[future]))
+            if not eval_stages:
+                finished = [info]
+            else:
+                # logged once evaluated, so an interrupted run evaluates them again on resume
+                pending.append((futures[future], info))
+                if len(pending) < eval_batch and n < len(futures):
+                    continue
+                finished, pending = batch_evaluate(pending, model, eval_stages, eval_batch), []
+            for info in finished:
+                log.append(info)
+            # update cross-model analytics, search index, learned gazetteer and global location tree with the finished picture
+            analytics.update()
+            search_index.update()
+            gazetteer.learn()
+            location_tree.update()
+
+    runlog.compact(log_file, out_file)
     print(f"All finished! Process info is saved to {out_file}")        
+    return run_id
 
+# process a batch of images, each image fanned out to all models
+# plans: {model: pictures to process} (None: every model processes every picture)
+def batch_fanout(pic_list, models, run_id=None, stages=STAGES, workers=1, plans=None):
 
+    if run_id is None:
+        run_id = runlog.new_run_id()
+    first_name = os.path.splitext(pic_list[0])[0]
+    last_name = os.path.splitext(pic_list[-1])[0]
+    paths = {
+        model: f"geomindmap/data/{model}/info/{first_name}_to_{last_name}_{run_id}"
+        for model in models
+    }
+    # models of each picture: those whose plan contains it and that have not logged it yet
+    # (failure records are not done, a resumed run retries them)
+    logged = {m: {r["picture"] for r in runlog.read_log(paths[m] + ".jsonl") if "error" not in r} for m in models}
+    todo = {}
+    for pic in pic_list:
+        pending = [m for m in models if (plans is None or pic in plans[m]) and os.path.splitext(pic)[0] not in logged[m]]
+        if pending:
+            todo[pic] = pending
+    print(f"Run ID: {run_id}, fan-out to {', '.join(models)}, {len(todo)} pictures to process with {workers} worker(s)")
 
-if __name__ == "__main__":
-    
-    # read picture list
-    with open("geomindmap/pictures/index.json", 'r', encoding='utf-8') as f:
-        all_pic_list = json.load(f)
-
-    # define the list of pictures to process
-    pic_list =[
-    "pic101.png",
-    "pic34.png",
-    "pic38.png"
-    ]
-    
-    # batch process to generate GeoMindMap in pipeline
-    batch(pic_list,"claude")
+    logs = {model: runlog.RunLog(paths[model] + ".jsonl") for model in models}
+    try:
+        hashes = catalogue_hashes()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(process_fanout, pic, pending, stages): pic for pic, pending in todo.items()}
+            for future in as_completed(futures):
+                pic = futures[future]
+                results, errors = future.result()
+                for model, result in results.items():
+                    logs[model].append(to_info(result, hashes.get(pic)))
+                # one failed model does not abort the run, its picture is recorded as failed
+                for model, error in errors.items():
+                    print(f"{pic} failed for {model}: {error}")
+                    logs[model].append({"picture": os.path.splitext(pic)[0], "error": error})
+                analytics.update()
+                search_index.update()
+                gazetteer.learn()
+                location_tree.update()
+    finally:
+        for log in logs.values():
+            log.close()
 
-    # detect reasoning pattern and save to reasoning.json
-    for pic in pic_list:
-        pic_name = os.path.splitext(pic)[0]
-        reasoning.detect_pattern(f"geomindmap/data/claude/{pic_name}/reasoning.json", "geomindmap/pictures/gps.json", pic, f"geomindmap/data/claude/{pic_name}/")
-    
-    
+    for model in models:
+        runlog.compact(paths[model] + ".jsonl", paths[model] + ".json")
+    print(f"All finished! Process info is saved to {', '.join(p + '.json' for p in paths.values())}")
+    return run_id
+
+# run one work queue item: a single stage of one picture
+def run_queue_item(item):
+    result = process_single(item["picture"], item["model"], [item["stage"]])
+    if result[-1]:
+        # released for another attempt (up to max_attempts), like a failed stage
+        raise TimeoutError(f"{result[-1]} of {item['picture']} exceeded its deadline")
+    return to_info(result, catalogue_hashes().get(item["picture"]))
+
+# drain a shared work queue with worker processes, then save the process info of all done items
+def batch_queue(plans, queue_path=workqueue.QUEUE_PATH, stages=STAGES, workers=1):
+    queue = workqueue.WorkQueue(queue_path)
+    for model, pic_list in plans.items():
+        queue.enqueue([model], pic_list, stages)
+    print(f"Queue status: {queue.status()}")
 
+    # each worker process leases items until the queue is finished (also items of other nodes)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(workqueue.drain, queue_path, run_queue_item) for _ in range(workers)]
+        for future in as_completed(futures):
+            future.result()
 
-    
\ No newline at end of file
+    name = os.path.splitext(os.path.basename(queue_path))[0]
+    for model in plans:
+        out_file = f"geomindmap/data/{model}/info/queue_{name}.json"
+        os.makedirs(os.path.dirname(out_file), exist_ok=True)
+        runlog.atomic_write_json(out_file, queue.info(model))
+        print(f"Process info of {model} is saved to {out_file}")
+    print(f"Queue status: {queue.status()}")
+    queue.close()
+    analytics.update()
+    search_index.update()
+    gazetteer.learn()
+    location_tree.update()
+
+# read picture names from index.json (file names or manifest entries of images.py)
+def load_pic_index(index_path="geomindmap/pictures/index.json"):
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return [images.entry_name(e) for e in json.load(f)]
+
+# select pictures by glob patterns and shard "i/N"
+def select_pictures(all_pic_list, patterns=("*",), shard=None):
+    pic_list = [pic for pic in all_pic_list if any(fnmatch.fnmatch(pic, p) or fnmatch.fnmatch(os.path.splitext(pic)[0], p) for p in patterns)]
+    if shard:
+        # stable hash of the file name: shards never overlap and do not move when pictures are added
+        i, n = (int(x) for x in shard.split("/"))
+        if not 0 <= i < n:
+            raise ValueError(f"shard must be i/N with 0 <= i < N, got {shard}")
+        pic_list = [pic for pic in pic_list if zlib.crc32(pic.encode("utf-8")) % n == i]
+    return pic_list
+
+# command line arguments
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the GeoMindMap pipeline on a batch of pictures.")
+    parser.add_argument("--model", "-m", nargs="+", default=["chatgpt"], choices=sorted(REASONING),
+                        help="reasoning model(s), each model runs as a separate batch")
+    parser.add_argument("--pics", "-p", nargs="+", default=["*"],
+                        help="picture name globs, e.g. pic1* 'pic4?.png' (default: all in index.json)")
+    parser.add_argument("--stages", "-s", nargs="+", default=STAGES, choices=STAGES,
+                        help="pipeline stages to run (default: all)")
+    parser.add_argument("--workers", "-w", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--shard", help="process only shard i of N, e.g. 0/4")
+    parser.add_argument("--fanout", action="store_true",
+                        help="send each image to all models concurrently with shared preprocessing")
+    parser.add_argument("--run-id", help="resume the run with this id")
+    parser.add_argument("--queue", nargs="?", const=workqueue.QUEUE_PATH,
+                        help="drain a shared lease-based work queue (SQLite file, default data/queue.sqlite); "
+                             "several machines can run the same command on a shared file")
+    parser.add_argument("--changed", action="store_true",
+                        help="rescan the picture catalogue and process only pictures changed since the last run")
+    parser.add_argument("--routing", default=routing.DEFAULT_POLICY, choices=sorted(routing.POLICIES),
+                        help="model/effort routing policy of the helper LLM calls")
+    parser.add_argument("--match-mode", default=match.MATCH_MODE, choices=match.MODES,
+                        help="full: chained requests with all entities; pruned: prefiltered entities per paragraph, "
+                             "check it first with match.py --compare-modes (default: full)")
+    parser.add_argument("--dedup", default="flag", choices=["flag", "reuse", "off"],
+                        help="near-duplicates of processed pictures: flag them, reuse their results, or ignore")
+    parser.add_argument("--hedge", default=os.getenv("GEOMINDMAP_HEDGE", "off"),
+                        help="duplicate an LLM call still running after this percentile of its stage's "
+                             "historical latency, e.g. 90; each duplicate is a paid request (default off)")
+    parser.add_argument("--stage-deadline", default=os.getenv("GEOMINDMAP_STAGE_DEADLINE", ""),
+                        help="seconds per stage before it is recorded as timed out, e.g. 600 or reasoning=900,match=300")
+    parser.add_argument("--image-deadline", type=float, default=float(os.getenv("GEOMINDMAP_IMAGE_DEADLINE") or 0),
+                        help="seconds for all stages of one picture (0: no limit)")
+    parser.add_argument("--batch-eval", type=int, default=0, metavar="N",
+                        help="evaluate accuracy and pattern of N finished pictures per request (batch_eval.py); "
+                             "not with --fanout / --queue")
+    args = parser.parse_args(argv)
+    # fan-out and queue workers log each picture as it finishes, there is nothing to batch
+    if args.batch_eval and (args.fanout or args.queue):
+        parser.error("--batch-eval cannot be combined with --fanout or --queue")
+    if args.batch_eval < 0:
+        parser.error("--batch-eval must be a positive number of pictures")
+    return args
+
+
+# run the pipeline with the options of parse_args(); returns the selected pictures
+def run(args):
+    # worker processes read the policy from the environment
+    routing.set_policy(args.routing)
+    os.environ["GEOMINDMAP_ROUTING"] = args.routing
+    match.set_mode(args.match_mode)
+    hedging.set_config(args.hedge, args.stage_deadline, args.image_deadline)
+
+    # read picture list and select pictures to process
+    if args.changed:
+        build_pic_list()
+    pic_list = select_pictures(load_pic_index(), args.pics, args.shard)
+    if not pic_list:
+        print("No pictures selected")
+        return pic_list
+    print(f"Selected {len(pic_list)} pictures")
+    # pictures per model, only changed ones with --changed
+    plans = {model: plan_changed(pic_list, model) if args.changed else pic_list for model in args.model}
+    if args.dedup != "off":
+        plans = {model: dedup(plan, model, args.dedup == "reuse") for model, plan in plans.items()}
+
+    # batch process to generate GeoMindMap in pipeline
+    if args.queue:
+        batch_queue(plans, args.queue, args.stages, args.workers)
+    elif args.fanout:
+        fanout_list = [pic for pic in pic_list if any(pic in plan for plan in plans.values())]
+        if fanout_list:
+            batch_fanout(fanout_list, args.model, args.run_id, args.stages, args.workers, plans)
+    else:
+        for model in args.model:
+            if plans[model]:
+                batch(plans[model], model, args.run_id, args.stages, args.workers, args.batch_eval)
+    return pic_list
+
+
+if __name__ == "__main__":
+    if not run(parse_args()):
+        raise SystemExit(1)
@@ -1,9 +1,15 @@
 import os
 import base64
-import requests
 import argparse
 import json
-from openai import OpenAI
+import glob
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import routing
+import gazetteer
+import hierarchy
+import hedging
 
 ### NER Match: Iterate over paragraphs and match with entities list
 ### Input: paragraph json and entity list json
@@ -17,13 +23,113 @@ This module matches reasoning paragraphs with extracted entities:
 - Link locations to supporting clue entities
 - Save per-paragraph match result as para_match.json
 
+Modes:
+- full (default): one response chain over all paragraphs, every request carries the full entity list
+  and (via previous_response_id) all earlier paragraphs and answers
+- pruned (opt-in: GEOMINDMAP_MATCH=pruned or main.py --match-mode pruned): a local prefilter
+  picks the candidate entities of each paragraph (word / prefix overlap of normalized names),
+  the request carries only these plus the locations already in play (candidates of earlier
+  paragraphs); requests are independent and run concurrently, paragraphs without
+  candidates are skipped (empty record). The model decides
+  the location status without the earlier paragraphs, so compare_modes() checks the labels
+  against full-mode results before pruned is used for a dataset
+Each run saves match_stats.json with measured tokens and time, and the estimated input
+tokens of both modes.
+
 Functions:
 - check_fix_json(str): validate and fix JSON format using LLM
-- match(entity_path, reasoning_path, output_dir): main matching function
+- write_partial(path, text): atomic write of the (partial) para_match.json
+- prefilter(text, entities): candidate entities of a paragraph
+- match(entity_path, reasoning_path, output_dir, mode, output_name): main matching function
+- set_mode(name): choose the match mode
+- report(data_dir): estimated savings of the pruned mode and prefilter recall against
+  existing full-mode results
+- agreement(data_dir, models, output_name): labels of output_name compared with para_match.json
+- compare_modes(data_dir, models, pics): pruned match of pictures with full-mode results
+  (para_match_pruned.json) and its agreement report
+
+Usage (from repository root):
+    python geomindmap/pipeline/match.py --report
+    python geomindmap/pipeline/match.py --compare-modes --model claude --pics pic10 pic11
 """
-client = OpenAI(
-    api_key = os.getenv("OPENAI_API_KEY"),
-)
+
+MODES = ["full", "pruned"]
+# pruned changes what the model sees, it is opt-in
+MATCH_MODE = os.getenv("GEOMINDMAP_MATCH", "full")
+# compare_modes(): minimum location recall and status agreement of pruned with full mode
+MIN_AGREEMENT = 0.9
+MATCH_WORKERS = 4
+# words that never make an entity a candidate on their own
+STOPWORDS = {"the", "and", "with", "for", "from", "of", "in", "on", "at", "a", "an", "to", "or",
+             "style", "type", "like", "sign", "signs"}
+# shared word prefix length for word-form variants (german / germany, bavarian / bavaria)
+PREFIX = 4
+
+# choose the match mode; worker processes read it from the environment
+def set_mode(name):
+    global MATCH_MODE
+    if name not in MODES:
+        raise ValueError(f"Unknown match mode: {name}")
+    MATCH_MODE = name
+    os.environ["GEOMINDMAP_MATCH"] = name
+
+# rough token count of a text (~4 characters per token)
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+# candidate entities of a paragraph: full normalized name in the text, or at least
+# half of its content words (singular form or shared prefix) in the text
+def prefilter(text, entities):
+    norm = " " + gazetteer.normalize(text) + " "
+    words = {hierarchy.singular(w) for w in norm.split()}
+    prefixes = {w[:PREFIX] for w in words if len(w) >= PREFIX}
+    candidates = []
+    for e in entities:
+        name = gazetteer.normalize(e["entity"])
+        if not name:
+            continue
+        if f" {name} " in norm:
+            candidates.append(e)
+            continue
+        content = [hierarchy.singular(w) for w in name.split() if w not in STOPWORDS and len(w) > 2]
+        content = content or [hierarchy.singular(w) for w in name.split()]
+        hits = sum(1 for w in content if w in words or (len(w) >= PREFIX and w[:PREFIX] in prefixes))
+        if hits and hits * 2 >= len(content):
+            candidates.append(e)
+    return candidates
+
+# candidate entities of each paragraph, locations stay in play for the following paragraphs
+# (empty list: paragraph is skipped)
+def prune(entity_json, paragraph_json):
+    in_play, lists = [], []
+    for p in paragraph_json:
+        candidates = prefilter(p['content'], entity_json)
+        names = {e["entity"] for e in candidates}
+        lists.append(candidates + [e for e in in_play if e["entity"] not in names] if candidates else [])
+        in_play += [e for e in candidates if e.get("type") == "l" and e not in in_play]
+    return lists
+
+# estimated input tokens of both modes; outputs: answer texts of the paragraphs (if known)
+def estimate_modes(prompt, entity_json, paragraph_json, candidate_lists, outputs=None):
+    outputs = outputs or [""] * len(paragraph_json)
+    base = estimate_tokens(prompt)
+    system = base + estimate_tokens(json.dumps(entity_json, ensure_ascii=False, indent=2))
+    full, pruned, history = 0, 0, 0
+    for p, candidates, output in zip(paragraph_json, candidate_lists, outputs):
+        text = estimate_tokens(json.dumps(p['content'], ensure_ascii=False, indent=2))
+        # the chain re-sends every earlier paragraph and answer
+        full += system + history + text
+        history += text + estimate_tokens(output)
+        if candidates:
+            pruned += base + estimate_tokens(json.dumps(candidates, ensure_ascii=False, indent=2)) + text
+    return full, pruned
+
+# write atomically: readers never see a half-written file
+def write_partial(path, text):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
 
 # check and fix json format using llm
 def check_fix_json(str):
@@ -36,11 +142,9 @@ def check_fix_json(str):
     prompt = """
         Fix the following JSON string by ensuring it is properly formatted and contains valid JSON syntax. Please output only raw JSON. Do not use any Markdown syntax. Do not modify the original content.
         """
-    response = client.responses.create(
-        model = "o4-mini",
-        reasoning = { 
-            "effort": "medium"
-        }, 
+    response = routing.create(
+        "fix_json",
+        expect_json = True,
         input = [
             {
                 "role": "user",
@@ -61,7 +165,10 @@ def check_fix_json(str):
         raise ValueError(f"LLM returned invalid JSON after fixing: {e}\nGot: {fixed_json}")
 
 # semantic matching
-def match(entity_path, reasoning_path, output_dir):
+# output_name: result file, statistics go to match_stats.json (para_match.json) or <output_name>_stats.json
+def match(entity_path, reasoning_path, output_dir, mode=None, output_name="para_match.json"):
+    t0 = time.time()
+    mode = mode or MATCH_MODE
     
     with open(entity_path, 'r', encoding='utf-8') as f:
         entity_json = json.load(f)
@@ -112,18 +219,20 @@ def match(entity_path, reasoning_path, output_dir):
     }
     The following is the list of entity terms to be used for matching:
     """
-    tokens = 0
+    if mode == "pruned":
+        return match_pruned(prompt, entity_json, paragraph_json, output_dir, t0, output_name)
+
+    tokens, input_tokens = 0, 0
+    outputs = []
     para_match = '['
     for i, p in enumerate(paragraph_json):
         
         content = json.dumps(p['content'], ensure_ascii=False, indent=2)
         
         if i == 0:
-            previous_response = client.responses.create(
-                model = "o4-mini",
-                reasoning = { 
-                "effort": "medium"
-                }, 
+            previous_response = routing.create(
+                "match",
+                expect_json = True,
                 input = [
                     {
                         "role": "system",
@@ -140,12 +249,11 @@ def match(entity_path, reasoning_path, output_dir):
                 ]
             )
             tokens += previous_response.usage.total_tokens
+            input_tokens += previous_response.usage.input_tokens
         else: 
-            response = client.responses.create(
-                model = "o4-mini", 
-                reasoning = { 
-                    "effort": "medium"
-                },
+            response = routing.create(
+                "match",
+                expect_json = True,
                 previous_response_id = previous_response.id,
                 input = [
                     {
@@ -158,16 +266,246 @@ def match(entity_path, reasoning_path, output_dir):
             )
             previous_response = response
             tokens += response.usage.total_tokens
+            input_tokens += response.usage.input_tokens
 
         match_output = previous_response.output_text
         match_output = check_fix_json(match_output)
         print(match_output)
+        outputs.append(match_output)
         para_match += match_output + ','
+        # partial result after every paragraph, so the live viewer (server.py) can show it
+        write_partial(output_dir + output_name, para_match.rstrip(',') + ']')
 
     para_match = para_match.rstrip(',') + ']'
 
-    with open(output_dir + "para_match.json", 'w', encoding='utf-8') as f:
-        f.write(para_match)
+    write_partial(output_dir + output_name, para_match)
     print(f"Finish match! Written in {output_dir}")
 
-    return tokens
\ No newline at end of file
+    full_est, pruned_est = estimate_modes(prompt, entity_json, paragraph_json, prune(entity_json, paragraph_json), outputs)
+    save_stats(output_dir, output_name, {"mode": "full", "paragraphs": len(paragraph_json), "requests": len(paragraph_json),
+                            "skipped": 0, "tokens": tokens, "input_tokens": input_tokens, "time": time.time() - t0,
+                            "full_input_tokens_est": full_est, "pruned_input_tokens_est": pruned_est})
+    return tokens
+
+# match with pruned entity lists, independent concurrent requests per paragraph
+def match_pruned(prompt, entity_json, paragraph_json, output_dir, t0, output_name="para_match.json"):
+    candidate_lists = prune(entity_json, paragraph_json)
+    results = [None] * len(paragraph_json)
+    usage = {"tokens": 0, "input_tokens": 0}
+    lock = threading.Lock()
+
+    def run(i):
+        candidates = candidate_lists[i]
+        if not candidates:
+            results[i] = json.dumps({"paragraph": i + 1, "clue": [], "loc-clue": []}, ensure_ascii=False)
+        else:
+            content = json.dumps(paragraph_json[i]['content'], ensure_ascii=False, indent=2)
+            response = routing.create(
+                "match",
+                expect_json = True,
+                input = [
+                    {
+                        "role": "system",
+                        "content": [
+                            {"type": "input_text", "text": prompt + json.dumps(candidates, ensure_ascii=False, indent=2)},
+                        ]
+                    },
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "input_text", "text": f"This is paragraph {i+1} :" + content},
+                        ]
+                    }
+                ]
+            )
+            record = json.loads(check_fix_json(response.output_text))
+            # requests are independent: the paragraph number comes from the position
+            if isinstance(record, dict):
+                record["paragraph"] = i + 1
+            results[i] = json.dumps(record, ensure_ascii=False, indent=2)
+            print(results[i])
+        with lock:
+            if candidates:
+                usage["tokens"] += response.usage.total_tokens
+                usage["input_tokens"] += response.usage.input_tokens
+            # partial result: matched prefix of the paragraphs, for the live viewer (server.py)
+            done = []
+            for r in results:
+                if r is None:
+                    break
+                done.append(r)
+            write_partial(output_dir + output_name, "[" + ",".join(done) + "]")
+
+    with ThreadPoolExecutor(max_workers=MATCH_WORKERS) as pool:
+        # paragraph requests keep the deadline of the match stage
+        list(pool.map(hedging.bind(run), range(len(paragraph_json))))
+
+    write_partial(output_dir + output_name, "[" + ",".join(results) + "]")
+    print(f"Finish match! Written in {output_dir}")
+
+    skipped = sum(1 for c in candidate_lists if not c)
+    full_est, pruned_est = estimate_modes(prompt, entity_json, paragraph_json, candidate_lists, results)
+    save_stats(output_dir, output_name, {"mode": "pruned", "paragraphs": len(paragraph_json), "requests": len(paragraph_json) - skipped,
+                            "skipped": skipped, "tokens": usage["tokens"], "input_tokens": usage["input_tokens"],
+                            "time": time.time() - t0, "full_input_tokens_est": full_est, "pruned_input_tokens_est": pruned_est})
+    print(f"Pruned match: {skipped} of {len(paragraph_json)} paragraphs skipped, "
+          f"estimated input tokens {pruned_est} instead of {full_est} ({1 - pruned_est / max(full_est, 1):.0%} saved)")
+    return usage["tokens"]
+
+# token / time statistics of a match run
+def save_stats(output_dir, output_name, stats):
+    name = "match_stats.json" if output_name == "para_match.json" else os.path.splitext(output_name)[0] + "_stats.json"
+    with open(output_dir + name, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, indent=2)
+
+# savings of the pruned mode over existing outputs, prefilter recall against full-mode results
+def report(data_dir="geomindmap/data/"):
+    full = pruned = paragraphs = skipped = gold = found = candidates = entities = 0
+    measured = {}
+    for pic_dir in sorted(glob.glob(os.path.join(data_dir, "*", "pic*"))):
+        try:
+            with open(os.path.join(pic_dir, "entity.json"), 'r', encoding='utf-8') as f:
+                entity_json = json.load(f)
+            with open(os.path.join(pic_dir, "reasoning.json"), 'r', encoding='utf-8') as f:
+                paragraph_json = json.load(f)
+            with open(os.path.join(pic_dir, "para_match.json"), 'r', encoding='utf-8') as f:
+                para_match = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        stats_path = os.path.join(pic_dir, "match_stats.json")
+        if os.path.exists(stats_path):
+            with open(stats_path, 'r', encoding='utf-8') as f:
+                stats = json.load(f)
+            m = measured.setdefault(stats["mode"], {"pictures": 0, "tokens": 0, "input_tokens": 0, "time": 0.0})
+            m["pictures"] += 1
+            for key in ("tokens", "input_tokens", "time"):
+                m[key] += stats[key]
+
+        candidate_lists = prune(entity_json, paragraph_json)
+        by_paragraph = {r.get("paragraph"): r for r in para_match if isinstance(r, dict)}
+        outputs = [json.dumps(by_paragraph.get(i + 1, {}), ensure_ascii=False, indent=2) for i in range(len(paragraph_json))]
+        f_est, p_est = estimate_modes("", entity_json, paragraph_json, candidate_lists, outputs)
+        full += f_est
+        pruned += p_est
+        names = {e["entity"] for e in entity_json}
+        for i, c in enumerate(candidate_lists):
+            r = by_paragraph.get(i + 1, {})
+            matched = (set(r.get("clue", [])) | {l.get("loc") for l in r.get("loc-clue", [])}) & names
+            gold += len(matched)
+            found += len(matched & {e["entity"] for e in c})
+            candidates += len(c)
+            entities += len(entity_json)
+        paragraphs += len(paragraph_json)
+        skipped += sum(1 for c in candidate_lists if not c)
+
+    print(f"Paragraphs: {paragraphs}, skipped by the prefilter: {skipped} ({skipped / max(paragraphs, 1):.1%})")
+    print(f"Entity list per request: {candidates / max(entities, 1):.1%} of the full list")
+    print(f"Prefilter recall of full-mode matches: {found / max(gold, 1):.1%}")
+    print(f"Estimated input tokens without the prompt: full {full}, pruned {pruned} ({1 - pruned / max(full, 1):.0%} saved)")
+    for mode, m in measured.items():
+        print(f"Measured {mode}: {m['pictures']} pictures, {m['input_tokens'] / m['pictures']:.0f} input tokens, "
+              f"{m['time'] / m['pictures']:.1f} s per picture")
+    return {"paragraphs": paragraphs, "skipped": skipped, "recall": found / max(gold, 1),
+            "full_input_tokens_est": full, "pruned_input_tokens_est": pruned, "measured": measured}
+
+# {paragraph: (clue set, {loc: status})} of a para_match file
+def read_matches(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    matches = {}
+    for r in records if isinstance(records, list) else []:
+        if isinstance(r, dict):
+            locs = {l.get("loc"): l.get("status") for l in r.get("loc-clue", []) if isinstance(l, dict)}
+            matches[r.get("paragraph")] = (set(r.get("clue", [])), locs)
+    return matches
+
+# labels of output_name compared with the full-mode para_match.json of the same pictures
+def agreement(data_dir="geomindmap/data/", models=None, output_name="para_match_pruned.json"):
+    """
+    Per paragraph, clues and locations of the full-mode result are the reference:
+    clue recall / precision, location recall / precision, and the share of locations found
+    by both whose status (excluded / included / concluded) is the same. Paragraphs with
+    reference matches that the other result leaves empty are counted as emptied.
+    """
+    counts = {"pictures": 0, "paragraphs": 0, "emptied": 0, "clues": 0, "clues_found": 0, "clues_other": 0,
+              "locations": 0, "locations_found": 0, "locations_other": 0, "same_status": 0}
+    for path in sorted(glob.glob(os.path.join(data_dir, "*", "pic*", output_name))):
+        pic_dir = os.path.dirname(path)
+        if models and os.path.basename(os.path.dirname(pic_dir)) not in models:
+            continue
+        full_path = os.path.join(pic_dir, "para_match.json")
+        if not os.path.exists(full_path):
+            continue
+        try:
+            full, other = read_matches(full_path), read_matches(path)
+        except json.JSONDecodeError as e:
+            print(f"Skip {pic_dir}: {e}")
+            continue
+        counts["pictures"] += 1
+        for paragraph, (clues, locs) in full.items():
+            other_clues, other_locs = other.get(paragraph, (set(), {}))
+            counts["paragraphs"] += 1
+            counts["emptied"] += bool(clues or locs) and not (other_clues or other_locs)
+            counts["clues"] += len(clues)
+            counts["clues_found"] += len(clues & other_clues)
+            counts["clues_other"] += len(other_clues)
+            counts["locations"] += len(locs)
+            counts["locations_other"] += len(other_locs)
+            both = set(locs) & set(other_locs)
+            counts["locations_found"] += len(both)
+            counts["same_status"] += sum(locs[l] == other_locs[l] for l in both)
+
+    def share(a, b):
+        return round(counts[a] / counts[b], 4) if counts[b] else None
+    report = {
+        **counts,
+        "clue_recall": share("clues_found", "clues"),
+        "clue_precision": share("clues_found", "clues_other"),
+        "location_recall": share("locations_found", "locations"),
+        "location_precision": share("locations_found", "locations_other"),
+        "status_agreement": share("same_status", "locations_found"),
+    }
+    print(f"{output_name} vs para_match.json: {report['pictures']} pictures, {report['emptied']} of "
+          f"{report['paragraphs']} paragraphs emptied, clue recall {report['clue_recall']}, "
+          f"location recall {report['location_recall']}, status agreement {report['status_agreement']}")
+    return report
+
+# pruned match of pictures with full-mode results, written to para_match_pruned.json, agreement report
+def compare_modes(data_dir="geomindmap/data/", models=None, pics=None, output_name="para_match_pruned.json"):
+    for path in sorted(glob.glob(os.path.join(data_dir, "*", "pic*", "para_match.json"))):
+        pic_dir = os.path.dirname(path)
+        model, pic_name = os.path.basename(os.path.dirname(pic_dir)), os.path.basename(pic_dir)
+        if models and model not in models or pics and pic_name not in pics:
+            continue
+        stats_path = os.path.join(pic_dir, "match_stats.json")
+        if os.path.exists(stats_path):
+            with open(stats_path, 'r', encoding='utf-8') as f:
+                if json.load(f).get("mode") != "full":
+                    # no full-mode reference for this picture
+                    continue
+        match(os.path.join(pic_dir, "entity.json"), os.path.join(pic_dir, "reasoning.json"), pic_dir + "/",
+              mode="pruned", output_name=output_name)
+    return agreement(data_dir, models, output_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Savings and label agreement of the pruned match mode over the existing outputs.")
+    parser.add_argument("--report", action="store_true")
+    parser.add_argument("--compare-modes", action="store_true",
+                        help="run the pruned mode on pictures with full-mode results and compare the labels (LLM calls)")
+    parser.add_argument("--agreement", action="store_true",
+                        help="compare existing para_match_pruned.json files with para_match.json (no LLM calls)")
+    parser.add_argument("--model", "-m", nargs="+", default=None)
+    parser.add_argument("--pics", "-p", nargs="+", default=None, help="picture names, e.g. pic10 pic11")
+    parser.add_argument("--data-dir", default="geomindmap/data/")
+    args = parser.parse_args()
+    if args.report:
+        report(args.data_dir)
+    if args.compare_modes or args.agreement:
+        if args.compare_modes:
+            result = compare_modes(args.data_dir, args.model, args.pics)
+        else:
+            result = agreement(args.data_dir, args.model)
+        checks = [result["location_recall"], result["status_agreement"]]
+        if any(c is not None and c < MIN_AGREEMENT for c in checks):
+            raise SystemExit(f"Pruned mode below {MIN_AGREEMENT} location recall / status agreement, keep the full mode")
\ No newline at end of file
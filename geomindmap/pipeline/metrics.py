@@ -0,0 +1,139 @@
+import os
+import json
+import glob
+import numpy as np
+import gazetteer
+"""
+metrics.py
+----------
+This module computes geodesic error metrics of the reasoning steps.
+Each step's hypothesis/conclusion location in step_acc.json is resolved to coordinates
+with the offline gazetteer and compared with the ground truth GPS in pictures/gps.json.
+Great-circle errors (km) of every step of every picture of every model are computed
+in one vectorized haversine pass.
+
+Functions:
+- haversine(lat1, lon1, lat2, lon2): vectorized great-circle distance in km
+- locate(gaz, location): resolve a location string (e.g. "Mehlgasse, Koblenz, Germany") to (lat, lon)
+- geo_error(data_dir, gps_path, models): compute per-step error curves and percentiles, save to info/geo_error.json
+"""
+
+EARTH_RADIUS_KM = 6371.0088
+# km scales of the location granularity levels (continent, country, area, city, street)
+THRESHOLDS_KM = [2500, 750, 250, 25, 1]
+PERCENTILES = [25, 50, 75, 90]
+
+# great-circle distance in km, works on scalars and numpy arrays
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+# resolve a location string to coordinates, finest known part first
+def locate(gaz, location):
+    if not location:
+        return None
+    parts = [location] + [p.strip() for p in str(location).split(",")]
+    for part in parts:
+        place = gazetteer.lookup(gaz, part)
+        if place is not None and "lat" in gaz["places"][place]:
+            return gaz["places"][place]["lat"], gaz["places"][place]["lon"]
+    return None
+
+# summary statistics of an error array (nan = unresolved)
+def summarize(errors):
+    resolved = errors[~np.isnan(errors)]
+    summary = {"count": int(errors.size), "resolved": int(resolved.size)}
+    if resolved.size:
+        for p, v in zip(PERCENTILES, np.percentile(resolved, PERCENTILES)):
+            summary[f"p{p}_km"] = round(float(v), 2)
+        summary["mean_km"] = round(float(resolved.mean()), 2)
+        for t in THRESHOLDS_KM:
+            summary[f"within_{t}km"] = round(float((resolved <= t).mean()), 4)
+    return summary
+
+# compute geodesic error of all steps of all pictures and models in one pass
+def geo_error(data_dir="geomindmap/data/", gps_path="geomindmap/pictures/gps.json", models=None):
+    """
+    Output per model: data/<model>/info/geo_error.json with
+    - pictures: {pic: [error_km per step, null if location unresolved]}
+    - curve: median/mean error per step index over pictures
+    - final / all_steps: percentiles and share of answers within granularity km scales
+    Returns {model: result}.
+    """
+    gaz = gazetteer.load_gazetteer()
+    with open(gps_path, 'r', encoding='utf-8') as f:
+        gps_json = json.load(f)
+    if models is None:
+        models = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+
+    # collect all steps into flat columns
+    col_model, col_pic, col_step = [], [], []
+    lat, lon, gt_lat, gt_lon = [], [], [], []
+    for model in models:
+        for path in sorted(glob.glob(os.path.join(data_dir, model, "pic*", "step_acc.json"))):
+            pic_name = os.path.basename(os.path.dirname(path))
+            gt = gps_json.get(pic_name + ".png", {}).get("GPS")
+            if not gt:
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                steps = json.load(f)
+            for i, s in enumerate(steps):
+                coord = locate(gaz, s.get("location"))
+                col_model.append(model)
+                col_pic.append(pic_name)
+                col_step.append(i)
+                lat.append(coord[0] if coord else np.nan)
+                lon.append(coord[1] if coord else np.nan)
+                gt_lat.append(gt["lat"])
+                gt_lon.append(gt["lon"])
+
+    col_model = np.array(col_model)
+    col_pic = np.array(col_pic)
+    col_step = np.array(col_step)
+    errors = haversine(np.array(lat), np.array(lon), np.array(gt_lat), np.array(gt_lon))
+    print(f"Computed {errors.size} step errors, {int(np.isnan(errors).sum())} unresolved")
+
+    results = {}
+    for model in models:
+        in_model = col_model == model
+        if not in_model.any():
+            continue
+        pictures = {}
+        final = []
+        for pic_name in dict.fromkeys(col_pic[in_model]):
+            mask = in_model & (col_pic == pic_name)
+            e = errors[mask][np.argsort(col_step[mask])]
+            pictures[pic_name] = [None if np.isnan(v) else round(float(v), 2) for v in e]
+            final.append(e[-1])
+
+        curve = []
+        for step in range(int(col_step[in_model].max()) + 1):
+            e = errors[in_model & (col_step == step)]
+            e = e[~np.isnan(e)]
+            curve.append({
+                "step": step + 1,
+                "pictures": int(e.size),
+                "median_km": round(float(np.median(e)), 2) if e.size else None,
+                "mean_km": round(float(e.mean()), 2) if e.size else None
+            })
+
+        result = {
+            "final": summarize(np.array(final)),
+            "all_steps": summarize(errors[in_model]),
+            "curve": curve,
+            "pictures": pictures
+        }
+        results[model] = result
+
+        out_file = os.path.join(data_dir, model, "info", "geo_error.json")
+        os.makedirs(os.path.dirname(out_file), exist_ok=True)
+        with open(out_file, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=4, ensure_ascii=False)
+        print(f"{model}: final median error {result['final'].get('p50_km')} km, saved to {out_file}")
+
+    return results
+
+
+if __name__ == "__main__":
+    geo_error()
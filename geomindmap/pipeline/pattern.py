@@ -0,0 +1,364 @@
+import os
+import re
+import json
+import glob
+import argparse
+import numpy as np
+"""
+pattern.py
+----------
+This module detects reasoning patterns (Breadth-First / Depth-First / Switch) locally,
+without an LLM pass. Step features come from the structured pipeline outputs:
+- para_match.json: locations mentioned per step, their status and status changes
+- l_map_info.json: granularity of the mentioned locations
+- reasoning.json: Breadth-First / Depth-First reference keywords of the detect_pattern prompt
+All steps of all pictures are classified in one vectorized pass and saved in the
+pattern.json schema.
+
+The linear rule (WEIGHTS, BIAS) is a logistic regression on the LLM labels in pattern.json,
+so its agreement with those labels over the same pictures is in-sample. cross_validate()
+fits on all but one fold of pictures and scores the held-out fold; its figures are the ones
+to report. fit() reproduces WEIGHTS / BIAS from all pictures.
+
+Usage (from repository root):
+    python geomindmap/pipeline/pattern.py               # write pattern_local.json, in-sample agreement
+    python geomindmap/pipeline/pattern.py --cv 5        # held-out agreement of 5-fold cross-validation
+    python geomindmap/pipeline/pattern.py --fit         # fitted WEIGHTS / BIAS from all pictures
+
+Functions:
+- step_features(reasoning, para_match, l_map_info): feature matrix of one picture (steps x features)
+- classify(X): vectorized BF/DF labels for a feature matrix
+- to_pattern(labels, X, para_match): build pattern.json dict from labels
+- detect_pattern_local(data_dir, models, output_name): run over the whole dataset, save and report agreement
+- agreement(data_dir, models, output_name): compare local labels with the LLM labels in pattern.json
+- fit(X, y): logistic regression weights and bias of the decision rule
+- cross_validate(data_dir, models, folds): held-out agreement, pictures split into folds
+"""
+
+# reference keywords from reasoning.detect_pattern prompt
+BF_KEYWORDS = ["consider", "observe", "try", "wonder", "notice", "might", "could"]
+DF_KEYWORDS = ["focus", "detail", "lead to", "indicate", "hint", "confirm", "specific", "narrow down", "point"]
+
+FEATURES = [
+    "n_loc",         # locations mentioned in the step
+    "n_new_loc",     # locations mentioned for the first time
+    "n_included",    # locations with status 2 (included)
+    "n_concluded",   # locations with status 3 (concluded)
+    "n_excluded",    # locations with status 1 (excluded)
+    "n_changed",     # locations whose status changed compared to earlier steps
+    "max_gran",      # finest granularity among mentioned locations
+    "gran_delta",    # max_gran - finest granularity reached before
+    "n_clue",        # clues mentioned in the step
+    "kw_bf",         # Breadth-First keyword hits per 100 words
+    "kw_df",         # Depth-First keyword hits per 100 words
+    "position",      # relative position of the step in the reasoning (0..1)
+]
+
+# linear decision rule: score > 0 -> Depth-First
+# fit(*training_set()) on the LLM labels in data/*/pic*/pattern.json (86 pictures, 1941 steps);
+# held-out (cross_validate, 5 folds): agreement 0.826, kappa 0.628, switch precision 0.447 / recall 0.507
+WEIGHTS = np.array([0.05, -0.09, -0.17, 0.27, -0.26, 0.04, 0.53, -0.17, 0.01, -0.16, 0.28, 1.57])
+BIAS = -2.37
+# L2 penalty of fit() on the standardized features, WEIGHTS / BIAS were fitted with it
+L2 = 20.0
+
+# count keyword hits in text
+def keyword_hits(text, keywords):
+    text = text.lower()
+    return sum(len(re.findall(r"\b" + re.escape(k), text)) for k in keywords)
+
+# feature matrix of one picture
+def step_features(reasoning, para_match, l_map_info):
+    granularity = {n['entity']: n['granularity'] for n in l_map_info}
+    matches = {m['paragraph']: m for m in para_match}
+    n_steps = len(reasoning)
+
+    X = np.zeros((n_steps, len(FEATURES)))
+    seen_status = {}
+    finest = 0
+    for i, p in enumerate(reasoning):
+        m = matches.get(i + 1, {"clue": [], "loc-clue": []})
+        locs = m.get("loc-clue", [])
+        status = [l.get("status") for l in locs]
+        new = [l for l in locs if l["loc"] not in seen_status]
+        changed = [l for l in locs if l["loc"] in seen_status and seen_status[l["loc"]] != l.get("status")]
+        grans = [granularity.get(l["loc"], 0) for l in locs]
+        max_gran = max(grans, default=0)
+        words = max(len(p.get("content", "").split()), 1)
+
+        X[i] = [
+            len(locs),
+            len(new),
+            status.count(2),
+            status.count(3),
+            status.count(1),
+            len(changed),
+            max_gran,
+            max(max_gran - finest, 0) if max_gran else 0,
+            len(m.get("clue", [])),
+            100 * keyword_hits(p.get("content", ""), BF_KEYWORDS) / words,
+            100 * keyword_hits(p.get("content", ""), DF_KEYWORDS) / words,
+            i / max(n_steps - 1, 1),
+        ]
+        for l in locs:
+            seen_status[l["loc"]] = l.get("status")
+        finest = max(finest, max_gran)
+    return X
+
+# vectorized labels: True = Depth-First, False = Breadth-First
+def classify(X):
+    return X @ WEIGHTS + BIAS > 0
+
+# build pattern.json dict from labels of one picture
+def to_pattern(labels, X, para_match):
+    matches = {m['paragraph']: m for m in para_match}
+    col = {name: i for i, name in enumerate(FEATURES)}
+    pattern = {"Breadth-First": [], "Depth-First": [], "Breadth-Depth Switch": []}
+
+    for i, is_df in enumerate(labels):
+        x = X[i]
+        step = i + 1
+        if is_df:
+            locs = [l["loc"] for l in matches.get(step, {}).get("loc-clue", []) if l.get("status") == 3]
+            key = ", ".join(locs) or ", ".join(matches.get(step, {}).get("clue", [])[:3])
+            pattern["Depth-First"].append({
+                "Step": step,
+                "Explanation": f"Rule-based: {int(x[col['n_concluded']])} concluded location(s), granularity +{int(x[col['gran_delta']])}, {x[col['kw_df']]:.1f} depth keywords per 100 words",
+                "KeyElement": key
+            })
+        else:
+            pattern["Breadth-First"].append({
+                "Step": step,
+                "Explanation": f"Rule-based: {int(x[col['n_included']])} included location(s), {int(x[col['n_new_loc']])} new, {int(x[col['n_clue']])} clues, {x[col['kw_bf']]:.1f} breadth keywords per 100 words"
+            })
+        if i > 0 and labels[i - 1] != is_df:
+            pattern["Breadth-Depth Switch"].append({
+                "FromStep": step - 1,
+                "ToStep": step,
+                "SwitchType": "ToDepth" if is_df else "ToBreadth",
+                "Explanation": "Rule-based: pattern label changes between consecutive steps"
+            })
+    return pattern
+
+# collect feature matrices of all pictures
+def load_dataset(data_dir, models):
+    items = []
+    for model in models:
+        for pic_dir in sorted(glob.glob(os.path.join(data_dir, model, "pic*", ""))):
+            try:
+                with open(pic_dir + "reasoning.json", 'r', encoding='utf-8') as f:
+                    reasoning = json.load(f)
+                with open(pic_dir + "para_match.json", 'r', encoding='utf-8') as f:
+                    para_match = json.load(f)
+                with open(pic_dir + "l_map_info.json", 'r', encoding='utf-8') as f:
+                    l_map_info = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Skip {pic_dir}: {e}")
+                continue
+            items.append((model, pic_dir, para_match, step_features(reasoning, para_match, l_map_info)))
+    return items
+
+# run local pattern detection over the whole dataset
+def detect_pattern_local(data_dir="geomindmap/data/", models=None, output_name="pattern_local.json"):
+    """
+    Writes data/<model>/<pic>/<output_name> in pattern.json schema.
+    Default output name keeps the LLM labels in pattern.json for comparison;
+    use output_name="pattern.json" to replace them.
+    Returns agreement report.
+    """
+    if models is None:
+        models = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    items = load_dataset(data_dir, models)
+    if not items:
+        print(f"No pictures with reasoning.json, para_match.json and l_map_info.json in {data_dir}")
+        return {}
+
+    # classify all steps of all pictures at once
+    X = np.vstack([x for _, _, _, x in items])
+    labels = classify(X)
+    offsets = np.cumsum([0] + [len(x) for _, _, _, x in items])
+
+    for k, (model, pic_dir, para_match, x) in enumerate(items):
+        pattern = to_pattern(labels[offsets[k]:offsets[k + 1]], x, para_match)
+        with open(pic_dir + output_name, "w", encoding="utf-8") as f:
+            f.write(json.dumps(pattern, ensure_ascii=False) + "\n")
+    print(f"Finish Detecting Pattern locally! {len(items)} pictures, {len(labels)} steps")
+
+    if output_name == "pattern.json":
+        return None
+    return agreement(data_dir, models, output_name)
+
+# read step labels of a pattern.json file: {step: is_df}, set of switch steps
+def read_labels(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        pattern = json.load(f)
+    if not isinstance(pattern, dict):
+        return None, None
+    labels = {s["Step"]: False for s in pattern.get("Breadth-First", [])}
+    labels.update({s["Step"]: True for s in pattern.get("Depth-First", [])})
+    switches = {s["ToStep"] for s in pattern.get("Breadth-Depth Switch", [])}
+    return labels, switches
+
+# agreement of local labels with LLM labels
+def agreement(data_dir="geomindmap/data/", models=None, output_name="pattern_local.json"):
+    if models is None:
+        models = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    report = {}
+    for model in models:
+        llm, local = [], []
+        sw_tp = sw_llm = sw_local = 0
+        for path in sorted(glob.glob(os.path.join(data_dir, model, "pic*", output_name))):
+            llm_path = os.path.join(os.path.dirname(path), "pattern.json")
+            if not os.path.exists(llm_path):
+                continue
+            a, a_sw = read_labels(llm_path)
+            b, b_sw = read_labels(path)
+            if a is None:
+                continue
+            steps = sorted(set(a) & set(b))
+            llm += [a[s] for s in steps]
+            local += [b[s] for s in steps]
+            sw_tp += len(a_sw & b_sw)
+            sw_llm += len(a_sw)
+            sw_local += len(b_sw)
+        if not llm:
+            continue
+        report[model] = scores(llm, local, sw_tp, sw_llm, sw_local)
+        print(f"{model}: {report[model]}")
+    return report
+
+# agreement, Cohen's kappa and switch precision/recall of local with LLM labels
+def scores(llm, local, sw_tp, sw_llm, sw_local):
+    llm, local = np.array(llm, dtype=bool), np.array(local, dtype=bool)
+    # Cohen's kappa for BF/DF labels
+    p_o = (llm == local).mean()
+    p_e = llm.mean() * local.mean() + (1 - llm.mean()) * (1 - local.mean())
+    kappa = (p_o - p_e) / (1 - p_e) if p_e < 1 else 1.0
+    precision = sw_tp / sw_local if sw_local else 0.0
+    recall = sw_tp / sw_llm if sw_llm else 0.0
+    return {
+        "steps": int(llm.size),
+        "agreement": round(float(p_o), 4),
+        "kappa": round(float(kappa), 4),
+        "switch_precision": round(precision, 4),
+        "switch_recall": round(recall, 4),
+    }
+
+# LLM labels of the steps of one picture: y (True = Depth-First), mask of the labelled steps, switch steps
+def llm_labels(pic_dir, n_steps):
+    path = pic_dir + "pattern.json"
+    if not os.path.exists(path):
+        return None
+    try:
+        labels, switches = read_labels(path)
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return None
+    if labels is None:
+        return None
+    steps = np.arange(1, n_steps + 1)
+    y = np.array([labels.get(s, False) for s in steps])
+    mask = np.array([s in labels for s in steps])
+    return y, mask, switches
+
+# logistic regression (Newton steps, L2 penalty): weights and bias on the raw features
+def fit(X, y, l2=L2, iterations=50):
+    # standardized features for a well-conditioned fit, mapped back to raw features at the end
+    mean, std = X.mean(axis=0), X.std(axis=0)
+    std[std == 0] = 1.0
+    Z = np.hstack([(X - mean) / std, np.ones((len(X), 1))])
+    penalty = np.full(Z.shape[1], l2)
+    penalty[-1] = 0.0
+    w = np.zeros(Z.shape[1])
+    for _ in range(iterations):
+        p = 1 / (1 + np.exp(-(Z @ w)))
+        gradient = Z.T @ (p - y) + penalty * w
+        hessian = (Z * (p * (1 - p))[:, None]).T @ Z + np.diag(penalty)
+        step = np.linalg.solve(hessian, gradient)
+        w -= step
+        if np.abs(step).max() < 1e-8:
+            break
+    weights = w[:-1] / std
+    return weights, float(w[-1] - weights @ mean)
+
+# labelled steps of the dataset: X, y and the picture (file name) of each step
+def training_set(data_dir="geomindmap/data/", models=None):
+    if models is None:
+        models = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    items = load_dataset(data_dir, models)
+    X, y, pics = [], [], []
+    for model, pic_dir, para_match, x in items:
+        labels = llm_labels(pic_dir, len(x))
+        if labels is None:
+            continue
+        X.append(x[labels[1]])
+        y.append(labels[0][labels[1]])
+        pics += [os.path.basename(os.path.dirname(pic_dir))] * int(labels[1].sum())
+    if not X:
+        return np.zeros((0, len(FEATURES))), np.zeros(0, dtype=bool), []
+    return np.vstack(X), np.concatenate(y), pics
+
+# held-out agreement: rule fitted on the other folds, scored on the pictures of each fold
+def cross_validate(data_dir="geomindmap/data/", models=None, folds=5, l2=L2):
+    """
+    Pictures are split into folds by name, so the traces of one picture by different
+    models are never in training and held-out data at once. Each fold is labelled by
+    a rule fitted on the other folds; the report is scored over all held-out labels
+    like agreement(), per model and "all". Nothing is written.
+    """
+    if models is None:
+        models = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    items = load_dataset(data_dir, models)
+    labelled = []
+    for model, pic_dir, para_match, x in items:
+        labels = llm_labels(pic_dir, len(x))
+        if labels is not None:
+            labelled.append((model, os.path.basename(os.path.dirname(pic_dir)), x, labels))
+    names = sorted({name for _, name, _, _ in labelled})
+    if len(names) < 2:
+        print(f"Not enough labelled pictures in {data_dir} for cross-validation")
+        return {}
+    folds = min(folds, len(names))
+    fold_of = {name: i % folds for i, name in enumerate(names)}
+
+    held_out = {}
+    for k in range(folds):
+        train = [(x, labels) for _, name, x, labels in labelled if fold_of[name] != k]
+        X = np.vstack([x[labels[1]] for x, labels in train])
+        y = np.concatenate([labels[0][labels[1]] for x, labels in train])
+        weights, bias = fit(X, y, l2)
+        for model, name, x, (y_pic, mask, switches) in labelled:
+            if fold_of[name] != k:
+                continue
+            predicted = x @ weights + bias > 0
+            local_switches = {i + 1 for i in range(1, len(predicted)) if predicted[i] != predicted[i - 1]}
+            for key in (model, "all"):
+                h = held_out.setdefault(key, [[], [], 0, 0, 0])
+                h[0] += list(y_pic[mask])
+                h[1] += list(predicted[mask])
+                h[2] += len(switches & local_switches)
+                h[3] += len(switches)
+                h[4] += len(local_switches)
+
+    report = {"folds": folds, "pictures": len(names)}
+    for key, h in held_out.items():
+        report[key] = scores(*h)
+        print(f"{key} (held-out, {folds} folds): {report[key]}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local BF/DF/Switch pattern detection.")
+    parser.add_argument("--models", "-m", nargs="+", default=None)
+    parser.add_argument("--cv", type=int, metavar="FOLDS", help="held-out agreement of k-fold cross-validation over pictures")
+    parser.add_argument("--fit", action="store_true", help="print WEIGHTS / BIAS fitted on all labelled pictures")
+    args = parser.parse_args()
+    if args.fit:
+        X, y, pics = training_set(models=args.models)
+        weights, bias = fit(X, y)
+        print(f"{len(set(pics))} pictures, {len(y)} labelled steps")
+        print(f"WEIGHTS = np.array([{', '.join(f'{w:.2f}' for w in weights)}])")
+        print(f"BIAS = {bias:.2f}")
+    elif args.cv:
+        cross_validate(models=args.models, folds=args.cv)
+    else:
+        detect_pattern_local(models=args.models)
@@ -0,0 +1,89 @@
+import os
+import threading
+"""
+providers.py
+------------
+Lazy registry of LLM provider clients.
+Each backend SDK (openai, anthropic, google.genai) is imported and its client is
+constructed only when a backend is used for the first time, so offline stages
+(coordinate, analytics, ...) start without loading any SDK.
+Backends: chatgpt, gpt5, gemini, gemini_genai, claude, qwen
+
+Functions:
+- register(name, factory): add or replace a backend client factory
+- get_client(name): return the (cached) client of a backend, created on first use
+- loaded(): names of backends whose client has been created
+"""
+
+# client factories, SDK imports happen inside
+def openai_client():
+    from openai import OpenAI
+    # opeanai api key
+    return OpenAI(
+        api_key = os.getenv("OPENAI_API_KEY"),
+    )
+
+def openrouter_client():
+    from openai import OpenAI
+    # openrouter api key
+    return OpenAI(api_key="YOUR_API_KEY",base_url="https://openrouter.ai/api/v1")
+
+def claude_client():
+    import anthropic
+    # claude api key
+    return anthropic.Anthropic(
+        # os.environ.get("ANTHROPIC_API_KEY")
+        api_key="YOUR_API_KEY",
+    )
+
+def qwen_client():
+    from openai import OpenAI
+    # qwen api key
+    return OpenAI(
+        api_key = os.getenv("DASHSCOPE_API_KEY"),
+        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
+    )
+
+def gemini_genai_client():
+    from google import genai
+    # gemini api key
+    return genai.Client(api_key="YOUR_API_KEY")
+
+# backend name -> client factory (gpt5 and gemini share the openrouter client)
+FACTORIES = {
+    "chatgpt": openai_client,
+    "gpt5": openrouter_client,
+    "gemini": openrouter_client,
+    "gemini_genai": gemini_genai_client,
+    "claude": claude_client,
+    "qwen": qwen_client,
+}
+
+_clients = {}
+_lock = threading.Lock()
+
+# add or replace a backend
+def register(name, factory):
+    with _lock:
+        FACTORIES[name] = factory
+        _clients.pop(name, None)
+
+# client of a backend, created on first use and shared by backends with the same factory
+def get_client(name):
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    with _lock:
+        if name not in _clients:
+            factory = FACTORIES[name]
+            for other, other_factory in FACTORIES.items():
+                if other_factory is factory and other in _clients:
+                    _clients[name] = _clients[other]
+                    break
+            else:
+                _clients[name] = factory()
+        return _clients[name]
+
+# backends with a created client
+def loaded():
+    return sorted(_clients)
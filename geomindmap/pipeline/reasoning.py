@@ -2,14 +2,12 @@ import os
 import base64
 import re
 import json
-import requests
 import argparse
-import backoff
-from openai import OpenAI, APIError, RateLimitError
-from google import genai
-from google.genai import types
-import anthropic
 import time
+import providers
+import routing
+import streaming
+import hedging
 
 """
 reasoning.py
@@ -19,37 +17,19 @@ reasoning.py
 - Evaluates reasoning accuracy in Granularity Score (0-3)
 - Detects reasoning patterns (BF/DF/Switch)
 - Main outputs: reasoning.json, step_acc.json, pattern.json
+- Provider clients come from providers.py and are created on first use
+- Every provider streams; streaming.py measures time to first (reasoning) token and
+  tokens/s of each reasoning call, saved as stream_metrics.json
+- Slow reasoning calls can be hedged with a duplicate request (hedging.py, opt-in)
 
 Functions:
+- load_image(image_path), load_ground_truth(ground_truth_path, pic): shared preprocessing,
+  results can be passed to the functions below to avoid repeated work
 - reasoning functions for each model
 - step_accuracy(): evaluate step-wise correctness (0-3)
 - detect_pattern(): annotate BF/DF/Switch patterns
 """
 
-# opeanai api key
-client_chatgpt = OpenAI(
-    api_key = os.getenv("OPENAI_API_KEY"),
-)
-
-# openrouter api key
-client_openrouter = OpenAI(api_key="YOUR_API_KEY",base_url="https://openrouter.ai/api/v1")
-
-# claude api key
-client_claude = anthropic.Anthropic(
-    # os.environ.get("ANTHROPIC_API_KEY")
-    api_key="YOUR_API_KEY",
-)
-
-# qwen api key
-client_qwen = OpenAI(
-    api_key = os.getenv("DASHSCOPE_API_KEY"),
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-)
-
-# gemini api key
-client_gemini = genai.Client(api_key="YOUR_API_KEY")
-
-
 # check and fix json format using llm
 def check_fix_json(str):
     try:
@@ -61,11 +41,9 @@ def check_fix_json(str):
     prompt = """
         Fix the following JSON string by ensuring it is properly formatted and contains valid JSON syntax. Please output only raw JSON. Do not use any Markdown syntax. Do not modify the original content.
         """
-    response = client_chatgpt.responses.create(
-        model = "o4-mini", 
-        reasoning = { 
-            "effort": "medium"
-        },
+    response = routing.create(
+        "fix_json",
+        expect_json = True,
         input = [
             {
                 "role": "user",
@@ -107,8 +85,9 @@ def split_to_paragraph_llm(text):
     Your task:
     """
     total_tokens = 0
-    response = client_chatgpt.responses.create(
-        model = "o4-mini", 
+    response = routing.create(
+        "split",
+        expect_json = True,
         input = [
             {
                 "role": "user",
@@ -122,6 +101,21 @@ def split_to_paragraph_llm(text):
     return response.output_text, total_tokens
 
 
+# read and base64-encode an image once, shared by all models and stages
+def load_image(image_path):
+    with open(image_path, "rb") as image_file:
+        image_bytes = image_file.read()
+    return {"bytes": image_bytes, "base64": base64.b64encode(image_bytes).decode("utf-8")}
+
+# ground truth location string of a picture
+def load_ground_truth(ground_truth_path, pic):
+    with open(ground_truth_path, 'r', encoding='utf-8') as f:
+        gps_json = json.load(f)
+    country = gps_json[pic]['COUNTRY']
+    city = gps_json[pic]['CITY']
+    street = gps_json[pic]['STREET']
+    return f'country: {country}, city: {city}, street: {street}'
+
 def extract_final_conclusion(text):
     match = re.search(r"Final Conclusion:\s*(.*)", text)
     if match:
@@ -161,14 +155,24 @@ prompt = """
     
     Let's think step by step.
 """
+# streamed reasoning call, hedged: a slow request is duplicated and the first complete stream wins
+# create: SDK method, adapter: streaming adapter of its stream, request: keyword arguments of create
+def hedged_stream(model, create, adapter, request):
+    def attempt(i):
+        t_start = time.time()
+        # only the original attempt echoes its tokens
+        return streaming.collect(adapter(create(**request)), t_start, echo=i == 0)
+    return hedging.run(f"reasoning/{model}", attempt)
+
 # reasoning with chatgpt
-def reasoning_chatgpt(image_path, output_dir):
+def reasoning_chatgpt(image_path, output_dir, image=None):
 
     image_name = os.path.splitext(os.path.basename(image_path))[0]
     os.makedirs(output_dir, exist_ok=True)
     
-    with open(image_path, "rb") as image_file:
-        base64_image = base64.b64encode(image_file.read()).decode("utf-8")
+    if image is None:
+        image = load_image(image_path)
+    base64_image = image["base64"]
     
     output =""
     total_tokens = 0
@@ -176,7 +180,7 @@ def reasoning_chatgpt(image_path, output_dir):
     reasoning_tokens = 0
 
     t0 = time.time()
-    response = client_chatgpt.responses.create(
+    request = dict(
         model = "o4-mini", 
         tools = [ { "type": "web_search_preview" ,"search_context_size": "low"} ],
         reasoning = { 
@@ -202,20 +206,15 @@ def reasoning_chatgpt(image_path, output_dir):
         ]
     )
 
-    for event in response:
-        if event.type == 'response.reasoning_summary_text.done' or event.type == 'response.output_text.done':
-            output += event.text
-            print(event.text)
-        elif event.type == "response.completed":
-            response_tokens += event.response.usage.total_tokens
-            total_tokens += event.response.usage.total_tokens
-            reasoning_tokens += event.response.usage.output_tokens_details.reasoning_tokens
-            print("Total tokens:", total_tokens)
-            print("Reasoning tokens:", reasoning_tokens)
-            break
-    t1 = time.time()
-
-    response_time = t1 - t0
+    reasoning_content, answer_content, usage, metrics = hedged_stream("chatgpt", providers.get_client("chatgpt").responses.create, streaming.openai_responses, request)
+    output = reasoning_content + answer_content
+    response_tokens += usage["total_tokens"]
+    total_tokens += usage["total_tokens"]
+    reasoning_tokens += usage["reasoning_tokens"]
+    print("Total tokens:", total_tokens)
+    print("Reasoning tokens:", reasoning_tokens)
+    response_time = time.time() - t0
+    streaming.save_metrics(output_dir, metrics)
         
     paragraph, tokens = split_to_paragraph_llm(output)
     
@@ -230,12 +229,13 @@ def reasoning_chatgpt(image_path, output_dir):
     return total_tokens, response_tokens, reasoning_tokens, response_time
 
 # reasoning with gpt-5 using openrouter
-def reasoning_gpt5(image_path, output_dir):
+def reasoning_gpt5(image_path, output_dir, image=None):
     image_name = os.path.splitext(os.path.basename(image_path))[0]
     os.makedirs(output_dir, exist_ok=True)
     
-    with open(image_path, "rb") as image_file:
-        base64_image = base64.b64encode(image_file.read()).decode("utf-8")
+    if image is None:
+        image = load_image(image_path)
+    base64_image = image["base64"]
 
     reasoning_content = ""  
     answer_content = ""    
@@ -246,7 +246,7 @@ def reasoning_gpt5(image_path, output_dir):
 
     t0 = time.time()
 
-    completion = client_openrouter.chat.completions.create(
+    request = dict(
         model="openai/gpt-5",  
         messages=[
             {
@@ -264,21 +264,21 @@ def reasoning_gpt5(image_path, output_dir):
                 ],
             },
         ],
+        stream=True,
         stream_options={
             "include_usage": True
         },
         extra_body={"enable_thinking": True,"enable_search": True}
     )
-    t1 = time.time()
-    response_time = t1 - t0
-   
-    reasoning_content = completion.choices[0].message.reasoning
-    answer_content = completion.choices[0].message.content
+
+    reasoning_content, answer_content, usage, metrics = hedged_stream("gpt5", providers.get_client("gpt5").chat.completions.create, streaming.chat_completions, request)
+    response_time = time.time() - t0
+    streaming.save_metrics(output_dir, metrics)
     output = reasoning_content + "\n" + answer_content
     
-    response_tokens += completion.usage.total_tokens
+    response_tokens += usage["total_tokens"]
     total_tokens += response_tokens
-    reasoning_tokens += completion.usage.completion_tokens_details.reasoning_tokens
+    reasoning_tokens += usage["reasoning_tokens"] or 0
 
     paragraph, tokens = split_to_paragraph_llm(output)
     
@@ -293,12 +293,13 @@ def reasoning_gpt5(image_path, output_dir):
     return total_tokens, response_tokens, reasoning_tokens, response_time
 
 # reasoning with gemini using openrouter
-def reasoning_gemini(image_path, output_dir):
+def reasoning_gemini(image_path, output_dir, image=None):
     image_name = os.path.splitext(os.path.basename(image_path))[0]
     os.makedirs(output_dir, exist_ok=True)
     
-    with open(image_path, "rb") as image_file:
-        base64_image = base64.b64encode(image_file.read()).decode("utf-8")
+    if image is None:
+        image = load_image(image_path)
+    base64_image = image["base64"]
 
     reasoning_content = ""  
     answer_content = ""    
@@ -309,7 +310,7 @@ def reasoning_gemini(image_path, output_dir):
 
     t0 = time.time()
 
-    completion = client_openrouter.chat.completions.create(
+    request = dict(
         model="google/gemini-2.5-pro",  # google/gemini-2.5-pro 
         messages=[
             {
@@ -327,21 +328,21 @@ def reasoning_gemini(image_path, output_dir):
                 ],
             },
         ],
+        stream=True,
         stream_options={
             "include_usage": True
         },
         extra_body={"enable_thinking": True,"enable_search": True}
     )
-    t1 = time.time()
-    response_time = t1 - t0
-   
-    reasoning_content = completion.choices[0].message.reasoning
-    answer_content = completion.choices[0].message.content
+
+    reasoning_content, answer_content, usage, metrics = hedged_stream("gemini", providers.get_client("gemini").chat.completions.create, streaming.chat_completions, request)
+    response_time = time.time() - t0
+    streaming.save_metrics(output_dir, metrics)
     output = reasoning_content + "\n" + answer_content
     
-    response_tokens += completion.usage.total_tokens
+    response_tokens += usage["total_tokens"]
     total_tokens += response_tokens
-    reasoning_tokens += completion.usage.completion_tokens_details.reasoning_tokens
+    reasoning_tokens += usage["reasoning_tokens"] or 0
 
     paragraph, tokens = split_to_paragraph_llm(output)
     
@@ -356,12 +357,13 @@ def reasoning_gemini(image_path, output_dir):
     return total_tokens, response_tokens, reasoning_tokens, response_time
 
 # reasoning with claude
-def reasoning_claude(image_path, output_dir):
+def reasoning_claude(image_path, output_dir, image=None):
     image_name = os.path.splitext(os.path.basename(image_path))[0]
     os.makedirs(output_dir, exist_ok=True)
     
-    with open(image_path, "rb") as image_file:
-        base64_image = base64.b64encode(image_file.read()).decode("utf-8")
+    if image is None:
+        image = load_image(image_path)
+    base64_image = image["base64"]
     
     output =""
     total_tokens = 0
@@ -370,7 +372,7 @@ def reasoning_claude(image_path, output_dir):
 
     t0 = time.time()
 
-    response = client_claude.messages.create(
+    request = dict(
         model="claude-sonnet-4-20250514",
         max_tokens=16000,
         thinking={
@@ -399,23 +401,21 @@ def reasoning_claude(image_path, output_dir):
     tools=[{
         "type": "web_search_20250305",
         "name": "web_search"
-    }]
+    }],
+    stream=True
     )
-    t1 = time.time()
-    response_time = t1 - t0
-
-    # The response will contain summarized thinking blocks and text blocks
-    for block in response.content:
-        if block.type == "thinking":
-            output += block.thinking
-            print(f"\nThinking summary: {block.thinking}")
-        elif block.type == "text":
-            print(f"\nResponse: {block.text}")
-            if extract_final_conclusion(block.text):
-                output += extract_final_conclusion(block.text)
-    
-    print(response.usage.output_tokens)
-    response_tokens += response.usage.output_tokens
+
+    # The stream contains summarized thinking blocks and text blocks (one text block per line)
+    thinking, text, usage, metrics = hedged_stream("claude", providers.get_client("claude").messages.create, streaming.anthropic_messages, request)
+    response_time = time.time() - t0
+    streaming.save_metrics(output_dir, metrics)
+    output += thinking
+    for line in text.split("\n"):
+        if extract_final_conclusion(line):
+            output += extract_final_conclusion(line)
+    
+    print(usage["output_tokens"])
+    response_tokens += usage["output_tokens"]
     total_tokens += response_tokens
     
     paragraph, tokens = split_to_paragraph_llm(output)
@@ -431,25 +431,25 @@ def reasoning_claude(image_path, output_dir):
     return total_tokens, response_tokens, reasoning_tokens, response_time
 
 # reasoning with qwen
-def reasoning_qwen(image_path, output_dir):
+def reasoning_qwen(image_path, output_dir, image=None):
     
     image_name = os.path.splitext(os.path.basename(image_path))[0]
     os.makedirs(output_dir, exist_ok=True)
     
-    with open(image_path, "rb") as image_file:
-        base64_image = base64.b64encode(image_file.read()).decode("utf-8")
+    if image is None:
+        image = load_image(image_path)
+    base64_image = image["base64"]
 
     reasoning_content = ""  # 定义完整思考过程
     answer_content = ""     # 定义完整回复
     output ="" # 最终输出
-    is_answering = False   # 判断是否结束思考过程并开始回复
     total_tokens = 0
     response_tokens = 0
     reasoning_tokens = 0
 
     t0 = time.time()
     # 创建聊天完成请求
-    completion = client_qwen.chat.completions.create(
+    request = dict(
         model="qvq-max",  # 此处以 qvq-max 为例，可按需更换模型名称
         messages=[
             {
@@ -474,32 +474,13 @@ def reasoning_qwen(image_path, output_dir):
         }
     )
 
-    print("\n" + "=" * 20 + "思考过程" + "=" * 20 + "\n")
-
-    for chunk in completion:
-        # 如果chunk.choices为空，则打印usage
-        if not chunk.choices:
-            print("\nUsage:")
-            print(chunk.usage)
-            response_tokens += chunk.usage.total_tokens
-            total_tokens += chunk.usage.total_tokens
-            reasoning_tokens += chunk.usage.completion_tokens_details.reasoning_tokens
-        else:
-            delta = chunk.choices[0].delta
-            # 打印思考过程
-            if hasattr(delta, 'reasoning_content') and delta.reasoning_content != None:
-                print(delta.reasoning_content, end='', flush=True)
-                reasoning_content += delta.reasoning_content
-            else:
-                # 开始回复
-                if delta.content != "" and is_answering is False:
-                    print("\n" + "=" * 20 + "完整回复" + "=" * 20 + "\n")
-                    is_answering = True
-                # 打印回复过程
-                print(delta.content, end='', flush=True)
-                answer_content += delta.content
-    t1 = time.time()
-    response_time = t1 - t0
+    reasoning_content, answer_content, usage, metrics = hedged_stream("qwen", providers.get_client("qwen").chat.completions.create, streaming.chat_completions, request)
+    response_time = time.time() - t0
+    streaming.save_metrics(output_dir, metrics)
+    print("\nUsage:", usage)
+    response_tokens += usage["total_tokens"]
+    total_tokens += usage["total_tokens"]
+    reasoning_tokens += usage["reasoning_tokens"] or 0
     
     output = reasoning_content + "\n" + answer_content
 
@@ -516,23 +497,26 @@ def reasoning_qwen(image_path, output_dir):
     return total_tokens, response_tokens, reasoning_tokens, response_time
 
 # reasoning with gemini using google genai
-def reasoning_gemini_genai(image_path, output_dir):
+def reasoning_gemini_genai(image_path, output_dir, image=None):
     
-    with open(image_path, 'rb') as f:
-        image_bytes = f.read()
+    if image is None:
+        image = load_image(image_path)
+    image_bytes = image["bytes"]
     
     output = ""
     total_tokens = 0
     response_tokens = 0
     reasoning_tokens = 0
 
+    from google.genai import types
+
     # Define the grounding tool
     grounding_tool = types.Tool(
         google_search=types.GoogleSearch()
     )
 
     t0 = time.time()
-    response = client_gemini.models.generate_content(
+    request = dict(
         model='gemini-2.5-pro',
         contents=[
         types.Part.from_bytes(
@@ -549,27 +533,14 @@ def reasoning_gemini_genai(image_path, output_dir):
         )
     )
 
-    for part in response.candidates[0].content.parts:
-        if not part.text:
-            continue
-        if part.thought:
-            print("Thought summary:")
-            print(part.text)
-            print()
-            output += part.text
-
-        else:
-            print("Answer:")
-            print(part.text)
-            print()
-            output += part.text
-    t1 = time.time()
+    thoughts, answer, usage, metrics = hedged_stream("gemini_genai", providers.get_client("gemini_genai").models.generate_content_stream, streaming.genai_content, request)
+    output = thoughts + answer
+    response_time = time.time() - t0
+    streaming.save_metrics(output_dir, metrics)
 
-    response_time = t1 - t0
-
-    response_tokens = response.usage_metadata.total_token_count
-    total_tokens += response.usage_metadata.total_token_count
-    reasoning_tokens += response.usage_metadata.thoughts_token_count
+    response_tokens = usage["total_tokens"]
+    total_tokens += usage["total_tokens"]
+    reasoning_tokens += usage["reasoning_tokens"] or 0
     
     paragraph, tokens = split_to_paragraph_llm(output)
     
@@ -583,21 +554,8 @@ def reasoning_gemini_genai(image_path, output_dir):
     total_tokens += tokens
     return total_tokens, response_tokens, reasoning_tokens, response_time
 
-
-# check the accuracy/correctness of each step in Granualrity Score
-def step_accuracy(reasoning_path, ground_truth_path, pic, output_dir):
-
-    with open(reasoning_path, 'r', encoding='utf-8') as f:
-        reasoning = json.load(f)
-    
-    with open(ground_truth_path, 'r', encoding='utf-8') as f:
-        gps_json = json.load(f)
-    country = gps_json[pic]['COUNTRY']
-    city = gps_json[pic]['CITY']
-    street = gps_json[pic]['STREET']
-    ground_truth = f'country: {country}, city: {city}, street: {street}'
-
-    prompt_stepAcc = """
+# instruction prompts of step_accuracy and detect_pattern (also used by batch_eval.py)
+prompt_stepAcc = """
     You are an helpful assistant to evaluate the accuracy of location conclusions.
     Given a text, for each paragraph, compare the hypothesis or conclusion by the end of it with the ground truth location, and rate accuracy: 
     0: No clear hypothesis or conclusion, or completely wrong at all levels. 
@@ -610,48 +568,8 @@ def step_accuracy(reasoning_path, ground_truth_path, pic, output_dir):
         - Strictly follow the output format 
         - Please output only raw JSON. Do not use any Markdown syntax
     """
-    response = client_chatgpt.responses.create(
-        model = "o4-mini", 
-        input = [
-            {
-                "role": "system",
-                "content": [
-                    {"type": "input_text", "text":prompt_stepAcc},               
-                ]
-            },
-            {
-                "role": "user",
-                "content": [
-                    {"type": "input_text", "text":f"Here is the reasoning text:{reasoning}, Here is the ground truth location:{ground_truth}"},               
-                ]
-            }
-        ]
-    )
-    output = check_fix_json(response.output_text)
-    step_acc = json.loads(output)
-    # last step accuracy
-    final_acc = step_acc[-1]['accuracy']
-
-    with open(output_dir + "step_acc.json", "w", encoding="utf-8") as f:
-        f.write(output + "\n")
-    print(f"Accuracy Rating for {pic}: {output}")
-    
-    return final_acc, response.usage.total_tokens
-
-# detect the pattern of each step
-def detect_pattern(reasoning_path, ground_truth_path, pic, output_dir):
-
-    with open(reasoning_path, 'r', encoding='utf-8') as f:
-        reasoning = json.load(f)
-    
-    with open(ground_truth_path, 'r', encoding='utf-8') as f:
-        gps_json = json.load(f)
-    country = gps_json[pic]['COUNTRY']
-    city = gps_json[pic]['CITY']
-    street = gps_json[pic]['STREET']
-    ground_truth = f'country: {country}, city: {city}, street: {street}'
 
-    prompt_pattern = """
+prompt_pattern = """
     You are a research expert specializing in analyzing LLM reasoning processes. Your task is to annotate and analyze LLM geolocation reasoning trajectories based on a defined theoretical framework.
 
     1. You will analyze a series of reasoning steps. After careful analysis, classify each paragraph according to its main content into one of the following two patterns:
@@ -712,11 +630,57 @@ def detect_pattern(reasoning_path, ground_truth_path, pic, output_dir):
     * Strictly follow JSON format, do not output in markdown format
 
     """
-    response = client_chatgpt.responses.create(
-        model = "o4-mini",
-        reasoning = { 
-            "effort": "medium"
-        }, 
+
+# check the accuracy/correctness of each step in Granualrity Score
+def step_accuracy(reasoning_path, ground_truth_path, pic, output_dir, ground_truth=None):
+
+    with open(reasoning_path, 'r', encoding='utf-8') as f:
+        reasoning = json.load(f)
+    
+    if ground_truth is None:
+        ground_truth = load_ground_truth(ground_truth_path, pic)
+
+    response = routing.create(
+        "step_accuracy",
+        expect_json = True,
+        input = [
+            {
+                "role": "system",
+                "content": [
+                    {"type": "input_text", "text":prompt_stepAcc},               
+                ]
+            },
+            {
+                "role": "user",
+                "content": [
+                    {"type": "input_text", "text":f"Here is the reasoning text:{reasoning}, Here is the ground truth location:{ground_truth}"},               
+                ]
+            }
+        ]
+    )
+    output = check_fix_json(response.output_text)
+    step_acc = json.loads(output)
+    # last step accuracy
+    final_acc = step_acc[-1]['accuracy']
+
+    with open(output_dir + "step_acc.json", "w", encoding="utf-8") as f:
+        f.write(output + "\n")
+    print(f"Accuracy Rating for {pic}: {output}")
+    
+    return final_acc, response.usage.total_tokens
+
+# detect the pattern of each step
+def detect_pattern(reasoning_path, ground_truth_path, pic, output_dir, ground_truth=None):
+
+    with open(reasoning_path, 'r', encoding='utf-8') as f:
+        reasoning = json.load(f)
+    
+    if ground_truth is None:
+        ground_truth = load_ground_truth(ground_truth_path, pic)
+
+    response = routing.create(
+        "pattern",
+        expect_json = True,
         input = [
             {
                 "role": "system",
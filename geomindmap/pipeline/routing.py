@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+import providers
+import runlog
+import hedging
+"""
+routing.py
+----------
+This module routes the helper LLM calls of the pipeline (JSON fixing, segmentation,
+extraction, matching, step accuracy, pattern detection) to a model and reasoning effort
+chosen per stage and input size, instead of o4-mini at medium effort for every call.
+The reasoning traces of the studied models are not routed.
+Every routed call is recorded in a trace (stage, input size, model, effort, tokens,
+latency, valid JSON output), so policies can be compared offline by replaying the trace.
+
+Policies are lists of rules, the first matching rule wins:
+    {"stage": "fix_json", "max_chars": 4000, "image": False, "model": "gpt-4.1-mini", "effort": None}
+- stage: stage name or "*"; max_chars: input size limit (None = any); image: require/forbid an image
+- effort None: no reasoning parameter (non-reasoning model or provider default)
+Custom policies can be loaded from a JSON file {name: [rules]} via load_policies().
+
+Functions:
+- route(stage, input_chars, has_image, policy): model and effort of a call
+- create(stage, input, **kwargs): routed responses.create call, recorded in the trace;
+  hedged and bounded by the stage deadline (hedging.py)
+- set_policy(name), load_policies(path): choose / add policies
+- replay(trace_path, policies): estimate latency and tokens of each policy from a trace
+"""
+
+TRACE_PATH = "geomindmap/data/routing_trace.jsonl"
+STAGES = ["fix_json", "split", "extract_entity", "vi_map", "l_map", "match", "step_accuracy", "pattern"]
+
+POLICIES = {
+    # default: one reasoning model at medium effort for everything (behaviour before routing)
+    "baseline": [
+        {"stage": "*", "model": "o4-mini", "effort": "medium"},
+    ],
+    # opt-in (--routing latency): compare with baseline via replay() and spot-check outputs first.
+    # mechanical calls on a small non-reasoning model, reasoning effort grows with input size;
+    # stages chained by previous_response_id (extract_entity -> vi_map -> l_map, match) stay on o4-mini
+    "latency": [
+        {"stage": "fix_json", "max_chars": 8000, "model": "gpt-4.1-mini", "effort": None},
+        {"stage": "split", "max_chars": 30000, "model": "gpt-4.1-mini", "effort": None},
+        {"stage": "match", "max_chars": 6000, "model": "o4-mini", "effort": "low"},
+        {"stage": "vi_map", "max_chars": 4000, "model": "o4-mini", "effort": "low"},
+        {"stage": "step_accuracy", "max_chars": 12000, "model": "o4-mini", "effort": "low"},
+        {"stage": "*", "model": "o4-mini", "effort": "medium"},
+    ],
+}
+# no silent model changes for existing runs: other policies are opt-in
+DEFAULT_POLICY = os.getenv("GEOMINDMAP_ROUTING", "baseline")
+
+_policy = DEFAULT_POLICY
+_trace = None
+_lock = threading.Lock()
+
+# choose the active policy
+def set_policy(name):
+    global _policy
+    if name not in POLICIES:
+        raise ValueError(f"Unknown routing policy: {name}")
+    _policy = name
+
+# add policies from a JSON file {name: [rules]}
+def load_policies(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        POLICIES.update(json.load(f))
+    return sorted(POLICIES)
+
+# model and effort of a call: first matching rule of the policy
+def route(stage, input_chars, has_image=False, policy=None):
+    for rule in POLICIES[policy or _policy]:
+        if rule.get("stage", "*") not in ("*", stage):
+            continue
+        if rule.get("max_chars") is not None and input_chars > rule["max_chars"]:
+            continue
+        if rule.get("image") is not None and rule["image"] != has_image:
+            continue
+        return rule["model"], rule.get("effort")
+    raise ValueError(f"No routing rule for stage {stage} in policy {policy or _policy}")
+
+# input size in characters and whether an image is attached
+def measure(input):
+    chars, has_image = 0, False
+    for message in input:
+        content = message.get("content", "")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content:
+            if part.get("type") == "input_image":
+                has_image = True
+            chars += len(part.get("text", ""))
+    return chars, has_image
+
+# append a record to the routing trace
+def record(entry, trace_path=None):
+    global _trace
+    trace_path = trace_path or TRACE_PATH
+    with _lock:
+        if _trace is None or _trace.path != trace_path:
+            _trace = runlog.RunLog(trace_path, fsync_every=20)
+        _trace.append(entry)
+
+# routed responses.create call; extra kwargs (previous_response_id, tools, ...) are passed through
+def create(stage, input, expect_json=False, **kwargs):
+    chars, has_image = measure(input)
+    model, effort = route(stage, chars, has_image)
+    if effort is not None:
+        kwargs["reasoning"] = {**kwargs.get("reasoning", {}), "effort": effort}
+    else:
+        kwargs.pop("reasoning", None)
+
+    t0 = time.time()
+    client = providers.get_client("chatgpt")
+    response = hedging.run(f"{stage}/{model}", lambda i: client.responses.create(model=model, input=input, **kwargs))
+    latency = time.time() - t0
+
+    usage = response.usage
+    details = getattr(usage, "output_tokens_details", None)
+    entry = {
+        "time": t0, "stage": stage, "policy": _policy, "model": model, "effort": effort,
+        "input_chars": chars, "image": has_image, "chained": "previous_response_id" in kwargs,
+        "tokens": usage.total_tokens, "output_tokens": usage.output_tokens,
+        "reasoning_tokens": getattr(details, "reasoning_tokens", 0) if details else 0,
+        "latency": round(latency, 3),
+    }
+    if expect_json:
+        try:
+            json.loads(response.output_text)
+            entry["valid_json"] = True
+        except json.JSONDecodeError:
+            entry["valid_json"] = False
+    record(entry)
+    return response
+
+# estimate latency/tokens of each policy over the calls of a trace
+def replay(trace_path=TRACE_PATH, policies=None):
+    """
+    For every (model, effort) seen in the trace, latency and tokens are fitted linearly
+    in the input size; each policy is then applied to the traced calls and the fitted
+    costs are summed. Calls routed to a (model, effort) without observations are counted
+    as "unobserved" instead of being estimated.
+    """
+    calls = runlog.read_log(trace_path)
+    if not calls:
+        print(f"No routed calls in {trace_path}")
+        return {}
+
+    # linear cost model per (model, effort): value = a * input_chars + b
+    fits = {}
+    groups = {}
+    for c in calls:
+        groups.setdefault((c["model"], c["effort"]), []).append(c)
+    for key, group in groups.items():
+        x = np.array([c["input_chars"] for c in group], dtype=float)
+        fit = {}
+        for col in ("latency", "tokens"):
+            y = np.array([c[col] for c in group], dtype=float)
+            fit[col] = np.polyfit(x, y, 1) if len(group) >= 3 and np.ptp(x) > 0 else np.array([0.0, y.mean()])
+        json_ok = [c["valid_json"] for c in group if "valid_json" in c]
+        fit["valid_json"] = float(np.mean(json_ok)) if json_ok else None
+        fits[key] = fit
+
+    report = {}
+    for name in policies or sorted(POLICIES):
+        stages = {}
+        for c in calls:
+            key = route(c["stage"], c["input_chars"], c["image"], policy=name)
+            s = stages.setdefault(c["stage"], {"calls": 0, "latency": 0.0, "tokens": 0.0, "unobserved": 0})
+            s["calls"] += 1
+            if key not in fits:
+                s["unobserved"] += 1
+                continue
+            s["latency"] += max(float(np.polyval(fits[key]["latency"], c["input_chars"])), 0.0)
+            s["tokens"] += max(float(np.polyval(fits[key]["tokens"], c["input_chars"])), 0.0)
+        for s in stages.values():
+            s["latency"] = round(s["latency"], 2)
+            s["tokens"] = round(s["tokens"])
+        report[name] = {
+            "latency": round(sum(s["latency"] for s in stages.values()), 2),
+            "tokens": sum(s["tokens"] for s in stages.values()),
+            "unobserved": sum(s["unobserved"] for s in stages.values()),
+            "stages": stages,
+        }
+        print(f"{name}: {report[name]['latency']} s, {report[name]['tokens']} tokens, {report[name]['unobserved']} unobserved calls")
+    report["observed"] = {
+        f"{m}/{e}": {"calls": len(groups[(m, e)]), "valid_json": fits[(m, e)]["valid_json"]}
+        for m, e in fits
+    }
+    return report
+
+
+if __name__ == "__main__":
+    replay()
@@ -0,0 +1,105 @@
+import os
+import re
+import json
+import time
+"""
+runlog.py
+---------
+This module stores the process info of a batch run as an append-only JSONL log.
+Each finished picture appends one line (flushed immediately, fsync in batches), so
+killing the process never corrupts earlier records. Compaction turns the log into
+the summary JSON list used in data/<model>/info/.
+Every batch has a run ID, so repeated or concurrent batches write separate files.
+
+Functions:
+- new_run_id(): unique run ID (timestamp + process id)
+- run_order(path): sort key of info files by the start time in their run ID
+- RunLog(path, fsync_every): append-only log writer with batched fsync
+- read_log(path): read records, ignore a truncated last line
+- atomic_write_json(path, data): write JSON via temp file + fsync + rename
+- compact(log_path, out_file): deduplicate log records per picture and save summary JSON
+"""
+
+# unique run id: timestamp + process id
+def new_run_id():
+    return time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+
+# sort key of info files: start time of the run ID in the name (copying or checking out
+# files changes their mtime, not their name); files without a run ID come first, by name
+def run_order(path):
+    name = os.path.basename(path)
+    match = re.search(r"(\d{8}-\d{6})-\d+", name)
+    return (match.group(1) if match else "", name)
+
+# append-only JSONL writer
+class RunLog:
+    def __init__(self, path, fsync_every=5):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.fsync_every = fsync_every
+        self.pending = 0
+        self.file = open(path, "a", encoding="utf-8")
+        # terminate a line truncated by a killed run, so new records stay readable
+        if self.file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write("\n")
+
+    def append(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # flushed lines survive a killed process, fsync protects against power loss
+        self.file.flush()
+        self.pending += 1
+        if self.pending >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# read log records, skip a truncated last line
+def read_log(path):
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"Skip broken line in {path}: {line[:80]}")
+    return records
+
+# write JSON atomically: temp file + fsync + rename
+def atomic_write_json(path, data):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+# compact log into summary JSON (last record per picture wins)
+def compact(log_path, out_file):
+    results = {}
+    for record in read_log(log_path):
+        results[record["picture"]] = record
+    results = list(results.values())
+    atomic_write_json(out_file, results)
+    print(f"Compacted {len(results)} records from {log_path} to {out_file}")
+    return results
@@ -0,0 +1,168 @@
+import os
+import json
+import glob
+import time
+from collections import Counter
+import gazetteer
+"""
+search_index.py
+---------------
+This module builds a dataset-wide inverted index of clue and location entities.
+Each normalized entity term maps to postings:
+    {"model", "picture", "step", "type", "status", "clues"}
+- clue terms (type v/i): one posting per step where the clue is matched
+- location terms (type l): one posting per step with its status (1 excluded, 2 included,
+  3 concluded) and the supporting clues
+The index is updated incrementally per picture directory (mtime/size of entity.json and
+para_match.json) and exported as sharded files for the search box in index.html.
+
+Functions:
+- build_postings(pic_dir, model): postings of one picture
+- update(data_dir, index_path, export_dir): incremental index update, optional web export
+- search(index, query, status, model): postings of terms matching the query
+- supporting_clues(index, status, top): clues that most often support locations with a status
+- export(index, export_dir): write sharded index files for index.html
+"""
+
+INDEX_PATH = "geomindmap/data/search_index.json"
+EXPORT_DIR = "geomindmap/search/"
+STATUS = {1: "excluded", 2: "included", 3: "concluded"}
+
+# postings of one picture: {term: [posting]}
+def build_postings(pic_dir, model):
+    picture = os.path.basename(os.path.normpath(pic_dir))
+    with open(os.path.join(pic_dir, "entity.json"), 'r', encoding='utf-8') as f:
+        entity_type = {e["entity"]: e["type"] for e in json.load(f)}
+    para_match = []
+    if os.path.exists(os.path.join(pic_dir, "para_match.json")):
+        with open(os.path.join(pic_dir, "para_match.json"), 'r', encoding='utf-8') as f:
+            para_match = json.load(f)
+
+    postings = {}
+    names = {}
+    def add(name, posting):
+        key = gazetteer.normalize(name)
+        postings.setdefault(key, []).append(posting)
+        names.setdefault(key, name)
+
+    for m in para_match:
+        step = m.get("paragraph")
+        for clue in m.get("clue", []):
+            add(clue, {"model": model, "picture": picture, "step": step, "type": entity_type.get(clue, "v"), "status": None, "clues": []})
+        for l in m.get("loc-clue", []):
+            add(l["loc"], {"model": model, "picture": picture, "step": step, "type": "l", "status": l.get("status"), "clues": l.get("related_clue", [])})
+
+    # entities never matched to a paragraph
+    for name, etype in entity_type.items():
+        if gazetteer.normalize(name) not in postings:
+            add(name, {"model": model, "picture": picture, "step": None, "type": etype, "status": None, "clues": []})
+    return postings, names
+
+# load index file
+def load_index(index_path=INDEX_PATH):
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {"manifest": {}, "pictures": {}}
+
+# build the term -> postings map from per-picture postings
+def terms(index):
+    if "_terms" not in index:
+        merged = {}
+        for entry in index["pictures"].values():
+            for key, postings in entry["postings"].items():
+                term = merged.setdefault(key, {"name": entry["names"][key], "postings": []})
+                term["postings"].extend(postings)
+        index["_terms"] = merged
+    return index["_terms"]
+
+# incremental update: only re-read changed picture directories
+def update(data_dir="geomindmap/data/", index_path=INDEX_PATH, export_dir=EXPORT_DIR):
+    t0 = time.time()
+    index = load_index(index_path)
+    seen = set()
+    changed = 0
+    for pic_dir in sorted(glob.glob(os.path.join(data_dir, "*", "pic*", ""))):
+        if not os.path.exists(pic_dir + "entity.json"):
+            continue
+        model = os.path.basename(os.path.dirname(os.path.dirname(pic_dir)))
+        key = f"{model}/{os.path.basename(os.path.normpath(pic_dir))}"
+        seen.add(key)
+        stamp = [[os.path.getmtime(p), os.path.getsize(p)] if os.path.exists(p) else None
+                 for p in (pic_dir + "entity.json", pic_dir + "para_match.json")]
+        if index["manifest"].get(key) == stamp:
+            continue
+        try:
+            postings, names = build_postings(pic_dir, model)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Skip {pic_dir}: {e}")
+            continue
+        index["pictures"][key] = {"postings": postings, "names": names}
+        index["manifest"][key] = stamp
+        changed += 1
+
+    # drop removed pictures
+    for key in set(index["pictures"]) - seen:
+        del index["pictures"][key]
+        del index["manifest"][key]
+
+    if changed or not os.path.exists(index_path):
+        with open(index_path, 'w', encoding='utf-8') as f:
+            json.dump({"manifest": index["manifest"], "pictures": index["pictures"]}, f, ensure_ascii=False)
+    print(f"Search index: {len(index['pictures'])} pictures, {changed} updated in {time.time() - t0:.2f} s")
+    if export_dir and changed:
+        export(index, export_dir)
+    return index
+
+# postings of terms matching the query (exact normalized term, or substring if exact=False)
+def search(index, query, status=None, model=None, exact=False):
+    q = gazetteer.normalize(query)
+    results = []
+    for key, term in terms(index).items():
+        if key != q and (exact or q not in key):
+            continue
+        for p in term["postings"]:
+            if status is not None and p["status"] != status:
+                continue
+            if model is not None and p["model"] != model:
+                continue
+            results.append(dict(p, term=term["name"]))
+    return results
+
+# clues that most often support locations with the given status
+def supporting_clues(index, status=1, top=20):
+    counter = Counter()
+    for term in terms(index).values():
+        for p in term["postings"]:
+            if p["type"] == "l" and p["status"] == status:
+                counter.update(gazetteer.normalize(c) for c in p["clues"])
+    return counter.most_common(top)
+
+# shard of a normalized term: first letter or digit, "_" otherwise
+def shard_of(key):
+    c = key[:1]
+    return c if c.isascii() and c.isalnum() else "_"
+
+# write sharded index files for index.html
+def export(index, export_dir=EXPORT_DIR):
+    os.makedirs(export_dir, exist_ok=True)
+    shards = {}
+    for key, term in terms(index).items():
+        shards.setdefault(shard_of(key), {})[key] = {
+            "name": term["name"],
+            # compact postings: [model, picture, step, type, status, clues]
+            "postings": [[p["model"], p["picture"], p["step"], p["type"], p["status"], p["clues"]] for p in term["postings"]],
+        }
+    for name, shard in shards.items():
+        with open(os.path.join(export_dir, f"{name}.json"), 'w', encoding='utf-8') as f:
+            json.dump(shard, f, ensure_ascii=False, separators=(",", ":"))
+    with open(os.path.join(export_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+        json.dump({"shards": sorted(shards), "terms": sum(len(s) for s in shards.values())}, f)
+    print(f"Exported {len(shards)} search shards to {export_dir}")
+
+
+if __name__ == "__main__":
+    index = update()
+    t0 = time.perf_counter()
+    hits = search(index, "Ratskeller")
+    print(f"'Ratskeller': {len(hits)} postings in {(time.perf_counter() - t0) * 1000:.2f} ms")
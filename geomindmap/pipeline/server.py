@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import queue
+import socket
+import threading
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import jobs
+"""
+server.py
+---------
+Local server for the GeoMindMap viewer with live pipeline progress.
+- serves geomindmap/ (index.html, data/, pictures/, search/) with ETag and Cache-Control
+  headers: unchanged files are revalidated with 304 responses, content-hashed URLs (?v=)
+  are cached as immutable
+- /events?model=&picture=: server-sent events with each pipeline artifact as soon as it is
+  written (reasoning paragraphs, entities, match records per paragraph, layouts, ...)
+- --run: runs the pipeline (same arguments as main.py) in the background while serving
+- --jobs N: pipeline service with N worker threads (jobs.py)
+  POST /jobs?model=claude,chatgpt&stages=reasoning,extract   body: image (PNG, others need Pillow)
+  POST /jobs   JSON body {"pictures": ["pic10.png"], "models": [...], "stages": [...]}
+  GET /jobs, GET /jobs/<id>: status, current stage, stage timings, result files in data/
+
+Usage (from repository root):
+    python geomindmap/pipeline/server.py --port 8000
+    python geomindmap/pipeline/server.py --port 8000 --run --model claude --pics pic10
+    python geomindmap/pipeline/server.py --jobs 4
+    python geomindmap/pipeline/server.py --host 0.0.0.0   # reachable from the network (no authentication)
+    curl --data-binary @photo.jpg "http://127.0.0.1:8000/jobs?model=claude"
+
+Functions:
+- watch(data_dir, interval): poll artifact files and publish changed ones to subscribers
+- subscribe(model, picture) / unsubscribe(q): event queues of SSE clients
+- cache_control(path, query): Cache-Control header of a static file
+- serve(root, port, run_args, job_workers, max_pending, host): start the HTTP server
+"""
+
+ROOT_DIR = "geomindmap/"
+# artifacts pushed to the viewer, in pipeline order
+ARTIFACTS = [
+    "reasoning.json", "step_acc.json", "entity.json", "vi_map_info.json", "l_map_info.json",
+    "para_match.json", "vi_map_layout.json", "l_map_layout.json", "l_map_global_layout.json", "pattern.json",
+]
+# loopback only: /jobs uploads files and starts paid LLM calls without authentication
+DEFAULT_HOST = "127.0.0.1"
+KEEPALIVE = 15
+MAX_UPLOAD = 50 * 1024 * 1024
+
+_subscribers = []
+_lock = threading.Lock()
+
+# event queue of an SSE client, filtered by model / picture (None = all)
+def subscribe(model=None, picture=None):
+    q = queue.Queue(maxsize=1000)
+    with _lock:
+        _subscribers.append((model, picture, q))
+    return q
+
+def unsubscribe(q):
+    with _lock:
+        _subscribers[:] = [s for s in _subscribers if s[2] is not q]
+
+def publish(event):
+    with _lock:
+        targets = [q for model, picture, q in _subscribers
+                   if (model is None or model == event["model"]) and (picture is None or picture == event["picture"])]
+    for q in targets:
+        try:
+            q.put_nowait(event)
+        except queue.Full:
+            # slow client: drop, it reloads the files on the next picture selection
+            pass
+
+# poll artifact files, publish each complete (parseable) new version
+def watch(data_dir=ROOT_DIR + "data/", interval=0.5):
+    seen = {}
+    # files existing at start are not events
+    first = True
+    while True:
+        for model in os.listdir(data_dir):
+            model_dir = os.path.join(data_dir, model)
+            if not os.path.isdir(model_dir):
+                continue
+            for picture in os.listdir(model_dir):
+                if not picture.startswith("pic"):
+                    continue
+                for name in ARTIFACTS:
+                    path = os.path.join(model_dir, picture, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    stamp = (st.st_mtime_ns, st.st_size)
+                    if seen.get(path) == stamp:
+                        continue
+                    if first:
+                        seen[path] = stamp
+                        continue
+                    try:
+                        with open(path, 'r', encoding='utf-8') as f:
+                            content = json.load(f)
+                    except (OSError, json.JSONDecodeError):
+                        # still being written, retry on the next poll
+                        continue
+                    seen[path] = stamp
+                    publish({"model": model, "picture": picture, "file": name, "content": content})
+        first = False
+        time.sleep(interval)
+
+# Cache-Control of a static file
+def cache_control(path, query):
+    if "v" in parse_qs(query):
+        # content-hashed URL (pictures/index.json manifest): never changes
+        return "public, max-age=31536000, immutable"
+    if path.endswith((".png", ".webp", ".pdf")):
+        return "public, max-age=86400"
+    # json data and html can change during a run: always revalidate (cheap 304 with ETag)
+    return "no-cache"
+
+class Handler(SimpleHTTPRequestHandler):
+    extra_headers = ()
+    # jobs.JobPool of the pipeline service (--jobs), None: viewer only
+    jobs = None
+
+    def end_headers(self):
+        for key, value in self.extra_headers:
+            self.send_header(key, value)
+        super().end_headers()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/events":
+            return self.events(parse_qs(url.query))
+        if url.path == "/jobs" or url.path.startswith("/jobs/"):
+            return self.get_jobs(url.path[len("/jobs/"):])
+        return super().do_GET()
+
+    def send_json(self, code, data, headers=()):
+        body = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+        self.extra_headers = (("Cache-Control", "no-store"),) + tuple(headers)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # job status: /jobs (all) or /jobs/<id>
+    def get_jobs(self, job_id):
+        if self.jobs is None:
+            return self.send_json(404, {"error": "pipeline service not enabled (server.py --jobs N)"})
+        if not job_id:
+            return self.send_json(200, self.jobs.list())
+        job = self.jobs.get(job_id)
+        if job is None:
+            return self.send_json(404, {"error": f"unknown job {job_id}"})
+        return self.send_json(200, job)
+
+    # new jobs: image upload (request body) or existing pictures (JSON)
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != "/jobs":
+            return self.send_json(404, {"error": "not found"})
+        if self.jobs is None:
+            return self.send_json(404, {"error": "pipeline service not enabled (server.py --jobs N)"})
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_UPLOAD:
+            return self.send_json(413 if length > 0 else 400, {"error": f"body of 1 byte to {MAX_UPLOAD} bytes required"})
+        body = self.rfile.read(length)
+        params = parse_qs(url.query)
+        # repeated or comma separated: ?model=claude&model=chatgpt or ?model=claude,chatgpt
+        values = lambda key: [v for item in params.get(key, []) for v in item.split(",") if v]
+        try:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                request = json.loads(body)
+                pictures = request.get("pictures", [])
+                models = request.get("models", ["chatgpt"])
+                stages = request.get("stages", None)
+                added = {}
+            else:
+                pic, new = self.jobs.add_picture(body)
+                pictures, added = [pic], {pic: new}
+                models = values("model") or ["chatgpt"]
+                stages = values("stages") or None
+            import main
+            submitted = [job for pic in pictures for job in self.jobs.submit(pic, models, stages or main.STAGES)]
+        except (ValueError, AttributeError) as e:
+            return self.send_json(400, {"error": str(e)})
+        except jobs.QueueFull as e:
+            return self.send_json(503, {"error": str(e)}, (("Retry-After", "60"),))
+        return self.send_json(202, {"pictures": pictures, "new_pictures": [p for p, new in added.items() if new], "jobs": submitted})
+
+    def send_head(self):
+        url = urlsplit(self.path)
+        path = self.translate_path(url.path)
+        self.extra_headers = ()
+        if os.path.isfile(path):
+            st = os.stat(path)
+            etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+            self.extra_headers = (("ETag", etag), ("Cache-Control", cache_control(url.path, url.query)))
+            if etag in [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]:
+                self.send_response(304)
+                self.end_headers()
+                return None
+        return super().send_head()
+
+    # server-sent events stream
+    def events(self, params):
+        model = params.get("model", [None])[0]
+        picture = params.get("picture", [None])[0]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "keep-alive")
+        self.end_headers()
+        q = subscribe(model, picture)
+        try:
+            self.wfile.write(b"event: hello\ndata: {}\n\n")
+            self.wfile.flush()
+            while True:
+                try:
+                    event = q.get(timeout=KEEPALIVE)
+                except queue.Empty:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    continue
+                data = json.dumps(event, ensure_ascii=False)
+                self.wfile.write(f"event: artifact\ndata: {data}\n\n".encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            unsubscribe(q)
+
+    def log_message(self, format, *args):
+        # events and 304s are frequent, keep the console for the pipeline output
+        pass
+
+# run the pipeline in a background thread (arguments of main.py, all options as on the command line)
+def run_pipeline(args):
+    import main
+    main.run(args)
+
+# start the HTTP server
+def serve(root=ROOT_DIR, port=8000, run_args=None, job_workers=0, max_pending=50, host=DEFAULT_HOST):
+    threading.Thread(target=watch, args=(os.path.join(root, "data/"),), daemon=True).start()
+    if run_args is not None:
+        threading.Thread(target=run_pipeline, args=(run_args,), daemon=True).start()
+    if job_workers:
+        Handler.jobs = jobs.JobPool(job_workers, max_pending, os.path.join(root, "pictures/"))
+        print(f"Pipeline service: {job_workers} worker(s), up to {max_pending} queued jobs")
+    handler = lambda *a, **kw: Handler(*a, directory=root, **kw)
+    server_class = ThreadingHTTPServer
+    if ":" in host:
+        # IPv6 address
+        server_class = type("ThreadingHTTPServer6", (ThreadingHTTPServer,), {"address_family": socket.AF_INET6})
+    server = server_class((host, port), handler)
+    server.daemon_threads = True
+    bound_host, bound_port = server.server_address[:2]
+    if bound_host in ("0.0.0.0", "::"):
+        print(f"Warning: listening on all interfaces, anyone on the network can use this server{' and its /jobs API' if job_workers else ''}")
+    url_host = f"[{bound_host}]" if ":" in bound_host else bound_host
+    print(f"Serving {root} on http://{url_host}:{bound_port}/index.html")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if Handler.jobs is not None:
+            Handler.jobs.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the GeoMindMap viewer with live pipeline progress; "
+                                                 "other arguments are passed to main.py with --run.")
+    parser.add_argument("--host", default=DEFAULT_HOST,
+                        help="address to listen on (default 127.0.0.1; 0.0.0.0 exposes the unauthenticated server to the network)")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--run", action="store_true", help="run the pipeline (main.py arguments) while serving")
+    parser.add_argument("--jobs", type=int, default=0, help="pipeline service with this many worker threads")
+    parser.add_argument("--max-pending", type=int, default=50, help="queued jobs before uploads are rejected (503)")
+    args, rest = parser.parse_known_args()
+    run_args = None
+    if args.run:
+        import main
+        run_args = main.parse_args(rest)
+    elif rest:
+        parser.error(f"unrecognized arguments: {' '.join(rest)} (pipeline arguments need --run)")
+    serve(ROOT_DIR, args.port, run_args, args.jobs, args.max_pending, args.host)
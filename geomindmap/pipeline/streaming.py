@@ -0,0 +1,140 @@
+import json
+import time
+from collections import namedtuple
+"""
+streaming.py
+------------
+This module turns the streaming responses of all reasoning providers into one event type
+and measures the responsiveness of each call:
+- ttft: time to the first token (reasoning or answer)
+- ttfr: time to the first reasoning token (None if the provider streams no reasoning)
+- tokens_per_s: output tokens per second after the first token
+- time_total: time of the whole call
+The times count from the request, so they include upload and queueing of the request.
+
+Event(kind, text, usage):
+- kind "reasoning": reasoning / thinking text delta
+- kind "text": answer text delta
+- kind "usage": usage dict {"total_tokens", "output_tokens", "reasoning_tokens"} (None: unknown)
+
+Adapters (SDK stream -> events):
+- openai_responses(stream): OpenAI Responses API (o4-mini)
+- chat_completions(stream): OpenAI-compatible chat completions (OpenRouter, DashScope)
+- anthropic_messages(stream): Anthropic messages with stream=True
+- genai_content(stream): google.genai generate_content_stream
+
+Functions:
+- collect(events, t0, echo): consume events, return reasoning text, answer text, usage and metrics
+- save_metrics(output_dir, metrics): write stream_metrics.json next to reasoning.json
+"""
+
+Event = namedtuple("Event", ["kind", "text", "usage"], defaults=[None, None])
+
+def usage(total_tokens=None, output_tokens=None, reasoning_tokens=None):
+    return {"total_tokens": total_tokens, "output_tokens": output_tokens, "reasoning_tokens": reasoning_tokens}
+
+# OpenAI Responses API stream
+def openai_responses(stream):
+    for event in stream:
+        if event.type == "response.reasoning_summary_text.delta":
+            yield Event("reasoning", event.delta)
+        elif event.type == "response.output_text.delta":
+            yield Event("text", event.delta)
+        elif event.type == "response.completed":
+            u = event.response.usage
+            yield Event("usage", usage=usage(u.total_tokens, u.output_tokens, u.output_tokens_details.reasoning_tokens))
+            break
+
+# OpenAI-compatible chat completions stream (stream_options include_usage: last chunk has the usage)
+def chat_completions(stream):
+    for chunk in stream:
+        if getattr(chunk, "usage", None) is not None:
+            u = chunk.usage
+            details = getattr(u, "completion_tokens_details", None)
+            yield Event("usage", usage=usage(u.total_tokens, u.completion_tokens, getattr(details, "reasoning_tokens", None)))
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        # OpenRouter: delta.reasoning, DashScope: delta.reasoning_content
+        reasoning = getattr(delta, "reasoning", None) or getattr(delta, "reasoning_content", None)
+        if reasoning:
+            yield Event("reasoning", reasoning)
+        if delta.content:
+            yield Event("text", delta.content)
+
+# Anthropic messages stream (raw events of messages.create(stream=True))
+def anthropic_messages(stream):
+    input_tokens, output_tokens = 0, 0
+    for event in stream:
+        if event.type == "message_start":
+            input_tokens = event.message.usage.input_tokens
+        elif event.type == "content_block_start" and event.content_block.type == "text":
+            # text blocks are separate answers (e.g. around web searches)
+            yield Event("text", "\n")
+        elif event.type == "content_block_delta":
+            if event.delta.type == "thinking_delta":
+                yield Event("reasoning", event.delta.thinking)
+            elif event.delta.type == "text_delta":
+                yield Event("text", event.delta.text)
+        elif event.type == "message_delta":
+            output_tokens = event.usage.output_tokens
+    yield Event("usage", usage=usage(input_tokens + output_tokens, output_tokens))
+
+# google.genai content stream (thought parts are reasoning, usage of the last chunk is final)
+def genai_content(stream):
+    last = None
+    for chunk in stream:
+        if chunk.usage_metadata is not None:
+            last = chunk.usage_metadata
+        if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+            continue
+        for part in chunk.candidates[0].content.parts:
+            if part.text:
+                yield Event("reasoning" if part.thought else "text", part.text)
+    if last is not None:
+        output_tokens = (last.candidates_token_count or 0) + (last.thoughts_token_count or 0)
+        yield Event("usage", usage=usage(last.total_token_count, output_tokens, last.thoughts_token_count))
+
+# consume events: reasoning text, answer text, usage and timing metrics
+def collect(events, t0, echo=True):
+    reasoning, text = [], []
+    final_usage = usage()
+    first_token = first_reasoning = None
+    last_kind = None
+    for event in events:
+        now = time.time()
+        if event.kind == "usage":
+            final_usage = event.usage
+            continue
+        # whitespace-only deltas (block separators) are not tokens
+        if event.text and event.text.strip():
+            if first_token is None:
+                first_token = now - t0
+            if event.kind == "reasoning" and first_reasoning is None:
+                first_reasoning = now - t0
+        (reasoning if event.kind == "reasoning" else text).append(event.text)
+        if echo:
+            if event.kind != last_kind:
+                print(f"\n[{event.kind}]")
+            print(event.text, end="", flush=True)
+        last_kind = event.kind
+    total = time.time() - t0
+    if echo:
+        print()
+
+    output_tokens = final_usage.get("output_tokens")
+    metrics = {
+        "ttft": first_token,
+        "ttfr": first_reasoning,
+        "time_total": total,
+        "output_tokens": output_tokens,
+        # generation rate after the first token
+        "tokens_per_s": output_tokens / (total - first_token) if output_tokens and first_token is not None and total > first_token else None,
+    }
+    print("Stream: " + ", ".join(f"{k} {v:.2f}" for k, v in metrics.items() if isinstance(v, float)))
+    return "".join(reasoning), "".join(text), final_usage, metrics
+
+# stream metrics of the reasoning call of a picture
+def save_metrics(output_dir, metrics):
+    with open(output_dir + "stream_metrics.json", "w", encoding="utf-8") as f:
+        json.dump(metrics, f, indent=2)
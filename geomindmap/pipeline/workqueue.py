@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+"""
+workqueue.py
+------------
+This module is a lease-based work queue in SQLite, so any number of worker processes on one
+or several machines can drain the same pipeline run without duplicating LLM work.
+Items are (model, picture file name, stage). A worker leases the next item whose earlier stages of
+the same (model, picture) are done, extends the lease with heartbeats while working, and
+records the result when done. Leases of crashed workers expire and the item is leased
+again; failing items are retried up to max_attempts. An item whose lease expired on its
+last attempt (e.g. the worker was killed every time) is marked failed, like a failing one.
+For several machines, put the queue file on a shared file system with working file locks
+(SQLite uses them for its transactions); the workers need no other coordination.
+
+Class:
+- WorkQueue(path, lease_seconds): queue store
+  - enqueue(models, pic_list, stages): add items (existing items are kept)
+  - lease(worker): lease the next ready item or None
+  - heartbeat(item, worker): extend a lease, False if it was lost
+  - complete(item, worker, result) / fail(item, worker, error): finish a leased item
+  - status(): item counts per status
+  - info(model): process info records aggregated from the results of done items
+
+Functions:
+- worker_id(): host name + process id
+- drain(path, handler, worker, stop_when_empty): lease and run items until the queue is empty
+"""
+
+QUEUE_PATH = "geomindmap/data/queue.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    model TEXT NOT NULL,
+    picture TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    seq INTEGER NOT NULL,           -- stage order within (model, picture)
+    status TEXT NOT NULL DEFAULT 'pending',   -- pending, leased, done, failed
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    updated REAL,
+    PRIMARY KEY (model, picture, stage)
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (status, lease_until);
+"""
+
+# host name + process id
+def worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+class WorkQueue:
+    def __init__(self, path=QUEUE_PATH, lease_seconds=600, max_attempts=3):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # autocommit mode, transactions are opened explicitly
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    # add items, keep existing ones (and their results)
+    def enqueue(self, models, pic_list, stages):
+        rows = [(model, pic, stage, seq)
+                for model in models for pic in pic_list for seq, stage in enumerate(stages)]
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO items (model, picture, stage, seq, updated) VALUES (?, ?, ?, ?, ?)",
+                                [row + (time.time(),) for row in rows])
+            added = self.db.total_changes - before
+            self.db.execute("COMMIT")
+        print(f"Queue {self.path}: {added} of {len(rows)} items added")
+        return added
+
+    # lease the next ready item: pending or expired, all earlier stages done
+    def lease(self, worker):
+        now = time.time()
+        with self.lock:
+            # BEGIN IMMEDIATE takes the write lock, so two workers never lease the same item
+            self.db.execute("BEGIN IMMEDIATE")
+            # expired on the last attempt: the worker never reached fail(), do not lease again
+            exhausted = self.db.execute("""
+                SELECT model, picture, stage FROM items
+                WHERE status = 'leased' AND lease_until < ? AND attempts >= ?
+            """, (now, self.max_attempts)).fetchall()
+            for key in exhausted:
+                self.db.execute("""
+                    UPDATE items SET status = 'failed', error = ?, lease_until = NULL, updated = ?
+                    WHERE model = ? AND picture = ? AND stage = ?
+                """, (f"lease expired on attempt {self.max_attempts} of {self.max_attempts}", now) + key)
+                self.fail_later_stages(key)
+            row = self.db.execute("""
+                SELECT model, picture, stage FROM items AS i
+                WHERE (status = 'pending' OR (status = 'leased' AND lease_until < ?))
+                AND NOT EXISTS (
+                    SELECT 1 FROM items AS e
+                    WHERE e.model = i.model AND e.picture = i.picture AND e.seq < i.seq AND e.status != 'done'
+                )
+                ORDER BY picture, model, seq LIMIT 1
+            """, (now,)).fetchone()
+            if row is not None:
+                self.db.execute("""
+                    UPDATE items SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ?
+                    WHERE model = ? AND picture = ? AND stage = ?
+                """, (worker, now + self.lease_seconds, now) + row)
+            self.db.execute("COMMIT")
+        return dict(zip(("model", "picture", "stage"), row)) if row else None
+
+    # extend the lease; False if the lease expired and another worker took the item
+    def heartbeat(self, item, worker):
+        now = time.time()
+        with self.lock:
+            cur = self.db.execute("""
+                UPDATE items SET lease_until = ?, updated = ?
+                WHERE model = ? AND picture = ? AND stage = ? AND status = 'leased' AND worker = ?
+            """, (now + self.lease_seconds, now, item["model"], item["picture"], item["stage"], worker))
+        return cur.rowcount == 1
+
+    # mark a leased item done with its result
+    def complete(self, item, worker, result=None):
+        with self.lock:
+            cur = self.db.execute("""
+                UPDATE items SET status = 'done', result = ?, error = NULL, lease_until = NULL, updated = ?
+                WHERE model = ? AND picture = ? AND stage = ? AND status = 'leased' AND worker = ?
+            """, (json.dumps(result), time.time(), item["model"], item["picture"], item["stage"], worker))
+        return cur.rowcount == 1
+
+    # release a failed item for retry, or mark it failed after max_attempts
+    def fail(self, item, worker, error):
+        key = (item["model"], item["picture"], item["stage"])
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            cur = self.db.execute("""
+                UPDATE items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                    error = ?, lease_until = NULL, updated = ?
+                WHERE model = ? AND picture = ? AND stage = ? AND status = 'leased' AND worker = ?
+            """, (self.max_attempts, str(error), time.time()) + key + (worker,))
+            released = cur.rowcount == 1
+            self.fail_later_stages(key)
+            self.db.execute("COMMIT")
+        return released
+
+    # later stages of a failed item can never run (inside the caller's transaction)
+    def fail_later_stages(self, key):
+        self.db.execute("""
+            UPDATE items SET status = 'failed', error = 'earlier stage failed', updated = ?
+            WHERE model = ? AND picture = ? AND status = 'pending' AND seq > (
+                SELECT seq FROM items WHERE model = ? AND picture = ? AND stage = ? AND status = 'failed'
+            )
+        """, (time.time(), key[0], key[1]) + key)
+
+    # item counts per status (expired leases counted as pending)
+    def status(self):
+        with self.lock:
+            rows = self.db.execute("""
+                SELECT CASE WHEN status = 'leased' AND lease_until < ? THEN 'pending' ELSE status END, COUNT(*)
+                FROM items GROUP BY 1
+            """, (time.time(),)).fetchall()
+        counts = {"pending": 0, "leased": 0, "done": 0, "failed": 0}
+        counts.update(dict(rows))
+        return counts
+
+    # process info per picture from the stage results of done items (see main.to_info)
+    def info(self, model):
+        with self.lock:
+            rows = self.db.execute("""
+                SELECT picture, stage, result FROM items WHERE model = ? AND status = 'done' ORDER BY picture, seq
+            """, (model,)).fetchall()
+        records = {}
+        for pic, stage, result in rows:
+            picture = os.path.splitext(pic)[0]
+            result = json.loads(result) if result else {}
+            r = records.setdefault(picture, {"picture": picture, "tokens_total": 0, "time_total": 0.0,
+                                             "tokens_response": 0, "tokens_reasoning": 0, "time_response": 0,
+                                             "accuracy": None, "stages": []})
+            r["stages"].append(stage)
+            for key in ("tokens_total", "time_total", "tokens_response", "tokens_reasoning", "time_response"):
+                r[key] += result.get(key) or 0
+            if result.get("accuracy") is not None:
+                r["accuracy"] = result["accuracy"]
+            if result.get("hash"):
+                r["hash"] = result["hash"]
+        return list(records.values())
+
+# lease and run items until the queue has no ready item left
+def drain(path, handler, worker=None, stop_when_empty=True, lease_seconds=600, poll=10):
+    """
+    handler(item) runs one item and returns its result (JSON serializable).
+    While the handler runs, a heartbeat thread extends the lease every lease_seconds / 3.
+    If only items blocked by leased earlier stages remain, the worker polls until they are
+    ready or the queue is finished.
+    """
+    worker = worker or worker_id()
+    queue = WorkQueue(path, lease_seconds)
+    done = 0
+    try:
+        while True:
+            item = queue.lease(worker)
+            if item is None:
+                counts = queue.status()
+                if counts["pending"] == 0 and counts["leased"] == 0 and stop_when_empty:
+                    break
+                time.sleep(poll)
+                continue
+
+            stop = threading.Event()
+            def beat():
+                while not stop.wait(lease_seconds / 3):
+                    if not queue.heartbeat(item, worker):
+                        print(f"{worker}: lost lease of {item}")
+                        return
+            thread = threading.Thread(target=beat, daemon=True)
+            thread.start()
+            try:
+                result = handler(item)
+            except Exception as e:
+                stop.set()
+                queue.fail(item, worker, e)
+                print(f"{worker}: {item} failed: {e}")
+                continue
+            stop.set()
+            thread.join()
+            if queue.complete(item, worker, result):
+                done += 1
+            else:
+                print(f"{worker}: lease of {item} expired before completion, result dropped")
+    finally:
+        queue.close()
+    print(f"{worker}: queue drained, {done} items done")
+    return done
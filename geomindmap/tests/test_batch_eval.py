@@ -0,0 +1,92 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import batch_eval
+import reasoning
+import routing
+
+
+def test_batches():
+    pics = [f"pic{i}.png" for i in range(1, 8)]
+    assert batch_eval.batches(pics, 3) == [pics[0:3], pics[3:6], pics[6:7]]
+    assert batch_eval.batches(pics, 10) == [pics]
+    assert batch_eval.batches([], 3) == []
+
+
+def test_valid_output():
+    assert batch_eval.valid_output("step_accuracy", [{"step": 1, "accuracy": 1}])
+    assert not batch_eval.valid_output("step_accuracy", [])
+    assert not batch_eval.valid_output("step_accuracy", [{"step": 1}])
+    assert batch_eval.valid_output("pattern", {"Breadth-First": [], "Depth-First": []})
+    assert not batch_eval.valid_output("pattern", [{"Breadth-First": []}])
+
+
+@pytest.fixture
+def data(monkeypatch, tmp_path):
+    """
+    Three pictures with reasoning traces and ground truth. routing.create answers with the
+    text in answers (no LLM), the unbatched step_accuracy records the pictures it evaluates.
+    """
+    gps_path = tmp_path / "gps.json"
+    gps_path.write_text(json.dumps({f"pic{i}.png": {"COUNTRY": "France", "CITY": "Paris", "STREET": f"Rue {i}"} for i in range(1, 4)}))
+    for i in range(1, 4):
+        os.makedirs(tmp_path / "m" / f"pic{i}")
+        (tmp_path / "m" / f"pic{i}" / "reasoning.json").write_text(json.dumps([{"step": 1, "text": f"trace {i}"}]))
+    monkeypatch.setattr(batch_eval, "DATA_DIR", str(tmp_path) + "/")
+    monkeypatch.setattr(batch_eval, "GPS_PATH", str(gps_path))
+
+    state = SimpleNamespace(answers=[], requests=[], unbatched=[])
+    def create(stage, input, expect_json=False, **kwargs):
+        state.requests.append((stage, input[-1]["content"][0]["text"]))
+        return SimpleNamespace(output_text=state.answers.pop(0), usage=SimpleNamespace(total_tokens=90))
+    def step_accuracy(reasoning_path, ground_truth_path, pic, output_dir, ground_truth=None):
+        state.unbatched.append(pic)
+        with open(output_dir + "step_acc.json", "w", encoding="utf-8") as f:
+            json.dump([{"step": 1, "accuracy": 0}], f)
+        return 0, 40
+    monkeypatch.setattr(routing, "create", create)
+    monkeypatch.setattr(reasoning, "step_accuracy", step_accuracy)
+    state.dir = tmp_path
+    return state
+
+
+# the answer is split per picture, a malformed picture is evaluated again on its own
+def test_run_splits_answer_and_falls_back(data):
+    data.answers = [json.dumps({
+        "pic1": [{"step": 1, "accuracy": 1}, {"step": 2, "accuracy": 1}],
+        "pic2": {"accuracy": 1},
+        "pic3": [{"step": 1, "accuracy": 0}],
+        "pic9": [{"step": 1, "accuracy": 1}],
+    })]
+    results = batch_eval.run("step_accuracy", ["pic1.png", "pic2.png", "pic3.png"], "m", batch_size=3,
+                             ground_truth_path=batch_eval.GPS_PATH)
+
+    [(stage, text)] = data.requests
+    items = json.loads(text.split(":", 1)[1])
+    assert stage == "step_accuracy" and sorted(items) == ["pic1", "pic2", "pic3"]
+    assert items["pic1"]["ground_truth"] == "country: France, city: Paris, street: Rue 1"
+    assert data.unbatched == ["pic2.png"]
+    assert results == {"pic1.png": (1, 30), "pic2.png": (0, 40), "pic3.png": (0, 30)}
+    with open(data.dir / "m" / "pic1" / "step_acc.json", encoding="utf-8") as f:
+        assert json.load(f)[-1] == {"step": 2, "accuracy": 1}
+
+
+# an answer that is no JSON object at all sends every picture of the batch to the fallback
+def test_run_falls_back_on_malformed_answer(data):
+    # the second answer is the reply of the fix_json request
+    data.answers = ["[1, 2", "[1, 2"]
+    results = batch_eval.run("step_accuracy", ["pic1.png", "pic2.png"], "m", batch_size=2,
+                             ground_truth_path=batch_eval.GPS_PATH)
+    assert [stage for stage, _ in data.requests] == ["step_accuracy", "fix_json"]
+    assert sorted(data.unbatched) == ["pic1.png", "pic2.png"]
+    assert results == {"pic1.png": (0, 40), "pic2.png": (0, 40)}
+
+
+# a batch of one picture is sent unbatched, without the batch framing
+def test_single_picture_batch_is_unbatched(data):
+    results = batch_eval.run("step_accuracy", ["pic3.png"], "m", batch_size=5, ground_truth_path=batch_eval.GPS_PATH)
+    assert data.requests == [] and data.unbatched == ["pic3.png"]
+    assert results == {"pic3.png": (0, 40)}
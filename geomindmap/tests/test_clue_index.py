@@ -0,0 +1,36 @@
+import numpy as np
+import clue_index
+
+NAMES = ["license plate", "license plates", "licence plate", "German license plate", "Irish license plate",
+         "columns", "column", "Doric columns", "Ionic columns", "square", "town square", "square tower",
+         "inscription MCMXXI", "inscription MCMXXXI", "traffic sign", "traffic signal"]
+
+
+def make_index():
+    counts = {name: len(NAMES) - i for i, name in enumerate(NAMES)}
+    return clue_index.ClueIndex(NAMES, counts, min_df=1)
+
+
+# spellings are merged, modifiers, derived words and numerals keep their own clue
+def test_cluster_does_not_merge_modifier_variants():
+    clusters = clue_index.cluster(make_index(), threshold=0.5)
+    assert sorted(clusters["license plate"]) == ["licence plate", "license plate", "license plates"]
+    assert sorted(clusters["columns"]) == ["column", "columns"]
+    for name in ("German license plate", "Irish license plate", "Doric columns", "Ionic columns",
+                 "town square", "square tower", "inscription MCMXXXI", "traffic signal"):
+        assert name in clusters, name
+    assert clusters["square"] == ["square"]
+
+
+# sparse pairs and nearest() agree with the dense cosine matrix
+def test_sparse_products_match_dense():
+    index = make_index()
+    X = np.zeros((len(index.names), len(index.vocab)), dtype=np.float32)
+    for i in range(len(index.names)):
+        span = slice(index.indptr[i], index.indptr[i + 1])
+        X[i, index.indices[span]] = index.data[span]
+    S = X @ X.T
+    dense = {(i, j) for i, j in zip(*np.nonzero(S >= 0.5)) if i < j}
+    assert {tuple(p) for p in index.similar_pairs(0.5, batch=5)} == dense
+    name, similarity = index.nearest("licence plates", k=1)[0]
+    assert name in ("license plates", "licence plate") and similarity > 0.5
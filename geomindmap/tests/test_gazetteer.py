@@ -0,0 +1,50 @@
+import json
+import os
+
+import gazetteer
+
+
+def write_l_map(data_dir, model, pic, nodes):
+    os.makedirs(data_dir / model / pic, exist_ok=True)
+    with open(data_dir / model / pic / "l_map_info.json", "w", encoding="utf-8") as f:
+        json.dump(nodes, f)
+
+
+# spelling, accents, a leading "the" and aliases resolve to the bundled name
+def test_lookup_normalizes_names_and_aliases():
+    gaz = gazetteer.load_gazetteer(learned_path=None)
+    assert gazetteer.lookup(gaz, "PARIS") == "Paris"
+    assert gazetteer.lookup(gaz, "the Ile-de-France") == "Île-de-France"
+    assert gazetteer.lookup(gaz, "Holland") == "Netherlands"
+    assert gazetteer.lookup(gaz, "Atlantis") is None
+    assert gazetteer.ancestors(gaz, "Paris") == ["Île-de-France", "France", "Europe"]
+
+
+# parents are the nearest ancestor named in the same picture, unknown names go to the LLM
+def test_resolve_uses_nearest_named_ancestor():
+    gaz = gazetteer.load_gazetteer(learned_path=None)
+    resolved, unknown = gazetteer.resolve(["Europe", "Paris", "Rue Mouffetard"], gaz)
+    assert resolved == [
+        {"entity": "Europe", "granularity": 1, "parent": None},
+        {"entity": "Paris", "granularity": 4, "parent": "Europe"},
+    ]
+    assert unknown == ["Rue Mouffetard"]
+
+
+# names with a consistent answer in enough pictures are learned, disputed ones are not
+def test_learn_keeps_consistent_answers(tmp_path):
+    street = {"entity": "Rue Mouffetard", "granularity": 5, "parent": "paris"}
+    write_l_map(tmp_path, "m1", "pic1", [street, {"entity": "Quartier X", "granularity": 4, "parent": "Paris"}])
+    write_l_map(tmp_path, "m2", "pic1", [street, {"entity": "Quartier X", "granularity": 5, "parent": "Paris"}])
+    write_l_map(tmp_path, "m1", "pic2", [{"entity": "Paris", "granularity": 2, "parent": None}])
+    learned_path = str(tmp_path / "learned.json")
+
+    assert gazetteer.learn(str(tmp_path), learned_path) == 1
+    with open(learned_path, encoding="utf-8") as f:
+        places = json.load(f)["places"]
+    # parents are stored under their bundled name, bundled places are never relearned
+    assert places == {"Rue Mouffetard": {"granularity": 5, "parent": "Paris", "votes": 2}}
+
+    gaz = gazetteer.load_gazetteer(learned_path=learned_path)
+    assert gazetteer.lookup(gaz, "rue mouffetard") == "Rue Mouffetard"
+    assert gazetteer.ancestors(gaz, "Rue Mouffetard")[0] == "Paris"
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+import hedging
+
+
+@pytest.fixture(autouse=True)
+def config(monkeypatch, tmp_path):
+    # no history on disk, hedging off unless a test asks for it
+    monkeypatch.setattr(hedging, "HEDGE_PERCENTILE", None)
+    monkeypatch.setattr(hedging, "STAGE_DEADLINES", {})
+    monkeypatch.setattr(hedging, "IMAGE_DEADLINE", None)
+    monkeypatch.setattr(hedging, "INFO_GLOB", str(tmp_path / "{model}" / "*.json*"))
+    monkeypatch.setattr(hedging, "TRACE_PATH", str(tmp_path / "trace.jsonl"))
+    monkeypatch.setattr(hedging, "_history", {})
+    monkeypatch.setattr(hedging, "MIN_DELAY", 0.0)
+    monkeypatch.setattr(hedging, "stats", dict.fromkeys(hedging.stats, 0))
+
+
+def test_parse_config():
+    assert hedging.parse_deadlines("600") == {"*": 600.0}
+    assert hedging.parse_deadlines("reasoning=900, match=300") == {"reasoning": 900.0, "match": 300.0}
+    assert hedging.parse_deadlines(None) == {}
+    assert hedging.parse_percentile("off") is None
+    assert hedging.parse_percentile("90") == 90.0
+    with pytest.raises(ValueError):
+        hedging.parse_percentile("100")
+
+
+# no duplicate without an opt-in percentile or before MIN_SAMPLES latencies are known
+def test_hedge_delay_needs_opt_in_and_history():
+    key = "split/o4-mini"
+    for _ in range(hedging.MIN_SAMPLES - 1):
+        hedging.observe(key, 1.0)
+    assert hedging.hedge_delay(key) is None
+    assert hedging.hedge_delay(key, percentile=90) is None
+    hedging.observe(key, 11.0)
+    assert hedging.hedge_delay(key) is None
+    assert hedging.hedge_delay(key, percentile=50) == 1.0
+    assert hedging.hedge_delay(key, percentile=99) > 1.0
+
+
+# a call still running at the stage deadline raises StageTimeout
+def test_stage_deadline_raises_stage_timeout(monkeypatch):
+    monkeypatch.setattr(hedging, "STAGE_DEADLINES", hedging.parse_deadlines("split=0.1"))
+    release = threading.Event()
+    start = time.time()
+    with hedging.stage("split"):
+        with pytest.raises(hedging.StageTimeout) as e:
+            hedging.run("split/o4-mini", lambda i: release.wait(5))
+    release.set()
+    assert e.value.stage == "split"
+    assert time.time() - start < 2
+    # other stages have no limit
+    with hedging.stage("match"):
+        assert hedging.run("match/o4-mini", lambda i: "done") == "done"
+
+
+# a picture whose time is up times out at the start of its next stage
+def test_image_deadline_cuts_stage():
+    with pytest.raises(hedging.StageTimeout):
+        with hedging.stage("match", image_end=time.time() - 1):
+            pass
+
+
+# a slow original gets one duplicate after the hedge delay, the first result wins
+def test_duplicate_wins():
+    key = "extract_entity/o4-mini"
+    for _ in range(hedging.MIN_SAMPLES):
+        hedging.observe(key, 0.05)
+    release = threading.Event()
+    attempts = []
+    def attempt(i):
+        attempts.append(i)
+        if i == 0:
+            release.wait(5)
+            return "original"
+        return "duplicate"
+    assert hedging.run(key, attempt, percentile=90) == "duplicate"
+    release.set()
+    assert attempts == [0, 1]
+    assert hedging.stats["hedged"] == hedging.stats["hedge_won"] == 1
+
+
+# errors before a duplicate was started are raised at once
+def test_failure_without_hedging_raises():
+    def attempt(i):
+        raise RuntimeError("provider error")
+    with pytest.raises(RuntimeError):
+        hedging.run("fix_json/o4-mini", attempt)
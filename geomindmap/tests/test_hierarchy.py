@@ -0,0 +1,63 @@
+import hierarchy
+
+
+def node(entity, granularity, parent=None):
+    return {"entity": entity, "granularity": granularity, "parent": parent}
+
+
+def parents(nodes):
+    return {n["entity"]: n["parent"] for n in nodes}
+
+
+# a valid tree is returned unchanged, without repairs
+def test_repair_keeps_valid_tree():
+    nodes = [node("Germany", 2), node("Koblenz", 4, "Germany"), node("Mehlgasse", 5, "Koblenz")]
+    fixed, repairs = hierarchy.repair(nodes)
+    assert fixed == nodes and repairs == []
+    assert hierarchy.validate(nodes) == []
+
+
+# duplicates, null parents, plural and own parents, invalid granularity
+def test_repair_fields_and_parents():
+    nodes = [
+        node("tall residential building", 2),
+        node("balcony", 3, "tall residential buildings"),
+        node("balcony", 4, "window"),
+        node("window", 3, "window"),
+        node("roof", None, "tall residential building"),
+        node("sky", 1, "None"),
+        node("tree", 3, "forest"),
+        "not a node",
+    ]
+    fixed, repairs = hierarchy.repair(nodes)
+    assert [n["entity"] for n in fixed] == ["tall residential building", "balcony", "window", "roof", "sky", "tree"]
+    assert parents(fixed) == {
+        "tall residential building": None, "balcony": "tall residential building", "window": None,
+        "roof": "tall residential building", "sky": None, "tree": None,
+    }
+    # a missing granularity comes from the parent
+    assert fixed[3]["granularity"] == 3
+    issues = {(r["entity"], r["issue"].split(" '")[0]) for r in repairs}
+    assert issues >= {
+        ("not a node", "invalid node"), ("balcony", "duplicate entity"), ("window", "node is its own parent"),
+        ("balcony", "parent"), ("tree", "parent"), ("roof", "invalid granularity None"),
+    }
+    assert nodes[1]["parent"] == "tall residential buildings"
+
+
+# cycles are cut above their coarsest node, children finer than parents
+def test_repair_cycles_and_granularity_order():
+    nodes = [
+        node("a", 3, "c"), node("b", 2, "a"), node("c", 4, "b"),
+        node("city", 4), node("district", 3, "city"), node("country", 2), node("region", 3, "country"),
+        node("town", 3, "region"),
+    ]
+    fixed, repairs = hierarchy.repair(nodes)
+    # b is the coarsest node of the cycle a -> c -> b -> a, a moves up to the coarser b
+    assert parents(fixed) == {
+        "a": "b", "b": None, "c": "b",
+        "city": None, "district": None, "country": None, "region": "country", "town": "country",
+    }
+    granularity = {n["entity"]: n["granularity"] for n in fixed}
+    assert all(granularity[n["parent"]] < n["granularity"] for n in fixed if n["parent"])
+    assert repairs[0] == {"entity": "b", "issue": "parent cycle a -> c -> b -> a", "action": "made root"}
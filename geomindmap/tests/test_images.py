@@ -0,0 +1,61 @@
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+import images
+
+
+def gradient(path, size=(64, 48), shift=0):
+    x = np.linspace(0, 255, size[0])
+    y = np.linspace(0, 255, size[1])[:, None]
+    Image.fromarray(((x + y) / 2 + shift).clip(0, 255).astype(np.uint8)).save(path)
+
+
+# index.json holds no file times; a touched file stays unchanged, new content is changed
+def test_scan_ignores_mtime(tmp_path):
+    gradient(tmp_path / "pic1.png")
+    gradient(tmp_path / "pic2.png", shift=40)
+    _, diff = images.scan(str(tmp_path))
+    assert diff["new"] == ["pic1.png", "pic2.png"]
+    with open(tmp_path / "index.json", encoding="utf-8") as f:
+        assert all("mtime" not in e for e in json.load(f))
+
+    # a checkout sets new mtimes
+    os.utime(tmp_path / "pic1.png", (1, 1))
+    gradient(tmp_path / "pic2.png", shift=80)
+    _, diff = images.scan(str(tmp_path))
+    assert diff["unchanged"] == ["pic1.png"] and diff["changed"] == ["pic2.png"]
+
+    # a fresh clone has no local cache: files are hashed again, nothing counts as changed
+    os.remove(tmp_path / "index_cache.json")
+    _, diff = images.scan(str(tmp_path))
+    assert diff["unchanged"] == ["pic1.png", "pic2.png"]
+
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+# resized, recompressed and slightly brighter copies keep their perceptual hash, other pictures do not
+def test_phash_near_duplicates(tmp_path):
+    rng = np.random.default_rng(0)
+    scene = Image.fromarray(rng.integers(0, 256, (48, 64), dtype=np.uint8)).resize((640, 480), Image.BILINEAR)
+    scene.save(tmp_path / "pic1.png")
+    scene.resize((320, 240)).save(tmp_path / "pic2.jpg", quality=70)
+    Image.fromarray((np.asarray(scene, dtype=np.int16) + 12).clip(0, 255).astype(np.uint8)).save(tmp_path / "pic3.png")
+    Image.fromarray(rng.integers(0, 256, (48, 64), dtype=np.uint8)).resize((640, 480), Image.BILINEAR).save(tmp_path / "pic4.png")
+
+    hashes = {name: images.phash(str(tmp_path / name)) for name in ("pic1.png", "pic2.jpg", "pic3.png", "pic4.png")}
+    assert all(len(h) == 16 for h in hashes.values())
+    assert hamming(hashes["pic1.png"], hashes["pic2.jpg"]) <= images.PHASH_THRESHOLD
+    assert hamming(hashes["pic1.png"], hashes["pic3.png"]) <= images.PHASH_THRESHOLD
+    assert hamming(hashes["pic1.png"], hashes["pic4.png"]) > images.PHASH_THRESHOLD
+
+    entries = [{"file": name, "phash": h} for name, h in hashes.items()] + [{"file": "pic5.png"}, "pic6.png"]
+    pairs = images.near_duplicates(entries)
+    assert [(a, b) for a, b, _ in pairs] == [("pic1.png", "pic2.jpg"), ("pic1.png", "pic3.png"), ("pic2.jpg", "pic3.png")]
+    assert all(d == hamming(hashes[a], hashes[b]) for a, b, d in pairs)
+    assert images.near_duplicates(entries, threshold=-1) == []
+    assert images.near_duplicates(entries[:1]) == []
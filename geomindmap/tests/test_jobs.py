@@ -0,0 +1,12 @@
+import jobs
+
+
+# a long-running server keeps only the last max_finished finished jobs
+def test_finished_jobs_are_evicted(tmp_path):
+    pool = jobs.JobPool(workers=1, picture_dir=str(tmp_path), max_finished=2)
+    for i in range(4):
+        pool.jobs[f"j{i}"] = {"status": "done", "finished": 100.0 + i}
+    pool.jobs["running"] = {"status": "running", "finished": None}
+    pool.evict()
+    assert sorted(pool.jobs) == ["j2", "j3", "running"]
+    pool.close()
@@ -0,0 +1,59 @@
+import json
+import location_tree
+import gazetteer
+
+HAMBURG = [
+    {"entity": "Europe", "granularity": 1, "parent": None},
+    {"entity": "Germany", "granularity": 2, "parent": "Europe"},
+    {"entity": "Hamburg", "granularity": 4, "parent": "Germany"},
+    {"entity": "St. Pauli", "granularity": 5, "parent": "Hamburg"},
+]
+
+
+def write_picture(data_dir, model, pic, nodes):
+    pic_dir = data_dir / model / pic
+    pic_dir.mkdir(parents=True)
+    (pic_dir / "l_map_info.json").write_text(json.dumps(nodes))
+
+
+# a name learned between two updates keeps its key: no second node at a new angle
+def test_update_stable_across_learn(tmp_path, monkeypatch):
+    # load_gazetteer() reads the learned entries from the relative LEARNED_PATH
+    monkeypatch.chdir(tmp_path)
+    data_dir = tmp_path / "geomindmap" / "data"
+    tree_path = str(tmp_path / "tree.json")
+    write_picture(data_dir, "claude", "pic1", HAMBURG)
+    write_picture(data_dir, "gemini", "pic1", HAMBURG)
+    tree = location_tree.update(str(data_dir) + "/", tree_path)
+    angle = tree["nodes"]["st pauli"]["angle"]
+
+    assert gazetteer.learn(str(data_dir) + "/", gazetteer.LEARNED_PATH) >= 1
+    assert gazetteer.lookup(gazetteer.load_gazetteer(), "st pauli") == "St. Pauli"
+    write_picture(data_dir, "claude", "pic2", HAMBURG)
+    tree = location_tree.update(str(data_dir) + "/", tree_path)
+
+    assert [k for k in tree["nodes"] if gazetteer.normalize(k) == "st pauli"] == ["st pauli"]
+    assert tree["nodes"]["st pauli"]["angle"] == angle
+
+
+# a full parent is rebalanced on its own: nodes outside its subtree keep their angles
+def test_rebalance_moves_only_the_full_subtree():
+    gaz = gazetteer.load_gazetteer(learned_path=None)
+    tree = location_tree.empty_tree()
+    location_tree.insert(tree, HAMBURG[:3], "a/pic1", gaz)
+    location_tree.insert(tree, [HAMBURG[0], {"entity": "France", "granularity": 2, "parent": "Europe"}], "a/pic2", gaz)
+    outside = {k: tree["nodes"][k]["angle"] for k in ("europe", "germany", "france")}
+
+    moved = set()
+    districts = [{"entity": f"District {i}", "granularity": 5, "parent": "Hamburg"} for i in range(12)]
+    location_tree.insert(tree, HAMBURG[:3] + districts, "a/pic3", gaz, moved)
+
+    assert moved and moved <= set(location_tree.descendants(tree, "hamburg"))
+    assert tree["rebalances"][-1]["parent"] == "hamburg"
+    assert {k: tree["nodes"][k]["angle"] for k in outside} == outside
+    children = tree["nodes"]["hamburg"]["children"]
+    assert len(children) == 12
+    node = tree["nodes"]["hamburg"]
+    assert all(node["lo"] <= tree["nodes"][c]["lo"] < tree["nodes"][c]["hi"] <= node["hi"] for c in children)
+    gap, _ = location_tree.min_sibling_gap(tree)
+    assert gap >= location_tree.MIN_SIBLING_GAP
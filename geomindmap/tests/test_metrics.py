@@ -0,0 +1,54 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import gazetteer
+import metrics
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+# scalars and arrays give the same great-circle distances
+def test_haversine_scalars_and_arrays():
+    assert metrics.haversine(48.86, 2.35, 48.86, 2.35) == 0
+    # a quarter of the equator and pole to pole
+    assert metrics.haversine(0, 0, 0, 90) == pytest.approx(np.pi / 2 * metrics.EARTH_RADIUS_KM)
+    assert metrics.haversine(90, 0, -90, 0) == pytest.approx(np.pi * metrics.EARTH_RADIUS_KM)
+    # Paris - London is about 344 km
+    errors = metrics.haversine(np.array([48.8566, np.nan]), np.array([2.3522, 0.0]), 51.5074, -0.1278)
+    assert errors[0] == pytest.approx(343.5, abs=1)
+    assert np.isnan(errors[1])
+
+
+# the finest part of a comma-separated location known to the gazetteer wins
+def test_locate_finest_known_part():
+    gaz = gazetteer.load_gazetteer(learned_path=None)
+    assert metrics.locate(gaz, "Rue Mouffetard, Paris, France") == (48.86, 2.35)
+    assert metrics.locate(gaz, "Atlantis") is None
+    assert metrics.locate(gaz, None) is None
+
+
+# per-step errors, unresolved steps as null, pictures without ground truth skipped
+def test_geo_error(tmp_path, monkeypatch):
+    # load_gazetteer reads the learned entries relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    gps_path = str(tmp_path / "gps.json")
+    write_json(gps_path, {"pic1.png": {"GPS": {"lat": 48.86, "lon": 2.35}}})
+    write_json(str(tmp_path / "data/m1/pic1/step_acc.json"),
+               [{"location": "France"}, {"location": "Atlantis"}, {"location": "Paris, France"}])
+    write_json(str(tmp_path / "data/m1/pic2/step_acc.json"), [{"location": "Paris"}])
+
+    result = metrics.geo_error(str(tmp_path / "data"), gps_path)["m1"]
+    errors = result["pictures"]["pic1"]
+    assert list(result["pictures"]) == ["pic1"]
+    assert errors[0] > 0 and errors[1] is None and errors[2] == 0
+    assert result["final"] == {**result["final"], "count": 1, "resolved": 1, "p50_km": 0.0, "within_1km": 1.0}
+    assert result["all_steps"]["count"] == 3 and result["all_steps"]["resolved"] == 2
+    assert [c["pictures"] for c in result["curve"]] == [1, 0, 1]
+    assert os.path.exists(tmp_path / "data/m1/info/geo_error.json")
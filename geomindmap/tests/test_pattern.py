@@ -0,0 +1,17 @@
+import numpy as np
+import pattern
+
+
+# no pictures with pipeline outputs: empty report instead of np.vstack([]) raising
+def test_detect_pattern_local_without_pictures(tmp_path):
+    (tmp_path / "claude").mkdir()
+    assert pattern.detect_pattern_local(str(tmp_path) + "/", ["claude"]) == {}
+
+
+# fit() recovers the direction of a separable rule on raw (unstandardized) features
+def test_fit_separable_labels():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(400, 3)) * [1.0, 10.0, 0.1] + [0.0, 5.0, 0.0]
+    y = X[:, 0] + 0.1 * (X[:, 1] - 5.0) > 0
+    weights, bias = pattern.fit(X, y, l2=0.1)
+    assert ((X @ weights + bias > 0) == y).mean() > 0.95
@@ -0,0 +1,95 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import hedging
+import routing
+import runlog
+
+
+def call(stage, input_chars, model, effort, latency, tokens, image=False, **extra):
+    return {"stage": stage, "input_chars": input_chars, "image": image, "model": model, "effort": effort,
+            "latency": latency, "tokens": tokens, **extra}
+
+
+# the first matching rule wins; stage, size limit and image decide
+def test_route_policies():
+    assert routing.DEFAULT_POLICY == "baseline"
+    for stage in routing.STAGES:
+        assert routing.route(stage, 10 ** 6, policy="baseline") == ("o4-mini", "medium")
+    assert routing.route("fix_json", 8000, policy="latency") == ("gpt-4.1-mini", None)
+    assert routing.route("fix_json", 8001, policy="latency") == ("o4-mini", "medium")
+    assert routing.route("vi_map", 100, policy="latency") == ("o4-mini", "low")
+    assert routing.route("l_map", 100, policy="latency") == ("o4-mini", "medium")
+
+
+def test_route_image_rules_and_unknown_policy(monkeypatch, tmp_path):
+    path = tmp_path / "policies.json"
+    path.write_text(json.dumps({"vision": [
+        {"stage": "pattern", "image": True, "model": "gpt-4.1", "effort": None},
+        {"stage": "pattern", "model": "gpt-4.1-mini", "effort": None},
+    ]}))
+    monkeypatch.setattr(routing, "POLICIES", dict(routing.POLICIES))
+    assert "vision" in routing.load_policies(str(path))
+    assert routing.route("pattern", 10, has_image=True, policy="vision") == ("gpt-4.1", None)
+    assert routing.route("pattern", 10, has_image=False, policy="vision") == ("gpt-4.1-mini", None)
+    with pytest.raises(ValueError):
+        routing.route("split", 10, policy="vision")
+    with pytest.raises(ValueError):
+        routing.set_policy("no-such-policy")
+
+
+def test_measure_counts_text_and_images():
+    messages = [
+        {"role": "system", "content": "abc"},
+        {"role": "user", "content": [{"type": "input_text", "text": "hello"}, {"type": "input_image", "image_url": "x"}]},
+    ]
+    assert routing.measure(messages) == (8, True)
+    assert routing.measure([{"role": "user", "content": "hi"}]) == (2, False)
+
+
+# costs are fitted per (model, effort) and summed over the calls each policy would make
+def test_replay_estimates_policies(tmp_path):
+    trace_path = str(tmp_path / "trace.jsonl")
+    with runlog.RunLog(trace_path) as log:
+        for chars in (1000, 2000, 3000):
+            log.append(call("fix_json", chars, "o4-mini", "medium", latency=chars / 100, tokens=chars, valid_json=True))
+            log.append(call("fix_json", chars, "gpt-4.1-mini", None, latency=chars / 1000, tokens=chars // 2, valid_json=chars < 3000))
+        log.append(call("vi_map", 1000, "o4-mini", "medium", latency=10.0, tokens=1000))
+
+    report = routing.replay(trace_path, ["baseline", "latency"])
+    # every call on o4-mini at medium effort: latency = chars / 100, tokens = chars
+    assert report["baseline"]["latency"] == pytest.approx(2 * (10 + 20 + 30) + 10, abs=0.01)
+    assert report["baseline"]["tokens"] == 2 * 6000 + 1000
+    assert report["baseline"]["unobserved"] == 0
+    # fix_json moves to gpt-4.1-mini, vi_map to o4-mini at low effort, never seen in the trace
+    assert report["latency"]["stages"]["fix_json"]["latency"] == pytest.approx(2 * (1 + 2 + 3), abs=0.01)
+    assert report["latency"]["stages"]["fix_json"]["tokens"] == 2 * 3000
+    assert report["latency"]["stages"]["vi_map"] == {"calls": 1, "latency": 0.0, "tokens": 0, "unobserved": 1}
+    assert report["observed"]["gpt-4.1-mini/None"] == {"calls": 3, "valid_json": pytest.approx(2 / 3)}
+    assert routing.replay(str(tmp_path / "empty.jsonl")) == {}
+
+
+# a routed call is traced with its model, effort and JSON validity; nothing leaves the process
+def test_create_records_trace(monkeypatch, tmp_path):
+    sent = []
+    def fake_create(**kwargs):
+        sent.append(kwargs)
+        usage = SimpleNamespace(total_tokens=30, output_tokens=10, output_tokens_details=SimpleNamespace(reasoning_tokens=4))
+        return SimpleNamespace(output_text='{"ok": true}', usage=usage)
+    client = SimpleNamespace(responses=SimpleNamespace(create=fake_create))
+    monkeypatch.setattr(routing.providers, "get_client", lambda name: client)
+    monkeypatch.setattr(routing, "TRACE_PATH", str(tmp_path / "trace.jsonl"))
+    monkeypatch.setattr(hedging, "HEDGE_PERCENTILE", None)
+    monkeypatch.setattr(hedging, "TRACE_PATH", str(tmp_path / "trace.jsonl"))
+    monkeypatch.setattr(hedging, "_history", {})
+    monkeypatch.setattr(routing, "_policy", "latency")
+    monkeypatch.setattr(routing, "_trace", None)
+
+    routing.create("fix_json", [{"role": "user", "content": "x" * 50}], expect_json=True, reasoning={"effort": "high"})
+    assert sent[0]["model"] == "gpt-4.1-mini" and "reasoning" not in sent[0]
+    routing._trace.close()
+    [entry] = runlog.read_log(str(tmp_path / "trace.jsonl"))
+    assert entry["stage"] == "fix_json" and entry["policy"] == "latency" and entry["effort"] is None
+    assert entry["input_chars"] == 50 and entry["valid_json"] is True and entry["reasoning_tokens"] == 4
@@ -0,0 +1,16 @@
+import os
+import runlog
+
+
+# later runs win by the run ID in the name, whatever the file modification times
+def test_run_order_uses_run_id_timestamp(tmp_path):
+    names = ["pic1_to_pic9_20250102-080000-7.json", "pic1_to_pic9_20241231-235959-99.jsonl",
+             "pic10_to_pic162.json", "service_20250101-120000-3.jsonl"]
+    for i, name in enumerate(names):
+        path = tmp_path / name
+        path.write_text("[]")
+        # newest mtime on the oldest run
+        os.utime(path, (1000 - i, 1000 - i))
+    ordered = [os.path.basename(p) for p in sorted((str(tmp_path / n) for n in names), key=runlog.run_order)]
+    assert ordered == ["pic10_to_pic162.json", "pic1_to_pic9_20241231-235959-99.jsonl",
+                       "service_20250101-120000-3.jsonl", "pic1_to_pic9_20250102-080000-7.json"]
@@ -0,0 +1,39 @@
+import time
+import workqueue
+
+
+def make_queue(tmp_path, lease_seconds, max_attempts=2):
+    queue = workqueue.WorkQueue(str(tmp_path / "queue.sqlite"), lease_seconds, max_attempts)
+    queue.enqueue(["claude"], ["pic1.png"], ["reasoning", "extract"])
+    return queue
+
+
+# a worker killed on every attempt never calls fail(): the item must still stop after max_attempts
+def test_expired_lease_on_last_attempt_fails_item(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.05)
+    for _ in range(2):
+        item = queue.lease("w1")
+        assert item == {"model": "claude", "picture": "pic1.png", "stage": "reasoning"}
+        # crash: no heartbeat, no complete / fail
+        time.sleep(0.1)
+    assert queue.lease("w2") is None
+    rows = {stage: (status, error) for stage, status, error in
+            queue.db.execute("SELECT stage, status, error FROM items").fetchall()}
+    assert rows["reasoning"][0] == "failed"
+    assert "lease expired" in rows["reasoning"][1]
+    # the failure cascades to the later stages, like fail()
+    assert rows["extract"] == ("failed", "earlier stage failed")
+    assert queue.status() == {"pending": 0, "leased": 0, "done": 0, "failed": 2}
+    queue.close()
+
+
+# an expired lease with attempts left is leased again
+def test_expired_lease_with_attempts_left_is_released(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.05, max_attempts=3)
+    queue.lease("w1")
+    time.sleep(0.1)
+    item = queue.lease("w2")
+    assert item["stage"] == "reasoning"
+    assert queue.complete(item, "w2", {"tokens_total": 1})
+    assert queue.lease("w2")["stage"] == "extract"
+    queue.close()